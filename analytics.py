@@ -0,0 +1,184 @@
+# analytics.py
+
+import logging
+
+import numpy as np
+
+from database import NUM_LANDMARKS, STORAGE_LANDMARKS, SUMMARY_COUNTS, summarize_landmarks
+
+
+def analytics_settings(config):
+    """
+    Read the analytics settings from the configuration.
+    """
+    return {
+        'analytics_page_size': config.getint('analytics_page_size', fallback=100),
+        'analytics_chunk_rows': config.getint('analytics_chunk_rows', fallback=10000),
+    }
+
+
+def _describe(row):
+    """
+    Add the derived values to a summary row: mean visibility over every stored
+    landmark, and seconds as stored landmark sets over the frame rate.
+    """
+    frames = row['frames']
+    fps = row.get('fps') or 30.0
+    row['mean_visibility'] = row['visibility_sum'] / (frames * NUM_LANDMARKS) if frames else None
+    row['seconds'] = frames / fps
+    del row['visibility_sum']
+    return row
+
+
+def _total(rows):
+    """
+    Add up summary rows (before _describe) into one.
+    """
+    total = {name: sum(row[name] for row in rows) for name in SUMMARY_COUNTS}
+    total['seconds'] = sum(row['frames'] / (row['fps'] or 30.0) for row in rows)
+    total['mean_visibility'] = total['visibility_sum'] / (total['frames'] * NUM_LANDMARKS) if total['frames'] else None
+    del total['visibility_sum']
+    return total
+
+
+def video_summary(db, video_id):
+    """
+    Summary of the landmarks stored for a video.
+
+    Returns:
+        dict: video_id, source, fps, position_name, frames (landmark sets of
+        every athlete), detected_frames, interpolated_frames, first_frame,
+        last_frame, mean_visibility, seconds and positions, the per-athlete
+        rows of position_summary(); None if nothing was stored for the video.
+    """
+    rows = db.get_video_summaries(video_id=video_id)
+    if not rows:
+        return None
+    summary = _describe(rows[0])
+    summary['positions'] = [_describe(row) for row in db.get_position_summaries(video_id=video_id)]
+    return summary
+
+
+def list_video_summaries(db, position_name=None, limit=100, offset=0):
+    """
+    Summaries of stored videos, without their positions, ordered by video id.
+
+    Args:
+        position_name (str): Only videos with frames in this position.
+        limit (int): Page size.
+        offset (int): Videos to skip.
+    """
+    return [_describe(row) for row in db.get_video_summaries(position_name=position_name, limit=limit, offset=offset)]
+
+
+def position_summaries(db, video_id=None):
+    """
+    Totals per position over every video, or over one video.
+
+    Returns:
+        list of dict: position_name, videos, frames, detected_frames,
+        interpolated_frames, mean_visibility and seconds, the time on the
+        position summed over athletes; ordered by position name.
+    """
+    rows = db.get_position_summaries(video_id=video_id)
+    positions = {}
+    for row in rows:
+        positions.setdefault(row['position_name'], []).append(row)
+    return [
+        dict(_total(group), position_name=name, videos=len({row['video_id'] for row in group}))
+        for name, group in positions.items()
+    ]
+
+
+def position_summary(db, position_name):
+    """
+    Totals of one position, as position_summaries(), with the per video and
+    athlete rows under 'breakdown'; None if no frames were stored in it.
+    """
+    rows = db.get_position_summaries(position_name=position_name)
+    if not rows:
+        return None
+    total = dict(_total(rows), position_name=position_name, videos=len({row['video_id'] for row in rows}))
+    total['breakdown'] = [_describe(row) for row in rows]
+    return total
+
+
+def landmark_track(db, video_id, landmark_id, start_frame=None, end_frame=None, athlete_id=None):
+    """
+    One landmark of a video over a range of stored frame numbers.
+
+    Returns:
+        dict: video_id, landmark_id and frames, athlete_ids, x, y and
+        visibility as lists, ordered by frame and athlete.
+
+    Raises:
+        ValueError: If landmark_id is not a landmark of the Pose model.
+    """
+    if not 0 <= landmark_id < NUM_LANDMARKS:
+        raise ValueError(f"landmark_id must be between 0 and {NUM_LANDMARKS - 1}")
+    frames, values, athlete_ids = db.read_landmark_track(video_id, landmark_id, start_frame, end_frame, athlete_id)
+    return {
+        'video_id': video_id,
+        'landmark_id': landmark_id,
+        'frames': frames.tolist(),
+        'athlete_ids': athlete_ids.tolist(),
+        'x': values[:, 0].tolist(),
+        'y': values[:, 1].tolist(),
+        'visibility': values[:, 2].tolist(),
+    }
+
+
+def rebuild_video_summaries(db, video_id, chunk_rows=10000):
+    """
+    Recompute the summaries of a video from its stored landmarks and segment
+    labels, e.g. for videos stored before the summaries were introduced.
+
+    Returns:
+        int: Landmark sets counted.
+    """
+    video = db.get_video(video_id)
+    if video is None:
+        raise ValueError(f"Video {video_id} not found")
+    db.delete_summaries(video_id)
+    position_name = video['position_name']
+    if db.storage_mode == STORAGE_LANDMARKS:
+        rows = db.summarize_pose_data(video_id, position_name)
+        if not rows:
+            return 0
+        video_row = {name: sum(row[name] for row in rows) for name in SUMMARY_COUNTS}
+        video_row.update(video_id=video_id, first_frame=min(row['first_frame'] for row in rows),
+                         last_frame=max(row['last_frame'] for row in rows))
+        db.update_summaries([video_row], rows if position_name else [])
+    else:
+        for frames, landmarks, interpolated, athlete_ids in db.iter_pose_frames(video_id, chunk_rows):
+            chunks = []
+            for athlete_id in np.unique(athlete_ids).tolist():
+                rows = athlete_ids == athlete_id
+                chunks.append((video_id, frames[rows], landmarks[rows], interpolated[rows], athlete_id, position_name))
+            db.update_summaries(*summarize_landmarks(chunks))
+    if not position_name:
+        db.summarize_labels(db.get_segment_labels(video_id=video_id))
+    rows = db.get_video_summaries(video_id=video_id)
+    return rows[0]['frames'] if rows else 0
+
+
+def rebuild_summaries(db, config, video_ids=None, progress_callback=None):
+    """
+    Recompute the summaries of several stored videos, all of them by default.
+
+    Returns:
+        int: Number of videos rebuilt.
+    """
+    chunk_rows = analytics_settings(config)['analytics_chunk_rows']
+    video_ids = db.list_video_ids() if video_ids is None else video_ids
+    rebuilt = 0
+    for done, video_id in enumerate(video_ids, 1):
+        try:
+            rebuild_video_summaries(db, video_id, chunk_rows)
+            rebuilt += 1
+        except Exception:
+            logging.exception(f"Failed to rebuild the summaries of video {video_id}.")
+        if progress_callback:
+            progress_callback(done, len(video_ids))
+    logging.info(f"Rebuilt the summaries of {rebuilt} of {len(video_ids)} videos.")
+    return rebuilt
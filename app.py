@@ -1,11 +1,28 @@
 # app.py
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from werkzeug.utils import secure_filename
 import os
 import configparser
 import logging
-from pose_detection import process_video
-from video_processor import process_video_segment
+import threading
+import numpy as np
+from pose_detection import process_video, processing_mode, pose_settings, config_with_overrides, MODE_FULL, MODE_LANDMARKS_ONLY
+from video_processor import process_video_segment, get_downloader
+from segments import process_labelled_ranges
+from pose_index import get_pose_index, label_matches
+from position_classifier import train_position_classifier
+from kinematics import backfill_features, FEATURE_NAMES
+from archive import export_videos, import_archives, archive_settings
+from analytics import (video_summary, list_video_summaries, position_summaries, position_summary, landmark_track,
+                       rebuild_summaries, analytics_settings)
+from jobs import JobStore, JobManager, QueueFullError
+from result_cache import get_result_cache
+from renderer import render_video, cached_render
+from database import Database, get_engine
+from pose_pool import get_pose_pool
+from metrics import get_metrics, metrics_settings
+from streaming import UploadStream, StreamCapture, StreamError, mp4_streamable
 
 app = Flask(__name__)
 
@@ -27,6 +44,9 @@ db_config = {
     'db_user': config.get('DATABASE', 'db_user', fallback='user'),
     'db_password': config.get('DATABASE', 'db_password', fallback='password'),
     'db_name': config.get('DATABASE', 'db_name', fallback='pose_db'),
+    'storage_mode': config.get('DATABASE', 'storage_mode', fallback='frames'),
+    'db_pool_size': config.getint('DATABASE', 'db_pool_size', fallback=5),
+    'db_max_overflow': config.getint('DATABASE', 'db_max_overflow', fallback=10),
 }
 
 # Configure logging with exception handling
@@ -45,6 +65,17 @@ except Exception as e:
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
 
+# Create the database engine and its connection pool once, and build Pose
+# graphs ahead of time, so the first request does not pay for either
+try:
+    get_engine(db_config)
+    get_pose_pool(default_config).warm(
+        pose_settings(default_config),
+        count=default_config.getint('pose_pool_warm', fallback=1)
+    )
+except Exception:
+    logging.exception("Warm start failed, resources will be created on first use.")
+
 def parse_time_string(time_str):
     """
     Parses a time string in 'hh:mm:ss', 'mm:ss', or 'ss' format and returns total seconds.
@@ -66,6 +97,219 @@ def parse_time_string(time_str):
         logging.exception(f"Invalid time format: {time_str}")
         raise ValueError(f"Invalid time format: {time_str}") from e
 
+def job_config(params):
+    """
+    Configuration for a job, with the settings chosen per request applied.
+    """
+    return config_with_overrides(default_config, {'processing_mode': params.get('mode')})
+
+def parse_mode(mode):
+    """
+    Validate a processing mode given in a request.
+    """
+    if mode not in (None, MODE_FULL, MODE_LANDMARKS_ONLY):
+        raise ValueError(f"Invalid mode: {mode}. Use '{MODE_FULL}' or '{MODE_LANDMARKS_ONLY}'")
+    return mode
+
+def upload_filename(filename):
+    """
+    File name of an upload as given by the client, reduced to a safe name
+    without directories.
+    """
+    return secure_filename(filename or '') or 'upload.mp4'
+
+def run_upload_job(params, progress_callback):
+    """
+    Job handler for uploaded files.
+    """
+    config = job_config(params)
+    video_id = process_video(
+        video_path=params['video_path'],
+        output_path=params['output_path'],
+        db_config=db_config,
+        config=config,
+        position_name=None,  # No position name for local uploads
+        progress_callback=progress_callback
+    )
+    output_video = params['output_path'] if processing_mode(config) == MODE_FULL else None
+    return {'output_video': output_video, 'video_id': video_id}
+
+def run_stream_job(params, progress_callback, capture=None):
+    """
+    Job handler for uploads that are decoded while they arrive.
+    """
+    if capture is None:
+        # Requeued after a restart: the request body it was reading is gone
+        raise RuntimeError("The streamed upload was interrupted, upload the file again")
+    config = job_config(params)
+    try:
+        video_id = process_video(
+            video_path=params['video_path'],
+            output_path=params['output_path'],
+            db_config=db_config,
+            config=config,
+            position_name=None,
+            progress_callback=progress_callback,
+            capture=capture
+        )
+    finally:
+        capture.release()
+    progress_callback(capture.frames_read, capture.frames_read)
+    output_video = params['output_path'] if processing_mode(config) == MODE_FULL else None
+    return {'output_video': output_video, 'video_id': video_id}
+
+def run_youtube_job(params, progress_callback):
+    """
+    Job handler for YouTube segments.
+    """
+    output_path, video_id = process_video_segment(
+        video_url=params['video_url'],
+        start_time=params['start_time'],
+        end_time=params['end_time'],
+        position_name=params['position_name'],
+        db_config=db_config,
+        config=job_config(params),
+        progress_callback=progress_callback
+    )
+    return {'output_video': output_path, 'video_id': video_id}
+
+def run_batch_job(params, progress_callback):
+    """
+    Job handler for labelled ranges of one video.
+    """
+    config = job_config(params)
+    labels = process_labelled_ranges(
+        source=params['video_url'],
+        ranges=[(item['position_name'], item['start_time'], item['end_time']) for item in params['ranges']],
+        db_config=db_config,
+        config=config,
+        batch_id=params['batch_id'],
+        progress_callback=progress_callback,
+        downloader=get_downloader(config)
+    )
+    return {'output_video': None, 'batch_id': params['batch_id'], 'ranges': labels}
+
+def run_index_job(params, progress_callback):
+    """
+    Job handler that adds stored videos missing from the pose index.
+    """
+    index = get_pose_index(default_config)
+    db = Database(db_config)
+    try:
+        added = index.sync(db, progress_callback)
+    finally:
+        db.close()
+    return {'output_video': None, 'videos_added': added, 'index': index.stats()}
+
+def run_train_classifier_job(params, progress_callback):
+    """
+    Job handler that trains the position classifier on the stored position names.
+    """
+    db = Database(db_config)
+    try:
+        report = train_position_classifier(db, default_config, progress_callback)
+    finally:
+        db.close()
+    return dict(report, output_video=None)
+
+def run_kinematics_job(params, progress_callback):
+    """
+    Job handler that computes the kinematic features of stored videos that have none.
+    """
+    db = Database(db_config)
+    try:
+        computed = backfill_features(db, default_config, progress_callback)
+    finally:
+        db.close()
+    return {'output_video': None, 'videos_computed': computed}
+
+def run_archive_export_job(params, progress_callback):
+    """
+    Job handler that exports stored videos to memory-mappable archives.
+    """
+    db = Database(db_config)
+    try:
+        paths = export_videos(db, default_config, params.get('video_ids'), progress_callback)
+    finally:
+        db.close()
+    return {'output_video': None, 'archives': paths}
+
+def run_archive_import_job(params, progress_callback):
+    """
+    Job handler that stores the contents of archives as new videos.
+    """
+    db = Database(db_config)
+    try:
+        video_ids = import_archives(db, default_config, params['archives'], progress_callback)
+    finally:
+        db.close()
+    return {'output_video': None, 'video_ids': video_ids}
+
+def run_summaries_job(params, progress_callback):
+    """
+    Job handler that recomputes the video and position summaries of stored videos.
+    """
+    db = Database(db_config)
+    try:
+        rebuilt = rebuild_summaries(db, default_config, params.get('video_ids'), progress_callback)
+    finally:
+        db.close()
+    return {'output_video': None, 'videos_rebuilt': rebuilt}
+
+def run_render_job(params, progress_callback):
+    """
+    Job handler that renders the annotated video from stored landmarks.
+    """
+    output_path = render_video(db_config, default_config, params['video_id'], progress_callback)
+    return {'output_video': output_path, 'video_id': params['video_id']}
+
+def job_status(job):
+    """
+    Build the JSON description of a job.
+    """
+    total_frames = job['total_frames']
+    progress = {'frames_done': job['frames_done'], 'total_frames': total_frames}
+    if total_frames:
+        progress['percent'] = round(100.0 * job['frames_done'] / total_frames, 1)
+    if job['ranges']:
+        progress['ranges'] = job['ranges']
+    return {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': progress,
+        'result_path': job['result_path'],
+        'result': job['result'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    }
+
+# Background workers for video processing. Jobs are kept in a local SQLite
+# file so queued and interrupted jobs are picked up again after a restart.
+job_manager = JobManager(
+    JobStore(default_config.get('jobs_db', 'data/jobs.db')),
+    handlers={
+        'upload': run_upload_job,
+        'upload_stream': run_stream_job,
+        'process_video': run_youtube_job,
+        'process_batch': run_batch_job,
+        'render': run_render_job,
+        'index': run_index_job,
+        'train_classifier': run_train_classifier_job,
+        'kinematics': run_kinematics_job,
+        'archive_export': run_archive_export_job,
+        'archive_import': run_archive_import_job,
+        'summaries': run_summaries_job,
+    },
+    max_workers=default_config.getint('job_workers', fallback=2),
+    max_queued=default_config.getint('job_queue_size', fallback=20)
+)
+job_manager.start()
+
+# Streamed uploads run outside the job queue, so their number is limited separately
+stream_slots = threading.BoundedSemaphore(default_config.getint('stream_max_uploads', fallback=2))
+
 @app.route('/upload', methods=['POST'])
 def upload_video():
     try:
@@ -74,23 +318,100 @@ def upload_video():
         file = request.files['file']
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
+        mode = parse_mode(request.form.get('mode'))
         if file:
-            filename = file.filename
+            # Prefix with the job id so uploads with the same name do not overwrite each other
+            job_id = job_manager.new_job_id()
+            filename = f"{job_id}_{upload_filename(file.filename)}"
             filepath = os.path.join(UPLOAD_FOLDER, filename)
             output_path = os.path.join(OUTPUT_FOLDER, f"processed_{filename}")
             file.save(filepath)
-            process_video(
-                video_path=filepath,
-                output_path=output_path,
-                db_config=db_config,
-                config=default_config,
-                position_name=None  # No position name for local uploads
-            )
-            return jsonify({'message': 'Video processed successfully', 'output_video': output_path}), 200
+            try:
+                job_manager.submit('upload', {'video_path': filepath, 'output_path': output_path, 'mode': mode}, job_id=job_id)
+            except QueueFullError:
+                os.remove(filepath)
+                raise
+            return jsonify({'message': 'Video queued for processing', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         logging.exception("An error occurred during video upload and processing.")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/upload/stream', methods=['POST'])
+def upload_video_stream():
+    """
+    Process an upload while it is still arriving.
+
+    The video is the raw request body, e.g.
+    curl -T video.mp4 'http://localhost:5000/upload/stream?filename=video.mp4'.
+    Frames go through pose detection as the body is read, and the response is
+    sent once all of it has been received. MP4 files with their index at the
+    end cannot be decoded before they are complete; those are saved and queued
+    like /upload.
+    """
+    if not stream_slots.acquire(blocking=False):
+        logging.warning("Too many streamed uploads in progress.")
+        return jsonify({'error': 'Too many streamed uploads in progress'}), 503
+    try:
+        filename = upload_filename(request.args.get('filename'))
+        mode = parse_mode(request.args.get('mode'))
+        keep_raw = request.args.get('keep_raw', default_config.get('stream_keep_raw', 'false')).lower() in ('1', 'true', 'yes')
+
+        job_id = job_manager.new_job_id()
+        filename = f"{job_id}_{filename}"
+        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        output_path = os.path.join(OUTPUT_FOLDER, f"processed_{filename}")
+        params = {'video_path': filepath, 'output_path': output_path, 'mode': mode}
+        upload = UploadStream(
+            request.stream,
+            raw_path=filepath if keep_raw else None,
+            chunk_size=default_config.getint('stream_chunk_kb', fallback=1024) * 1024
+        )
+
+        capture = None
+        if mp4_streamable(upload.head()):
+            try:
+                capture = StreamCapture()
+            except StreamError as se:
+                logging.warning(f"{se}, saving the upload before processing.")
+        else:
+            logging.info("Upload has its MP4 index at the end, saving it before processing.")
+
+        if capture is None:
+            upload.save(filepath)
+            try:
+                job_manager.submit('upload', params, job_id=job_id)
+            except QueueFullError:
+                os.remove(filepath)
+                raise
+            return jsonify({'message': 'Video queued for processing', 'job_id': job_id, 'streamed': False,
+                            'status_url': f'/jobs/{job_id}'}), 202
+
+        job_manager.run_now('upload_stream', params, job_id=job_id, capture=capture)
+        complete = capture.feed(upload.chunks())
+        if not complete:
+            # The decoder gave up; whatever was kept is incomplete
+            upload.close()
+            if keep_raw and os.path.exists(filepath):
+                os.remove(filepath)
+        logging.info(f"Received {upload.bytes_read} bytes for streamed upload {job_id}.")
+        return jsonify({'message': 'Upload received, processing', 'job_id': job_id, 'streamed': True,
+                        'bytes_received': upload.bytes_read, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logging.exception("An error occurred during streamed video upload.")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        stream_slots.release()
+
 @app.route('/process_video', methods=['POST'])
 def process_youtube_video():
     try:
@@ -102,6 +423,7 @@ def process_youtube_video():
         position_name = data.get('position_name')
         start_time = data.get('start_time')
         end_time = data.get('end_time')
+        mode = parse_mode(data.get('mode'))
 
         if not all([video_url, position_name, start_time, end_time]):
             return jsonify({'error': 'Missing required parameters'}), 400
@@ -116,16 +438,18 @@ def process_youtube_video():
         if not (0 <= start_time < end_time):
             return jsonify({'error': 'Invalid time range: start_time must be less than end_time and non-negative'}), 400
 
-        output_path = process_video_segment(
-            video_url=video_url,
-            start_time=start_time,
-            end_time=end_time,
-            position_name=position_name,
-            db_config=db_config,
-            config=default_config
-        )
+        job_id = job_manager.submit('process_video', {
+            'video_url': video_url,
+            'start_time': start_time,
+            'end_time': end_time,
+            'position_name': position_name,
+            'mode': mode,
+        })
 
-        return jsonify({'message': 'Video processed successfully', 'output_video': output_path}), 200
+        return jsonify({'message': 'Video queued for processing', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
     except ValueError as ve:
         logging.exception("A value error occurred during YouTube video processing.")
         return jsonify({'error': str(ve)}), 400
@@ -133,5 +457,477 @@ def process_youtube_video():
         logging.exception("An error occurred during YouTube video processing.")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """
+    Process many labelled ranges of one video in a single pass.
+
+    The JSON body has a video_url (or the name of an uploaded file) and ranges,
+    a list of {position_name, start_time, end_time} that may overlap. The union
+    of the ranges is fetched and decoded once and each frame is processed once;
+    GET /jobs/<job_id> reports the progress of every range, and the result
+    lists a segment label per range. GET /batches/<job_id> lists the labels.
+    """
+    try:
+        data = request.get_json()
+        if data is None:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+
+        video_url = data.get('video_url')
+        items = data.get('ranges')
+        mode = parse_mode(data.get('mode'))
+        if not video_url or not isinstance(items, list) or not items:
+            return jsonify({'error': 'Missing required parameters'}), 400
+        max_ranges = default_config.getint('batch_max_ranges', fallback=200)
+        if len(items) > max_ranges:
+            return jsonify({'error': f'Too many ranges: at most {max_ranges} per batch'}), 400
+
+        ranges = []
+        for item in items:
+            position_name = item.get('position_name') if isinstance(item, dict) else None
+            start_time = item.get('start_time') if isinstance(item, dict) else None
+            end_time = item.get('end_time') if isinstance(item, dict) else None
+            if not all([position_name, start_time is not None, end_time is not None]):
+                return jsonify({'error': 'Each range needs position_name, start_time and end_time'}), 400
+            if isinstance(start_time, str):
+                start_time = parse_time_string(start_time)
+            if isinstance(end_time, str):
+                end_time = parse_time_string(end_time)
+            if not (0 <= start_time < end_time):
+                return jsonify({'error': f'Invalid time range for {position_name}: start_time must be less than end_time and non-negative'}), 400
+            ranges.append({'position_name': position_name, 'start_time': start_time, 'end_time': end_time})
+
+        # The job id also identifies the batch's segment labels
+        job_id = job_manager.new_job_id()
+        job_manager.submit('process_batch', {
+            'video_url': video_url,
+            'ranges': ranges,
+            'batch_id': job_id,
+            'mode': mode,
+        }, job_id=job_id)
+
+        return jsonify({'message': 'Batch queued for processing', 'job_id': job_id, 'ranges': len(ranges),
+                        'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+    except ValueError as ve:
+        logging.exception("A value error occurred during batch processing.")
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logging.exception("An error occurred during batch processing.")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    db = Database(db_config)
+    try:
+        labels = db.get_segment_labels(batch_id)
+    finally:
+        db.close()
+    if not labels:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify({'batch_id': batch_id, 'ranges': labels}), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job)), 200
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    try:
+        status = request.args.get('status')
+        limit = int(request.args.get('limit', 100))
+        jobs = job_manager.store.list(status=status, limit=limit)
+        return jsonify({'jobs': [job_status(job) for job in jobs]}), 200
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+@app.route('/videos/<int:video_id>', methods=['GET'])
+def get_video(video_id):
+    db = Database(db_config)
+    try:
+        video = db.get_video(video_id)
+    finally:
+        db.close()
+    if video is None:
+        return jsonify({'error': 'Video not found'}), 404
+    video['rendered_video'] = cached_render(default_config, video)
+    return jsonify(video), 200
+
+@app.route('/videos/<int:video_id>/render', methods=['POST'])
+def render_annotated_video(video_id):
+    """
+    Return the annotated video, rendering it from stored landmarks if needed.
+    """
+    try:
+        db = Database(db_config)
+        try:
+            video = db.get_video(video_id)
+        finally:
+            db.close()
+        if video is None:
+            return jsonify({'error': 'Video not found'}), 404
+
+        path = cached_render(default_config, video)
+        if path:
+            return jsonify({'message': 'Video already rendered', 'output_video': path}), 200
+        if not video['source'] or not os.path.exists(video['source']):
+            return jsonify({'error': 'Source video is no longer available'}), 409
+
+        job_id = job_manager.submit('render', {'video_id': video_id})
+        return jsonify({'message': 'Video queued for rendering', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+    except Exception as e:
+        logging.exception("An error occurred while rendering the video.")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/videos/<int:video_id>/positions', methods=['GET'])
+def get_video_positions(video_id):
+    """
+    Return the positions predicted for a video, per window of frames and athlete.
+    """
+    athlete_id = request.args.get('athlete_id', type=int)
+    db = Database(db_config)
+    try:
+        if db.get_video(video_id) is None:
+            return jsonify({'error': 'Video not found'}), 404
+        predictions = db.get_position_predictions(video_id, athlete_id)
+    finally:
+        db.close()
+    return jsonify({'video_id': video_id, 'positions': predictions}), 200
+
+@app.route('/videos/<int:video_id>/features', methods=['GET'])
+def get_video_features(video_id):
+    """
+    Return the precomputed kinematic features of a video over a time range.
+
+    Query parameters: start and end as 'hh:mm:ss', 'mm:ss' or seconds into the
+    source (or start_frame and end_frame, stored frame numbers), athlete_id,
+    and names, a comma separated subset of the features. The values are
+    returned per frame with a mean, min and max per feature over the range.
+    """
+    try:
+        names = request.args.get('names')
+        names = names.split(',') if names else FEATURE_NAMES
+        unknown = [name for name in names if name not in FEATURE_NAMES]
+        if unknown:
+            return jsonify({'error': f"Unknown features: {', '.join(unknown)}", 'features': FEATURE_NAMES}), 400
+        columns = [FEATURE_NAMES.index(name) for name in names]
+
+        db = Database(db_config)
+        try:
+            video = db.get_video(video_id)
+            if video is None:
+                return jsonify({'error': 'Video not found'}), 404
+            fps = video['fps'] or 30.0
+            start_frame = request.args.get('start_frame', type=int)
+            end_frame = request.args.get('end_frame', type=int)
+            # Stored frame numbers start at 1; frame n covers the time from (n - 1) / fps
+            if request.args.get('start'):
+                start_frame = int(parse_time_string(request.args['start']) * fps) + 1
+            if request.args.get('end'):
+                end_frame = int(np.ceil(parse_time_string(request.args['end']) * fps))
+            frames, features, athlete_ids = db.read_pose_features(video_id, start_frame, end_frame,
+                                                                  request.args.get('athlete_id', type=int))
+        finally:
+            db.close()
+
+        values = features[:, columns] if len(frames) else np.zeros((0, len(columns)), dtype=np.float32)
+        summary = {
+            name: {'mean': float(values[:, index].mean()), 'min': float(values[:, index].min()),
+                   'max': float(values[:, index].max())}
+            for index, name in enumerate(names)
+        } if len(frames) else {}
+        return jsonify({
+            'video_id': video_id,
+            'features': names,
+            'frames': frames.tolist(),
+            'times': ((frames - 1) / fps).tolist(),
+            'athlete_ids': athlete_ids.tolist(),
+            'values': values.tolist(),
+            'summary': summary,
+        }), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logging.exception("An error occurred while reading the kinematic features.")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/videos/<int:video_id>/summary', methods=['GET'])
+def get_video_summary(video_id):
+    """
+    Return the frame counts, mean visibility and time per position of a video.
+    """
+    db = Database(db_config)
+    try:
+        summary = video_summary(db, video_id)
+    finally:
+        db.close()
+    if summary is None:
+        return jsonify({'error': 'No landmarks stored for the video'}), 404
+    return jsonify(summary), 200
+
+@app.route('/videos/<int:video_id>/landmarks/<int:landmark_id>', methods=['GET'])
+def get_landmark_track(video_id, landmark_id):
+    """
+    Return one landmark of a video over a time range.
+
+    Query parameters: start and end as 'hh:mm:ss', 'mm:ss' or seconds into the
+    source (or start_frame and end_frame, stored frame numbers), and athlete_id.
+    """
+    try:
+        db = Database(db_config)
+        try:
+            video = db.get_video(video_id)
+            if video is None:
+                return jsonify({'error': 'Video not found'}), 404
+            fps = video['fps'] or 30.0
+            start_frame = request.args.get('start_frame', type=int)
+            end_frame = request.args.get('end_frame', type=int)
+            # Stored frame numbers start at 1; frame n covers the time from (n - 1) / fps
+            if request.args.get('start'):
+                start_frame = int(parse_time_string(request.args['start']) * fps) + 1
+            if request.args.get('end'):
+                end_frame = int(np.ceil(parse_time_string(request.args['end']) * fps))
+            track = landmark_track(db, video_id, landmark_id, start_frame, end_frame,
+                                   request.args.get('athlete_id', type=int))
+        finally:
+            db.close()
+        track['times'] = [(frame - 1) / fps for frame in track['frames']]
+        return jsonify(track), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logging.exception("An error occurred while reading the landmark track.")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/summaries/videos', methods=['GET'])
+def list_summaries_of_videos():
+    """
+    Return the summaries of stored videos, a page at a time (limit and offset),
+    optionally only of videos with frames in a position (position_name).
+    """
+    try:
+        limit = int(request.args.get('limit', analytics_settings(default_config)['analytics_page_size']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+    db = Database(db_config)
+    try:
+        summaries = list_video_summaries(db, request.args.get('position_name'), limit, offset)
+    finally:
+        db.close()
+    return jsonify({'videos': summaries, 'limit': limit, 'offset': offset}), 200
+
+@app.route('/summaries/positions', methods=['GET'])
+def list_summaries_of_positions():
+    """
+    Return the frame counts, mean visibility and time of every position, over
+    all videos or over one (video_id).
+    """
+    db = Database(db_config)
+    try:
+        summaries = position_summaries(db, request.args.get('video_id', type=int))
+    finally:
+        db.close()
+    return jsonify({'positions': summaries}), 200
+
+@app.route('/summaries/positions/<position_name>', methods=['GET'])
+def get_position_summary(position_name):
+    """
+    Return the totals of a position with a breakdown per video and athlete.
+    """
+    db = Database(db_config)
+    try:
+        summary = position_summary(db, position_name)
+    finally:
+        db.close()
+    if summary is None:
+        return jsonify({'error': 'No frames stored in the position'}), 404
+    return jsonify(summary), 200
+
+@app.route('/summaries/rebuild', methods=['POST'])
+def rebuild_video_summaries():
+    """
+    Queue recomputation of the summaries of the videos listed in 'video_ids',
+    or of all of them, such as videos stored before summaries were kept.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        video_ids = data.get('video_ids')
+        if video_ids is not None and (not isinstance(video_ids, list) or
+                                      not all(isinstance(video_id, int) for video_id in video_ids)):
+            return jsonify({'error': 'video_ids must be a list of video ids'}), 400
+        job_id = job_manager.submit('summaries', {'video_ids': video_ids})
+        return jsonify({'message': 'Rebuild queued', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+
+@app.route('/features/backfill', methods=['POST'])
+def backfill_video_features():
+    """
+    Queue computation of the kinematic features of stored videos that have none,
+    such as videos processed before the features were introduced.
+    """
+    try:
+        job_id = job_manager.submit('kinematics', {})
+        return jsonify({'message': 'Feature computation queued', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+
+@app.route('/archive/export', methods=['POST'])
+def export_archives():
+    """
+    Queue export of stored videos to archives in archive_dir: the ones listed
+    in 'video_ids', or all of them.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        video_ids = data.get('video_ids')
+        if video_ids is not None and (not isinstance(video_ids, list) or
+                                      not all(isinstance(video_id, int) for video_id in video_ids)):
+            return jsonify({'error': 'video_ids must be a list of video ids'}), 400
+        job_id = job_manager.submit('archive_export', {'video_ids': video_ids})
+        return jsonify({'message': 'Export queued', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+
+@app.route('/archive/import', methods=['POST'])
+def import_archive_files():
+    """
+    Queue import of archives, given in 'archives' as directory names inside
+    archive_dir, each as a new video.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        archives = data.get('archives')
+        if not isinstance(archives, list) or not archives or not all(isinstance(name, str) for name in archives):
+            return jsonify({'error': 'archives must be a list of archive names'}), 400
+        archive_dir = os.path.abspath(archive_settings(default_config)['archive_dir'])
+        for name in archives:
+            path = os.path.abspath(os.path.join(archive_dir, name))
+            # Only archives inside archive_dir can be imported
+            if os.path.dirname(path) != archive_dir:
+                return jsonify({'error': f"Invalid archive name: {name}"}), 400
+            if not os.path.exists(os.path.join(path, 'meta.json')):
+                return jsonify({'error': f"Archive not found: {name}"}), 404
+        job_id = job_manager.submit('archive_import', {'archives': archives})
+        return jsonify({'message': 'Import queued', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+
+@app.route('/classifier/train', methods=['POST'])
+def train_classifier():
+    """
+    Queue training of the position classifier on the position names stored
+    with videos and segment labels. Videos processed afterwards get predictions.
+    """
+    try:
+        job_id = job_manager.submit('train_classifier', {})
+        return jsonify({'message': 'Training queued', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+
+@app.route('/search', methods=['POST'])
+def search_poses():
+    """
+    Find stored clips whose poses look like a given pose or short sequence.
+
+    The JSON body has either landmarks, one frame of 33 [x, y, z, visibility]
+    values or a list of such frames (with the frame's width over height as
+    aspect, default 1), or a video_id, start_frame, end_frame and optional
+    athlete_id of stored landmarks to use as the query. k (default 10) is the
+    number of matches. Matches are found mirrored too, and are returned as
+    video_id, athlete_id, start_frame, end_frame, position_name and distance.
+    """
+    try:
+        index = get_pose_index(default_config)
+        if index is None:
+            return jsonify({'error': 'Pose index is disabled'}), 409
+        data = request.get_json()
+        if data is None:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+        k = int(data.get('k', 10))
+        if not 1 <= k <= 100:
+            return jsonify({'error': 'k must be between 1 and 100'}), 400
+
+        db = Database(db_config)
+        try:
+            if data.get('landmarks') is not None:
+                landmarks = np.asarray(data['landmarks'], dtype=np.float32)
+                if landmarks.shape[-2:] != (33, 4) or landmarks.ndim not in (2, 3) or landmarks.size == 0:
+                    return jsonify({'error': 'landmarks must be a frame of 33 [x, y, z, visibility] or a list of frames'}), 400
+                aspect = float(data.get('aspect', 1.0))
+            elif data.get('video_id') is not None:
+                video = db.get_video(int(data['video_id']))
+                if video is None:
+                    return jsonify({'error': 'Video not found'}), 404
+                landmarks = db.read_pose_frames(video['id'], data.get('start_frame'), data.get('end_frame'),
+                                                athlete_id=int(data.get('athlete_id', 0)))[1]
+                if len(landmarks) == 0:
+                    return jsonify({'error': 'No landmarks stored in that range'}), 404
+                aspect = video['width'] / video['height'] if video['width'] and video['height'] else 1.0
+            else:
+                return jsonify({'error': 'Missing landmarks or video_id'}), 400
+
+            matches = label_matches(db, index.search(landmarks, aspect=aspect, k=k))
+        finally:
+            db.close()
+        return jsonify({'matches': matches, 'index': index.stats()}), 200
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    except Exception as e:
+        logging.exception("An error occurred during pose search.")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search/index', methods=['POST'])
+def update_pose_index():
+    """
+    Queue indexing of the stored videos that are not in the pose index yet.
+    """
+    try:
+        if get_pose_index(default_config) is None:
+            return jsonify({'error': 'Pose index is disabled'}), 409
+        job_id = job_manager.submit('index', {})
+        return jsonify({'message': 'Indexing queued', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+    except QueueFullError as qe:
+        logging.warning(str(qe))
+        return jsonify({'error': str(qe)}), 503
+
+@app.route('/search/stats', methods=['GET'])
+def pose_index_stats():
+    index = get_pose_index(default_config)
+    if index is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify(dict(index.stats(), enabled=True)), 200
+
+@app.route('/pose_pool/stats', methods=['GET'])
+def pose_pool_stats():
+    return jsonify(get_pose_pool(default_config).stats()), 200
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    cache = get_result_cache(default_config)
+    if cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify(dict(cache.stats(), enabled=True)), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not metrics_settings(default_config)['metrics_enabled']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,357 @@
+# archive.py
+
+import os
+import json
+import shutil
+import logging
+import time
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from database import NUM_LANDMARKS, LANDMARK_FIELDS
+from ingest import BulkIngestor
+from kinematics import FEATURE_NAMES, compute_video_features, kinematics_settings
+
+# Written to meta.json; archives of a newer version are refused
+ARCHIVE_FORMAT = 'pose-landmarks'
+ARCHIVE_VERSION = 1
+
+# Values per landmark, in the order of the last axis of landmarks.npy
+LANDMARK_COLUMNS = ['x', 'y', 'z', 'visibility']
+
+
+def archive_settings(config):
+    """
+    Read the archive settings from the configuration.
+    """
+    return {
+        'archive_dir': config.get('archive_dir', 'archives'),
+        'archive_chunk_rows': config.getint('archive_chunk_rows', fallback=10000),
+    }
+
+
+def archive_path(archive_dir, video_id):
+    """
+    Directory of the archive of a video.
+    """
+    return os.path.join(archive_dir, f"video_{video_id}")
+
+
+def _create_array(path, dtype, shape):
+    """
+    Create an .npy file of the given shape, mapped into memory for writing.
+    """
+    return open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def _frame_offsets(frames):
+    """
+    Row offsets of every frame number from the first to the last one, plus the
+    end: the rows of frame f are offsets[f - first]:offsets[f - first + 1].
+    """
+    if len(frames) == 0:
+        return np.zeros(1, dtype=np.int64)
+    numbers = np.arange(int(frames[0]), int(frames[-1]) + 2, dtype=np.int64)
+    return np.searchsorted(frames, numbers, side='left').astype(np.int64)
+
+
+def _write_table(directory, prefix, rows, chunks, columns):
+    """
+    Write chunks of rows ordered by frame into .npy files, one per column,
+    plus the frame offsets; only one chunk is held in memory at a time.
+
+    Args:
+        directory (str): Directory of the archive being written.
+        prefix (str): Prefix of the file names, '' for the landmarks.
+        rows (int): Number of rows the chunks add up to.
+        chunks (iterable): Tuples of arrays, one per column.
+        columns (list): (name, dtype, shape of one row) per column.
+
+    Returns:
+        int: First frame number, or None without rows.
+    """
+    arrays = [_create_array(os.path.join(directory, f"{prefix}{name}.npy"), dtype, (rows,) + shape)
+              for name, dtype, shape in columns]
+    written = 0
+    for chunk in chunks:
+        count = len(chunk[0])
+        if written + count > rows:
+            raise RuntimeError("Rows were added while the video was exported")
+        for array, values in zip(arrays, chunk):
+            array[written:written + count] = values
+        written += count
+    if written != rows:
+        raise RuntimeError(f"Expected {rows} rows, read {written}")
+    for array in arrays:
+        array.flush()
+
+    frames = arrays[0]
+    np.save(os.path.join(directory, f"{prefix}frame_offsets.npy"), _frame_offsets(frames))
+    first_frame = int(frames[0]) if rows else None
+    del arrays, frames
+    return first_frame
+
+
+def export_video(db, video_id, archive_dir, chunk_rows=10000):
+    """
+    Write the landmarks, interpolated flags, athlete ids, kinematic features
+    and metadata of a stored video to a memory-mappable archive.
+
+    The archive is a directory of .npy files, one per column, ordered by
+    frame and athlete, with an index of the rows of every frame number and a
+    meta.json. Rows are streamed from pose_frames chunk_rows at a time into
+    files mapped into memory, so memory use does not grow with the length of
+    the video. The archive is written next to its final place and moved there
+    once complete, replacing an earlier export of the same video.
+
+    Args:
+        db (Database): Database to read from.
+        video_id (int): Id of the video.
+        archive_dir (str): Directory the archive is created in.
+        chunk_rows (int): Rows read from the database at a time.
+
+    Returns:
+        str: Path of the archive directory.
+
+    Raises:
+        ValueError: If the video does not exist.
+    """
+    video = db.get_video(video_id)
+    if video is None:
+        raise ValueError(f"Video {video_id} not found")
+    path = archive_path(archive_dir, video_id)
+    temp_path = f"{path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    start = time.perf_counter()
+    try:
+        rows = db.count_pose_frames(video_id)
+        first_frame = _write_table(temp_path, '', rows, db.iter_pose_frames(video_id, chunk_rows), [
+            ('frames', np.int64, ()),
+            ('landmarks', np.float32, (NUM_LANDMARKS, LANDMARK_FIELDS)),
+            ('interpolated', np.bool_, ()),
+            ('athlete_ids', np.int64, ()),
+        ])
+        feature_rows = db.count_pose_features(video_id)
+        feature_first_frame = _write_table(temp_path, 'feature_', feature_rows,
+                                           db.iter_pose_features(video_id, chunk_rows), [
+            ('frames', np.int64, ()),
+            ('values', np.float32, (len(FEATURE_NAMES),)),
+            ('athlete_ids', np.int64, ()),
+        ])
+        meta = {
+            'format': ARCHIVE_FORMAT,
+            'version': ARCHIVE_VERSION,
+            'video': video,
+            'rows': rows,
+            'first_frame': first_frame,
+            'landmark_columns': LANDMARK_COLUMNS,
+            'feature_rows': feature_rows,
+            'feature_first_frame': feature_first_frame,
+            'feature_names': FEATURE_NAMES,
+            'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+    except Exception as e:
+        logging.exception(f"Failed to export video {video_id}.")
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise e
+    logging.info(f"Exported {rows} frames of video {video_id} to '{path}' in {time.perf_counter() - start:.2f} seconds.")
+    return path
+
+
+class LandmarkArchive:
+    """
+    Read-only view of an archive written by export_video().
+
+    Every column is mapped into memory rather than read, so opening an
+    archive costs the same for a minute as for an hour of footage, and a
+    frame range is a slice of the mapped arrays found through the frame
+    offsets: a zero-copy NumPy view whose pages are only read when used.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Archive directory.
+
+        Raises:
+            ValueError: If the directory is not an archive of a supported version.
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != ARCHIVE_FORMAT or self.meta.get('version', 0) > ARCHIVE_VERSION:
+            raise ValueError(f"Not a supported landmark archive: {path}")
+        self.video = self.meta['video']
+        self.frames = self._load('frames')
+        self.landmarks = self._load('landmarks')
+        self.interpolated = self._load('interpolated')
+        self.athlete_ids = self._load('athlete_ids')
+        self.feature_frames = self._load('feature_frames')
+        self.features = self._load('feature_values')
+        self.feature_athlete_ids = self._load('feature_athlete_ids')
+        self._offsets = self._load('frame_offsets')
+        self._feature_offsets = self._load('feature_frame_offsets')
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.frames)
+
+    @staticmethod
+    def _rows(offsets, first_frame, start_frame, end_frame):
+        """
+        Slice of the rows of frames start_frame to end_frame, both included.
+        """
+        if first_frame is None:
+            return slice(0, 0)
+        last = len(offsets) - 1
+        start = 0 if start_frame is None else min(max(start_frame - first_frame, 0), last)
+        end = last if end_frame is None else min(max(end_frame - first_frame + 1, 0), last)
+        return slice(int(offsets[start]), int(offsets[max(start, end)]))
+
+    def read(self, start_frame=None, end_frame=None):
+        """
+        Return the rows of a frame range as views into the archive.
+
+        Args:
+            start_frame (int): First frame number to include, or None for the start.
+            end_frame (int): Last frame number to include, or None for the end.
+
+        Returns:
+            tuple: (frames, landmarks, interpolated, athlete_ids), read-only views
+            of shapes (N,), (N, 33, 4), (N,) and (N,), ordered by frame and athlete.
+        """
+        rows = self._rows(self._offsets, self.meta['first_frame'], start_frame, end_frame)
+        return self.frames[rows], self.landmarks[rows], self.interpolated[rows], self.athlete_ids[rows]
+
+    def read_features(self, start_frame=None, end_frame=None):
+        """
+        Return the kinematic features of a frame range as views into the archive.
+
+        Returns:
+            tuple: (frames, features, athlete_ids), features of shape (N, len(feature_names)).
+        """
+        rows = self._rows(self._feature_offsets, self.meta['feature_first_frame'], start_frame, end_frame)
+        return self.feature_frames[rows], self.features[rows], self.feature_athlete_ids[rows]
+
+    def chunks(self, chunk_rows=10000):
+        """
+        Yield the rows in consecutive views of at most chunk_rows rows.
+        """
+        for offset in range(0, len(self), max(1, chunk_rows)):
+            rows = slice(offset, offset + chunk_rows)
+            yield self.frames[rows], self.landmarks[rows], self.interpolated[rows], self.athlete_ids[rows]
+
+
+def _athlete_groups(athlete_ids):
+    """
+    Yield (athlete_id, rows) for every athlete in a chunk; rows is a slice
+    when the chunk has a single athlete, so its views are not copied.
+    """
+    ids = np.unique(athlete_ids)
+    if len(ids) == 1:
+        yield int(ids[0]), slice(None)
+        return
+    for athlete_id in ids.tolist():
+        yield athlete_id, athlete_ids == athlete_id
+
+
+def import_archive(db, config, path):
+    """
+    Store the contents of an archive as a new video.
+
+    The landmarks are handed to the background writer a chunk at a time
+    straight from the mapped files, so they take COPY on PostgreSQL and are
+    stored according to the storage mode like freshly processed ones. Stored
+    features are imported too; without them, they are computed when
+    kinematics are enabled.
+
+    Args:
+        db (Database): Database to store the video in.
+        config (dict): Configuration; archive_chunk_rows and the ingest_* settings are used.
+        path (str): Archive directory.
+
+    Returns:
+        int: Id of the new video row.
+    """
+    chunk_rows = archive_settings(config)['archive_chunk_rows']
+    archive = LandmarkArchive(path)
+    video = archive.video
+    start = time.perf_counter()
+    video_id = db.create_video(
+        source=video['source'],
+        fps=video['fps'],
+        width=video['width'],
+        height=video['height'],
+        total_frames=video['total_frames'],
+        position_name=video['position_name'],
+        model_settings=video['model_settings'],
+        start_frame=video['start_frame'],
+        end_frame=video['end_frame']
+    )
+    try:
+        ingestor = BulkIngestor.from_config(db, config)
+        try:
+            for frames, landmarks, interpolated, athlete_ids in archive.chunks(chunk_rows):
+                for athlete_id, rows in _athlete_groups(athlete_ids):
+                    ingestor.submit(video_id, frames[rows], landmarks[rows], video['position_name'],
+                                    interpolated=interpolated[rows], athlete_id=athlete_id)
+        finally:
+            ingestor.close()
+
+        if archive.meta['feature_rows'] and archive.meta['feature_names'] == FEATURE_NAMES:
+            for offset in range(0, archive.meta['feature_rows'], chunk_rows):
+                rows = slice(offset, offset + chunk_rows)
+                frames, features, athlete_ids = (archive.feature_frames[rows], archive.features[rows],
+                                                 archive.feature_athlete_ids[rows])
+                for athlete_id, athlete_rows in _athlete_groups(athlete_ids):
+                    db.insert_pose_features(video_id, frames[athlete_rows], features[athlete_rows], athlete_id)
+        elif kinematics_settings(config)['kinematics_enabled']:
+            compute_video_features(db, config, video_id)
+    except Exception as e:
+        logging.exception(f"Failed to import the archive '{path}'.")
+        raise e
+    logging.info(f"Imported {len(archive)} frames from '{path}' as video {video_id} "
+                 f"in {time.perf_counter() - start:.2f} seconds.")
+    return video_id
+
+
+def export_videos(db, config, video_ids=None, progress_callback=None):
+    """
+    Export several stored videos, all of them by default, to archive_dir.
+
+    Returns:
+        list: Paths of the archives written.
+    """
+    settings = archive_settings(config)
+    video_ids = db.list_video_ids() if video_ids is None else video_ids
+    paths = []
+    for done, video_id in enumerate(video_ids, 1):
+        paths.append(export_video(db, video_id, settings['archive_dir'], settings['archive_chunk_rows']))
+        if progress_callback:
+            progress_callback(done, len(video_ids))
+    return paths
+
+
+def import_archives(db, config, paths, progress_callback=None):
+    """
+    Import several archives; relative paths are taken inside archive_dir.
+
+    Returns:
+        list: Ids of the new video rows, in the order of paths.
+    """
+    archive_dir = archive_settings(config)['archive_dir']
+    video_ids = []
+    for done, path in enumerate(paths, 1):
+        video_ids.append(import_archive(db, config, os.path.join(archive_dir, path)))
+        if progress_callback:
+            progress_callback(done, len(paths))
+    return video_ids
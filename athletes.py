@@ -0,0 +1,327 @@
+# athletes.py
+
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from landmarks import landmarks_to_array
+from roi import RoiTracker, VISIBILITY_THRESHOLD
+
+# Athlete modes: one person per frame, or every athlete with a track of its own
+ATHLETES_SINGLE = 'single'
+ATHLETES_MULTI = 'multi'
+
+# Two tracks whose landmark boxes overlap this much follow the same athlete
+DUPLICATE_IOU = 0.7
+
+# Width of the painted-out limbs when searching for the next athlete, as a
+# share of the size of the athlete already found
+MASK_THICKNESS = 0.15
+
+
+def athlete_settings(config):
+    """
+    Read the multi-athlete settings from the configuration.
+
+    Returns:
+        dict: athletes mode, and in multi mode the number of athletes, the
+        detection interval and the tracking thresholds. The crop around each
+        athlete uses roi_margin, roi_input_size and roi_min_size.
+    """
+    mode = config.get('athletes', ATHLETES_SINGLE)
+    if mode not in (ATHLETES_SINGLE, ATHLETES_MULTI):
+        raise ValueError(f"Unknown athletes mode: {mode}")
+    if mode == ATHLETES_SINGLE:
+        return {'athletes': mode}
+    return {
+        'athletes': mode,
+        'max_athletes': config.getint('max_athletes', fallback=2),
+        'athlete_detect_interval': config.getint('athlete_detect_interval', fallback=30),
+        'athlete_match_iou': config.getfloat('athlete_match_iou', fallback=0.3),
+        'athlete_max_misses': config.getint('athlete_max_misses', fallback=5),
+        'athlete_max_lost': config.getint('athlete_max_lost', fallback=90),
+        'roi_margin': config.getfloat('roi_margin', fallback=0.25),
+        'roi_input_size': config.getint('roi_input_size', fallback=256),
+        'roi_min_size': config.getfloat('roi_min_size', fallback=0.2),
+    }
+
+
+def landmark_box(landmarks, width, height):
+    """
+    Bounding box of the visible landmarks as (x0, y0, x1, y1) in pixels, or
+    None if none is visible.
+    """
+    visible = landmarks[:, 3] >= VISIBILITY_THRESHOLD
+    if not visible.any():
+        return None
+    points = landmarks[visible, :2] * (width, height)
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    return (float(low[0]), float(low[1]), float(high[0]), float(high[1]))
+
+
+def box_iou(a, b):
+    """
+    Intersection over union of two (x0, y0, x1, y1) boxes.
+    """
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def mask_athlete(image, landmarks, connections):
+    """
+    Paint an athlete out of an image, in place, so a single-person detector
+    finds somebody else. The limbs are drawn over with thick black lines rather
+    than blacking out the whole box, which would also hide an athlete that is
+    tangled up with this one.
+    """
+    height, width = image.shape[:2]
+    box = landmark_box(landmarks, width, height)
+    if box is None:
+        return
+    thickness = max(4, int(MASK_THICKNESS * max(box[2] - box[0], box[3] - box[1])))
+    points = np.rint(landmarks[:, :2] * (width, height)).astype(np.int32).tolist()
+    visible = (landmarks[:, 3] >= VISIBILITY_THRESHOLD).tolist()
+    for start, end in connections:
+        if visible[start] and visible[end]:
+            cv2.line(image, tuple(points[start]), tuple(points[end]), (0, 0, 0), thickness)
+    for point, is_visible in zip(points, visible):
+        if is_visible:
+            cv2.circle(image, tuple(point), thickness, (0, 0, 0), -1)
+
+
+class _Track:
+    """
+    One athlete followed by its own Pose graph in its own region of the frame.
+    """
+
+    def __init__(self, athlete_id, slot, roi):
+        self.athlete_id = athlete_id
+        self.slot = slot
+        self.roi = roi
+        self.landmarks = None
+        self.misses = 0
+
+
+class AthleteTracker:
+    """
+    Follows several athletes through a video with single-person Pose graphs.
+
+    Every athlete gets a slot with a tracking-mode graph and a RoiTracker box;
+    each frame, the graphs run on the crops of their athletes concurrently on a
+    thread pool (MediaPipe releases the GIL while a graph runs), so two athletes
+    take about the time of one crop each rather than two full frames in a row.
+
+    Athletes are found on the downscaled whole frame by a static-mode detector:
+    after each find the athlete is painted out and the detector runs again, up
+    to the number of free slots. That only happens while a slot is free, at most
+    every detect_interval frames once someone is tracked. Found athletes that
+    overlap a tracked one are ignored; the others take over the id of an athlete
+    lost near the same place in the last max_lost frames (by box IoU), or get a
+    new id. A track ends after max_misses frames without landmarks, and when two
+    tracks end up on the same athlete the newer one is dropped.
+    """
+
+    def __init__(self, poses, detector, connections, detect_interval=30, match_iou=0.3, max_misses=5,
+                 max_lost=90, margin=0.25, input_size=256, min_size=0.2):
+        """
+        Args:
+            poses (list): One tracking-mode Pose graph per athlete slot; their
+                number is the maximum number of athletes.
+            detector: Static-image-mode Pose graph to search whole frames with.
+            connections (iterable): Pose connections, for painting athletes out.
+            detect_interval (int): Frames between searches for missing athletes.
+            match_iou (float): Minimum box IoU to match a found athlete with a
+                tracked or recently lost one.
+            max_misses (int): Frames without landmarks before a track ends.
+            max_lost (int): Frames during which a lost athlete's id can be reused.
+            margin (float): Space around each athlete's crop, as for RoiTracker.
+            input_size (int): Side of the crops passed to the graphs.
+            min_size (float): Minimum crop side, as a share of the shorter frame side.
+        """
+        self.poses = poses
+        self.detector = detector
+        self.connections = connections
+        self.detect_interval = detect_interval
+        self.match_iou = match_iou
+        self.max_misses = max_misses
+        self.max_lost = max_lost
+        self.margin = margin
+        self.input_size = input_size
+        self.min_size = min_size
+        self.slots = [None] * len(poses)
+        # Ended tracks as (athlete_id, box, frame_number), for re-identification
+        self._lost = []
+        self._next_id = 0
+        self._last_detect = None
+        self._executor = ThreadPoolExecutor(max_workers=len(poses)) if len(poses) > 1 else None
+        self._stats = {'searches': 0, 'found': 0, 'tracks': 0, 'reidentified': 0, 'lost': 0, 'duplicates': 0}
+
+    def process(self, frame_number, full_frame, image):
+        """
+        Detect the athletes of a frame.
+
+        Args:
+            frame_number (int): Frame number of the frame.
+            full_frame (numpy.ndarray): The full resolution BGR frame, to crop from.
+            image (numpy.ndarray): The downscaled BGR frame, to search for athletes.
+
+        Returns:
+            list: (athlete_id, pose_landmarks, landmarks) for every athlete found,
+            ordered by athlete id, with MediaPipe landmarks in normalized full
+            frame coordinates and the same as a (33, 4) array.
+        """
+        height, width = full_frame.shape[:2]
+        tracks = [track for track in self.slots if track is not None]
+        if self._executor is not None and len(tracks) > 1:
+            results = list(self._executor.map(lambda track: self._infer(track, full_frame), tracks))
+        else:
+            results = [self._infer(track, full_frame) for track in tracks]
+
+        found = []
+        for track, pose_landmarks in zip(tracks, results):
+            if pose_landmarks is None:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    self._end(track, frame_number, width, height)
+                continue
+            track.misses = 0
+            track.landmarks = landmarks_to_array(pose_landmarks)
+            track.roi.update(track.landmarks, width, height)
+            found.append((track, pose_landmarks))
+        found = self._drop_duplicates(found, width, height)
+
+        if None in self.slots and (not found or self._last_detect is None
+                                   or frame_number - self._last_detect >= self.detect_interval):
+            # Athletes missed in this frame are still tracked, and not searched for
+            known = [track.landmarks for track in self.slots if track is not None and track.landmarks is not None]
+            found += self._search(frame_number, image, known, width, height)
+
+        return sorted(
+            ((track.athlete_id, pose_landmarks, track.landmarks) for track, pose_landmarks in found),
+            key=lambda athlete: athlete[0]
+        )
+
+    def slot_landmarks(self):
+        """
+        Landmarks of all slots stacked into one (slots * 33, 4) array, with zeros
+        for empty slots, or None if no athlete is tracked. Lets motion measures
+        made for one athlete look at all of them.
+        """
+        if not any(track is not None and track.landmarks is not None for track in self.slots):
+            return None
+        return np.concatenate([
+            track.landmarks if track is not None and track.landmarks is not None else np.zeros((33, 4), dtype=np.float32)
+            for track in self.slots
+        ])
+
+    def close(self):
+        """
+        Stop the inference threads.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def stats(self):
+        """
+        Return the number of searches, athletes found, tracks started, re-identified,
+        lost and dropped as duplicates.
+        """
+        return dict(self._stats)
+
+    def _infer(self, track, full_frame):
+        height, width = full_frame.shape[:2]
+        box = track.roi.box
+        crop = track.roi.crop(full_frame, box)
+        results = self.poses[track.slot].process(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))
+        if not results.pose_landmarks:
+            return None
+        track.roi.to_frame(results.pose_landmarks, box, width, height)
+        return results.pose_landmarks
+
+    def _search(self, frame_number, image, known, width, height):
+        """
+        Look for athletes in the whole frame that are not tracked yet, and start
+        tracks for them.
+        """
+        self._last_detect = frame_number
+        self._stats['searches'] += 1
+        masked = image.copy()
+        for landmarks in known:
+            mask_athlete(masked, landmarks, self.connections)
+
+        started = []
+        # One try per free slot: a detector that keeps finding a tracked
+        # athlete would otherwise be asked again forever
+        for _ in range(self.slots.count(None)):
+            results = self.detector.process(cv2.cvtColor(masked, cv2.COLOR_BGR2RGB))
+            if not results.pose_landmarks:
+                break
+            landmarks = landmarks_to_array(results.pose_landmarks)
+            box = landmark_box(landmarks, width, height)
+            if box is None:
+                break
+            mask_athlete(masked, landmarks, self.connections)
+            # Painting out did not hide a tracked athlete well enough
+            if any(box_iou(box, landmark_box(other, width, height) or (0, 0, 0, 0)) >= self.match_iou
+                   for other in known):
+                continue
+            known.append(landmarks)
+            self._stats['found'] += 1
+            track = self._start(box, landmarks, frame_number, width, height)
+            started.append((track, results.pose_landmarks))
+        return started
+
+    def _start(self, box, landmarks, frame_number, width, height):
+        self._lost = [lost for lost in self._lost if frame_number - lost[2] <= self.max_lost]
+        athlete_id = None
+        if self._lost:
+            best = max(self._lost, key=lambda lost: box_iou(box, lost[1]))
+            if box_iou(box, best[1]) >= self.match_iou:
+                athlete_id = best[0]
+                self._lost.remove(best)
+                self._stats['reidentified'] += 1
+        if athlete_id is None:
+            athlete_id = self._next_id
+            self._next_id += 1
+            self._stats['tracks'] += 1
+
+        slot = self.slots.index(None)
+        # The graph may still track whoever had the slot before
+        self.poses[slot].reset()
+        roi = RoiTracker(margin=self.margin, input_size=self.input_size, min_size=self.min_size)
+        roi.update(landmarks, width, height)
+        track = _Track(athlete_id, slot, roi)
+        track.landmarks = landmarks
+        self.slots[slot] = track
+        return track
+
+    def _end(self, track, frame_number, width, height):
+        if track.landmarks is not None:
+            box = landmark_box(track.landmarks, width, height)
+            if box is not None:
+                self._lost.append((track.athlete_id, box, frame_number))
+        self.slots[track.slot] = None
+        self._stats['lost'] += 1
+
+    def _drop_duplicates(self, found, width, height):
+        """
+        End the newer of two tracks that follow the same athlete.
+        """
+        kept = []
+        for track, pose_landmarks in sorted(found, key=lambda item: item[0].athlete_id):
+            box = landmark_box(track.landmarks, width, height)
+            if box is not None and any(
+                    box_iou(box, landmark_box(other.landmarks, width, height) or (0, 0, 0, 0)) >= DUPLICATE_IOU
+                    for other, _ in kept):
+                self.slots[track.slot] = None
+                self._stats['duplicates'] += 1
+                continue
+            kept.append((track, pose_landmarks))
+        return kept
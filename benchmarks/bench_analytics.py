@@ -0,0 +1,125 @@
+# benchmarks/bench_analytics.py
+#
+# Position analytics on a large per-landmark table: fills pose_data (10
+# million rows by default) through the background writer, which keeps the
+# summary tables up to date as it goes, then compares on SQLite
+#   - position and video summaries read from the summary tables with the
+#     same aggregates computed by a GROUP BY over pose_data,
+#   - one landmark over a time range, and counting the rows of a position in
+#     a video, through the composite indexes and with NOT INDEXED (a scan).
+# The landmarks are random; each video switches position every
+# --position-seconds.
+#
+# Usage: python benchmarks/bench_analytics.py [--rows 10000000] [--videos 20]
+#            [--position-seconds 30] [--range-seconds 60] [--queries 5]
+
+import argparse
+import os
+import statistics
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import position_summaries, video_summary, landmark_track
+from database import Database, NUM_LANDMARKS
+from ingest import BulkIngestor
+
+POSITIONS = ['closed_guard', 'half_guard', 'side_control', 'mount', 'back_control', 'standing']
+
+
+def timed(function, repeat):
+    """
+    Median seconds of repeat calls, and the result of the last one.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000000, help='Rows of pose_data, 33 per frame')
+    parser.add_argument('--videos', type=int, default=20)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--position-seconds', type=float, default=30.0)
+    parser.add_argument('--range-seconds', type=float, default=60.0)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--db', help='Keep the database in this file instead of a temporary one')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames_per_video = max(1, args.rows // NUM_LANDMARKS // args.videos)
+    position_frames = int(args.position_seconds * args.fps)
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = args.db or os.path.join(work_dir, 'bench.db')
+        db = Database({'db_type': 'sqlite', 'db_name': path, 'storage_mode': 'landmarks'})
+        video_ids = [db.create_video(f"bench_{index}.mp4", args.fps, 1280, 720, frames_per_video)
+                     for index in range(args.videos)]
+
+        start = time.perf_counter()
+        ingestor = BulkIngestor(db, flush_rows=5000)
+        for number, video_id in enumerate(video_ids):
+            for offset in range(0, frames_per_video, position_frames):
+                frames = np.arange(offset + 1, min(offset + position_frames, frames_per_video) + 1)
+                landmarks = rng.uniform(0, 1, (len(frames), NUM_LANDMARKS, 4)).astype(np.float32)
+                position_name = POSITIONS[(number + offset // position_frames) % len(POSITIONS)]
+                ingestor.submit(video_id, frames, landmarks, position_name, interpolated=frames % 5 == 0)
+        ingestor.close()
+        seconds = time.perf_counter() - start
+        connection = sqlite3.connect(path)
+        rows = connection.execute('SELECT COUNT(*) FROM pose_data').fetchone()[0]
+        print(f"ingest: {rows} rows in {seconds:.1f} s ({rows / seconds:,.0f} rows/s) with summaries, "
+              f"database {os.path.getsize(path) / 1e9:.2f} GB")
+
+        video_id = video_ids[len(video_ids) // 2]
+        position_name = POSITIONS[0]
+
+        summary_seconds, _ = timed(lambda: position_summaries(db), args.queries)
+        scan_seconds, _ = timed(lambda: connection.execute(
+            'SELECT position_name, COUNT(DISTINCT video_id), COUNT(*), AVG(visibility) '
+            'FROM pose_data GROUP BY position_name').fetchall(), 1)
+        print(f"position summaries: summary tables {1000 * summary_seconds:.2f} ms, "
+              f"GROUP BY over pose_data {1000 * scan_seconds:.0f} ms")
+
+        summary_seconds, _ = timed(lambda: video_summary(db, video_id), args.queries)
+        scan_seconds, _ = timed(lambda: connection.execute(
+            'SELECT position_name, COUNT(*), AVG(visibility), MIN(frame), MAX(frame) '
+            'FROM pose_data WHERE video_id = ? GROUP BY position_name', (video_id,)).fetchall(), args.queries)
+        print(f"video summary: summary tables {1000 * summary_seconds:.2f} ms, "
+              f"aggregate of its pose_data rows {1000 * scan_seconds:.0f} ms")
+
+        length = int(args.range_seconds * args.fps)
+        first = max(1, frames_per_video // 2 - length // 2)
+        last = first + length - 1
+        indexed_seconds, track = timed(lambda: landmark_track(db, video_id, 15, first, last), args.queries)
+        track_sql = ('SELECT frame, x, y, visibility, athlete_id FROM pose_data {} '
+                     'WHERE video_id = ? AND landmark_id = ? AND frame >= ? AND frame <= ? ORDER BY frame')
+        raw_seconds, _ = timed(lambda: connection.execute(
+            track_sql.format(''), (video_id, 15, first, last)).fetchall(), args.queries)
+        scan_seconds, _ = timed(lambda: connection.execute(
+            track_sql.format('NOT INDEXED'), (video_id, 15, first, last)).fetchall(), 1)
+        print(f"{args.range_seconds:.0f} s of one landmark ({len(track['frames'])} rows): landmark_track "
+              f"{1000 * indexed_seconds:.1f} ms, indexed SELECT {1000 * raw_seconds:.1f} ms, "
+              f"NOT INDEXED {1000 * scan_seconds:.0f} ms")
+
+        count_sql = 'SELECT COUNT(*) FROM pose_data {} WHERE position_name = ? AND video_id = ?'
+        indexed_seconds, _ = timed(lambda: connection.execute(
+            count_sql.format(''), (position_name, video_id)).fetchall(), args.queries)
+        scan_seconds, _ = timed(lambda: connection.execute(
+            count_sql.format('NOT INDEXED'), (position_name, video_id)).fetchall(), 1)
+        print(f"rows of a position in a video: indexed {1000 * indexed_seconds:.1f} ms, "
+              f"NOT INDEXED {1000 * scan_seconds:.0f} ms")
+        connection.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
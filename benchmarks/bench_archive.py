@@ -0,0 +1,89 @@
+# benchmarks/bench_archive.py
+#
+# Landmark archives against the database: time and peak Python memory of
+# exporting a video (an hour at 30 fps by default), reading a time range
+# from the archive compared with a SELECT on pose_frames, and importing the
+# archive back. Uses a temporary SQLite database; the landmarks are random,
+# only the sizes matter. Memory is traced with tracemalloc, which sees NumPy
+# buffers but not pages of mapped files.
+#
+# Usage: python benchmarks/bench_archive.py [--frames 108000] [--chunk-rows 10000]
+#            [--range-seconds 60] [--queries 20]
+
+import argparse
+import configparser
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import LandmarkArchive, export_video, import_archive
+from database import Database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=108000, help='Stored frames (an hour at 30 fps)')
+    parser.add_argument('--chunk-rows', type=int, default=10000)
+    parser.add_argument('--range-seconds', type=float, default=60.0)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--fps', type=float, default=30.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as work_dir:
+        db = Database({'db_type': 'sqlite', 'db_name': os.path.join(work_dir, 'bench.db'), 'storage_mode': 'frames'})
+        video_id = db.create_video('bench.mp4', args.fps, 1280, 720, args.frames)
+        for offset in range(0, args.frames, 10000):
+            frames = np.arange(offset + 1, min(offset + 10000, args.frames) + 1)
+            landmarks = rng.uniform(0, 1, (len(frames), 33, 4)).astype(np.float32)
+            db.insert_pose_frames(video_id, frames, landmarks, frames % 3 != 1)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        path = export_video(db, video_id, os.path.join(work_dir, 'archives'), args.chunk_rows)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        print(f"export: {args.frames} frames in {seconds:.2f} s, peak Python memory {peak / 1e6:.1f} MB, "
+              f"archive {size / 1e6:.1f} MB")
+
+        archive = LandmarkArchive(path)
+        length = int(args.range_seconds * args.fps)
+        starts = rng.integers(1, max(2, args.frames - length), args.queries)
+        from_db, from_archive = [], []
+        for first in starts.tolist():
+            last = first + length - 1
+            start = time.perf_counter()
+            db.read_pose_frames(video_id, first, last, with_flags=True, with_athletes=True)
+            from_db.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            # Touch the values, so the pages are actually read
+            float(archive.read(first, last)[1][:, :, 0].sum())
+            from_archive.append(time.perf_counter() - start)
+        print(f"{args.range_seconds:.0f} s range, median of {args.queries}: SELECT {1000 * statistics.median(from_db):.1f} ms, "
+              f"archive {1000 * statistics.median(from_archive):.2f} ms")
+
+        parser = configparser.ConfigParser()
+        parser.read_dict({'DEFAULT': {'archive_chunk_rows': str(args.chunk_rows), 'kinematics_enabled': 'false'}})
+        tracemalloc.start()
+        start = time.perf_counter()
+        imported = import_archive(db, parser['DEFAULT'], path)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"import: {db.count_pose_frames(imported)} frames in {seconds:.2f} s, "
+              f"peak Python memory {peak / 1e6:.1f} MB")
+        del archive
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# benchmarks/bench_athletes.py
+#
+# Cost of tracking every athlete (athletes = multi) compared with one athlete
+# on the same clip. Runs in landmarks_only mode, so the numbers are decode +
+# inference. The goal is a multi/single time ratio well below the number of
+# athletes tracked, from the per-athlete crops running concurrently.
+#
+# Usage: python benchmarks/bench_athletes.py --video clip.mp4 [--max-athletes 2] [--runs 3]
+
+import argparse
+import statistics
+import time
+
+from bench_sampling import make_config
+from pose_detection import process_frames
+
+
+def run(video, overrides):
+    """
+    Process the video and return the number of landmark sets per athlete and the stats.
+    """
+    counts = {}
+
+    def on_landmarks(frame_number, pose_landmarks, athlete_id):
+        counts[athlete_id] = counts.get(athlete_id, 0) + 1
+
+    start = time.perf_counter()
+    stats = process_frames(video, None, make_config(overrides), on_landmarks)
+    stats['seconds'] = time.perf_counter() - start
+    return counts, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--video', required=True, help='Clip with two athletes, ideally a real sparring recording')
+    parser.add_argument('--max-athletes', type=int, default=2)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--scale-factor', type=float, default=0.5)
+    args = parser.parse_args()
+
+    common = {'scale_factor': args.scale_factor, 'pose_pool_size': args.max_athletes + 1}
+    settings = [
+        ('single', {'athletes': 'single'}),
+        ('multi', {'athletes': 'multi', 'max_athletes': args.max_athletes}),
+    ]
+
+    times = {}
+    for label, overrides in settings:
+        seconds = []
+        for _ in range(args.runs):
+            counts, stats = run(args.video, dict(common, **overrides))
+            seconds.append(stats['seconds'])
+        times[label] = statistics.median(seconds)
+        frames = stats['total_frames']
+        print(f"{label:>7}: {1000 * times[label] / frames:7.2f} ms/frame, "
+              f"landmark sets per athlete {dict(sorted(counts.items()))}")
+        if stats['athletes']:
+            print(f"         tracking: {stats['athletes']}")
+
+    print(f"multi/single time: {times['multi'] / times['single']:.2f}x for up to {args.max_athletes} athletes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# benchmarks/bench_classifier.py
+#
+# Training time, held-out accuracy and per-frame inference cost of the
+# position classifier. The data is synthetic: each position is a body shape,
+# seen at random places and sizes in the frame with per-frame jitter, so the
+# accuracy only shows that the features are invariant to placement; the cost
+# per frame is what matters. Inference runs as during processing: a
+# PositionTracker fed with chunks of landmark_chunk_frames frames.
+#
+# Usage: python benchmarks/bench_classifier.py [--positions 6] [--clips 40]
+#            [--clip-frames 300] [--chunk-frames 64]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from position_classifier import PositionClassifier, PositionTracker, frame_features, window_features
+
+
+def make_clip(rng, shape, frames):
+    """
+    Landmarks of a clip holding one body shape, shape (frames, 33, 4).
+    """
+    scale = rng.uniform(0.5, 1.0)
+    offset = rng.uniform(-0.15, 0.15, 2)
+    drift = rng.normal(0, 0.0005, 2)
+    landmarks = np.zeros((frames, 33, 4), dtype=np.float32)
+    steps = np.arange(frames)[:, None, None]
+    landmarks[..., :2] = 0.5 + (shape - 0.5) * scale + offset + drift * steps + rng.normal(0, 0.01, (frames, 33, 2))
+    landmarks[..., 3] = 0.9
+    return landmarks
+
+
+def clip_windows(landmarks, window_frames, stride_frames):
+    frames = np.arange(1, len(landmarks) + 1)
+    ends = np.arange(window_frames, len(landmarks) + 1, stride_frames)
+    return window_features(frames, frame_features(landmarks), ends, window_frames)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--positions', type=int, default=6)
+    parser.add_argument('--clips', type=int, default=40, help='Clips per position')
+    parser.add_argument('--clip-frames', type=int, default=300)
+    parser.add_argument('--window-frames', type=int, default=30)
+    parser.add_argument('--stride-frames', type=int, default=15)
+    parser.add_argument('--chunk-frames', type=int, default=64)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    shapes = rng.uniform(0.3, 0.7, (args.positions, 33, 2))
+    clips = [(position, make_clip(rng, shapes[position], args.clip_frames))
+             for position in range(args.positions) for _ in range(args.clips)]
+    rng.shuffle(clips)
+    split = int(0.8 * len(clips))
+
+    def dataset(part):
+        features = [clip_windows(landmarks, args.window_frames, args.stride_frames) for _, landmarks in part]
+        labels = [f"position_{position}" for (position, _), windows in zip(part, features) for _ in range(len(windows))]
+        return np.concatenate(features), labels
+
+    train_features, train_labels = dataset(clips[:split])
+    test_features, test_labels = dataset(clips[split:])
+    start = time.perf_counter()
+    model = PositionClassifier.fit(train_features, train_labels, args.window_frames)
+    train_seconds = time.perf_counter() - start
+    names, _ = model.predict(test_features)
+    accuracy = np.mean(np.array(names) == np.array(test_labels))
+    print(f"training: {len(train_labels)} windows in {train_seconds:.2f} s, held-out accuracy {accuracy:.3f}")
+
+    # Inference as during processing, over the held-out clips
+    frames_total = 0
+    start = time.perf_counter()
+    for _, landmarks in clips[split:]:
+        tracker = PositionTracker(model, fps=30.0, stride_frames=args.stride_frames)
+        for offset in range(0, len(landmarks), args.chunk_frames):
+            chunk = landmarks[offset:offset + args.chunk_frames]
+            tracker.update(np.arange(offset + 1, offset + len(chunk) + 1), chunk)
+        tracker.take_predictions()
+        frames_total += len(landmarks)
+    seconds = time.perf_counter() - start
+    print(f"inference: {frames_total} frames, {1e6 * seconds / frames_total:.1f} us/frame "
+          f"({args.chunk_frames}-frame chunks)")
+
+
+if __name__ == '__main__':
+    main()
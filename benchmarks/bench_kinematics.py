@@ -0,0 +1,87 @@
+# benchmarks/bench_kinematics.py
+#
+# Cost of the kinematic features: computing them while landmarks are stored
+# (a KinematicsStage fed with chunks as during processing), and answering a
+# time range query by reading the stored features compared with reading the
+# landmarks and recomputing the features from them. Uses a temporary SQLite
+# database; the landmarks are random, only the sizes matter.
+#
+# Usage: python benchmarks/bench_kinematics.py [--frames 54000] [--chunk-frames 64]
+#            [--range-seconds 60] [--queries 20]
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from kinematics import KinematicsStage, frame_kinematics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=54000, help='Stored frames (30 minutes at 30 fps)')
+    parser.add_argument('--chunk-frames', type=int, default=64)
+    parser.add_argument('--range-seconds', type=float, default=60.0)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--fps', type=float, default=30.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    landmarks = rng.uniform(0, 1, (args.frames, 33, 4)).astype(np.float32)
+    frames = np.arange(1, args.frames + 1)
+    # Every third frame detected, the others interpolated
+    interpolated = frames % 3 != 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        db = Database({'db_type': 'sqlite', 'db_name': os.path.join(work_dir, 'bench.db'), 'storage_mode': 'frames'})
+        video_id = db.create_video('bench.mp4', args.fps, 1280, 720, args.frames)
+        for offset in range(0, args.frames, 1000):
+            db.insert_pose_frames(video_id, frames[offset:offset + 1000], landmarks[offset:offset + 1000],
+                                  interpolated[offset:offset + 1000])
+
+        stored = []
+        stage = KinematicsStage(args.fps, aspect=1280 / 720,
+                                on_features=lambda f, values, athlete_id: stored.append((f, values)))
+        start = time.perf_counter()
+        for offset in range(0, args.frames, args.chunk_frames):
+            rows = slice(offset, offset + args.chunk_frames)
+            stage.update(frames[rows], landmarks[rows], interpolated[rows])
+        stage.close()
+        seconds = time.perf_counter() - start
+        print(f"incremental: {args.frames} frames, {1e6 * seconds / args.frames:.1f} us/frame "
+              f"({args.chunk_frames}-frame chunks)")
+
+        whole = frame_kinematics(frames, landmarks, args.fps, 1280 / 720)
+        incremental = np.concatenate([values for _, values in stored])
+        print(f"max difference to one pass over the whole video: {np.abs(whole - incremental).max():.2e}")
+        for stored_frames, values in stored:
+            db.insert_pose_features(video_id, stored_frames, values)
+
+        length = int(args.range_seconds * args.fps)
+        starts = rng.integers(1, max(2, args.frames - length), args.queries)
+        recompute, precomputed = [], []
+        for first in starts.tolist():
+            last = first + length - 1
+            start = time.perf_counter()
+            range_frames, range_landmarks = db.read_pose_frames(video_id, first, last)
+            frame_kinematics(range_frames, range_landmarks, args.fps, 1280 / 720)
+            recompute.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            db.read_pose_features(video_id, first, last)
+            precomputed.append(time.perf_counter() - start)
+        db.close()
+
+    print(f"{args.range_seconds:.0f} s range query, median of {args.queries}: "
+          f"recompute from landmarks {1000 * statistics.median(recompute):.1f} ms, "
+          f"read stored features {1000 * statistics.median(precomputed):.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# benchmarks/bench_landmarks.py
+#
+# Micro-benchmark: per-landmark dicts (the old process_video path) versus
+# writing landmarks straight into the preallocated LandmarkRing buffers.
+# "extract" only collects the landmarks; "extract+rows" also builds what is
+# sent to the database (PoseData objects for the dict path, one packed blob
+# per frame for the array path).
+#
+# Usage: python benchmarks/bench_landmarks.py [--frames 20000]
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import PoseData
+from landmarks import LandmarkRing
+
+try:
+    from mediapipe.framework.formats import landmark_pb2
+except ImportError:
+    landmark_pb2 = None
+
+
+class _Landmark:
+    __slots__ = ('x', 'y', 'z', 'visibility')
+
+    def __init__(self, x, y, z, visibility):
+        self.x, self.y, self.z, self.visibility = x, y, z, visibility
+
+
+class _LandmarkList:
+    def __init__(self, landmark):
+        self.landmark = landmark
+
+
+def make_landmarks():
+    """
+    Build one frame of 33 landmarks, as MediaPipe protobufs when available.
+    """
+    values = [(i / 33, 1 - i / 33, 0.01 * i, 0.9) for i in range(33)]
+    if landmark_pb2 is not None:
+        landmark_list = landmark_pb2.NormalizedLandmarkList()
+        for x, y, z, visibility in values:
+            landmark_list.landmark.add(x=x, y=y, z=z, visibility=visibility)
+        return landmark_list
+    return _LandmarkList([_Landmark(*v) for v in values])
+
+
+def dict_path(pose_landmarks, frames, batch_size=100, build_rows=False):
+    batch_data = []
+    for frame_number in range(frames):
+        data_to_insert = []
+        for idx, landmark in enumerate(pose_landmarks.landmark):
+            data = {
+                'frame': frame_number,
+                'landmark_id': idx,
+                'x': landmark.x,
+                'y': landmark.y,
+                'visibility': landmark.visibility,
+                'position_name': 'guard',
+            }
+            data_to_insert.append(data)
+        batch_data.extend(data_to_insert)
+        if len(batch_data) >= batch_size:
+            if build_rows:
+                [PoseData(**item) for item in batch_data]
+            batch_data = []
+
+
+def array_path(pose_landmarks, frames, chunk_frames=64, build_rows=False):
+    ring = LandmarkRing(chunk_frames=chunk_frames, chunks=4)
+    for frame_number in range(frames):
+        chunk = ring.append(frame_number, pose_landmarks)
+        if chunk is not None:
+            if build_rows:
+                [(1, frame, landmarks.tobytes()) for frame, landmarks in zip(chunk.frames.tolist(), chunk.landmarks)]
+            chunk.release()
+
+
+def measure(func, pose_landmarks, frames, build_rows):
+    gc.collect()
+    collections_before = sum(stat['collections'] for stat in gc.get_stats())
+    start = time.perf_counter()
+    func(pose_landmarks, frames, build_rows=build_rows)
+    elapsed = time.perf_counter() - start
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - collections_before
+
+    tracemalloc.start()
+    func(pose_landmarks, min(frames, 2000), build_rows=build_rows)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'us_per_frame': 1e6 * elapsed / frames,
+        'gc_collections': collections,
+        'peak_kib_2000_frames': peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=20000)
+    args = parser.parse_args()
+
+    pose_landmarks = make_landmarks()
+    source = 'protobuf' if landmark_pb2 is not None else 'plain objects'
+    print(f"{args.frames} frames, landmarks from {source}")
+    for build_rows in (False, True):
+        for name, func in (('dict', dict_path), ('array', array_path)):
+            result = measure(func, pose_landmarks, args.frames, build_rows)
+            label = f"{name} {'extract+rows' if build_rows else 'extract'}"
+            print(f"{label:>20}: {result['us_per_frame']:8.2f} us/frame, "
+                  f"{result['gc_collections']:5d} GC collections, "
+                  f"peak {result['peak_kib_2000_frames']:8.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
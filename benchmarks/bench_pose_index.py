@@ -0,0 +1,79 @@
+# benchmarks/bench_pose_index.py
+#
+# Query latency of the flat and IVF pose indexes at increasing corpus sizes,
+# and the recall of IVF against the exact flat result. The corpus is synthetic:
+# window descriptors drawn around a few thousand pose centres, which clusters
+# like real footage where the same positions recur. Latency is per single
+# query, as POST /search issues them (a query and its mirror image).
+#
+# Usage: python benchmarks/bench_pose_index.py [--sizes 10000,100000,500000]
+#            [--queries 50] [--k 10] [--nlist 256] [--nprobe 8]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pose_index import FlatIndex, IvfIndex, BODY_LANDMARKS
+
+
+def make_corpus(size, dim, centres=4096, seed=0):
+    rng = np.random.default_rng(seed)
+    means = rng.normal(size=(centres, dim)).astype(np.float32)
+    labels = rng.integers(0, centres, size)
+    return means[labels] + 0.3 * rng.normal(size=(size, dim)).astype(np.float32), means
+
+
+def time_queries(index, queries, k):
+    """
+    Return the median latency in milliseconds and the ids found per query.
+    """
+    seconds = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(np.stack([query, -query]), k)
+        seconds.append(time.perf_counter() - start)
+        found.append(ids[0])
+    return 1000 * statistics.median(seconds), found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10000,100000,500000')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=4, help='index_window_samples')
+    parser.add_argument('--nlist', type=int, default=256)
+    parser.add_argument('--nprobe', type=int, default=8)
+    args = parser.parse_args()
+
+    dim = args.samples * 2 * len(BODY_LANDMARKS)
+    rng = np.random.default_rng(1)
+    print(f"{'windows':>9} {'flat ms':>8} {'ivf ms':>8} {'speedup':>8} {'recall@' + str(args.k):>10} {'build s':>8}")
+    for size in (int(size) for size in args.sizes.split(',')):
+        corpus, means = make_corpus(size, dim)
+        queries = means[rng.integers(0, len(means), args.queries)] + 0.3 * rng.normal(size=(args.queries, dim)).astype(np.float32)
+
+        flat = FlatIndex(dim)
+        flat.add(corpus)
+        start = time.perf_counter()
+        ivf = IvfIndex(dim, args.nlist, args.nprobe)
+        # Added in batches, as videos arrive
+        for offset in range(0, size, 10000):
+            ivf.add(corpus[offset:offset + 10000])
+        build_seconds = time.perf_counter() - start
+
+        flat_ms, exact = time_queries(flat, queries, args.k)
+        ivf_ms, approximate = time_queries(ivf, queries, args.k)
+        recall = np.mean([len(set(a.tolist()) & set(b.tolist())) / args.k for a, b in zip(exact, approximate)])
+        print(f"{size:>9} {flat_ms:8.2f} {ivf_ms:8.2f} {flat_ms / ivf_ms:7.1f}x {recall:10.3f} {build_seconds:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
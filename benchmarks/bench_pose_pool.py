@@ -0,0 +1,84 @@
+# benchmarks/bench_pose_pool.py
+#
+# Latency of short clips with a cold start (new Pose graph, new database engine
+# and create_all for every clip, as before the pool) versus a warm start (Pose
+# graphs from the pool, shared engine). The clip is a synthetic video and the
+# database a temporary SQLite file; the result cache is disabled.
+#
+# Usage: python benchmarks/bench_pose_pool.py [--frames 30] [--runs 10]
+
+import argparse
+import configparser
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pose_pool
+from database import dispose_engines, get_engine
+from pose_detection import process_video, pose_settings
+from pose_pool import PosePool
+
+
+def make_clip(path, frames, width=640, height=360, fps=30):
+    """
+    Write a clip of a moving bright blob on a dark background.
+    """
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for i in range(frames):
+        image = np.full((height, width, 3), 30, dtype=np.uint8)
+        cv2.circle(image, (width // 4 + 4 * i % (width // 2), height // 2), height // 5, (200, 200, 200), -1)
+        out.write(image)
+    out.release()
+
+
+def run_clip(clip, work_dir, db_config, config, index):
+    start = time.perf_counter()
+    process_video(clip, os.path.join(work_dir, f"out_{index}.mp4"), db_config, config)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        clip = os.path.join(work_dir, 'clip.mp4')
+        make_clip(clip, args.frames)
+        config_parser = configparser.ConfigParser()
+        config_parser.read_dict({'DEFAULT': {'cache_enabled': 'false', 'parallel_workers': '1'}})
+        config = config_parser['DEFAULT']
+        db_config = {'db_type': 'sqlite', 'db_name': os.path.join(work_dir, 'bench.db')}
+
+        cold = []
+        for i in range(args.runs):
+            # No pooling: every clip builds its graph and its engine
+            dispose_engines()
+            pose_pool._pool = PosePool(0)
+            cold.append(run_clip(clip, work_dir, db_config, config, i))
+
+        dispose_engines()
+        pose_pool._pool = PosePool(4)
+        get_engine(db_config)
+        pose_pool._pool.warm(pose_settings(config))
+        warm = [run_clip(clip, work_dir, db_config, config, i) for i in range(args.runs)]
+        dispose_engines()
+
+    print(f"{args.frames}-frame clip, {args.runs} runs")
+    for label, times in (('cold', cold), ('warm', warm)):
+        print(f"{label:>5}: median {1000 * statistics.median(times):8.1f} ms, "
+              f"mean {1000 * statistics.mean(times):8.1f} ms, "
+              f"min {1000 * min(times):8.1f} ms")
+    print(f"speedup (median): {statistics.median(cold) / statistics.median(warm):.2f}x")
+
+
+if __name__ == '__main__':
+    main()
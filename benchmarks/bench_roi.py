@@ -0,0 +1,45 @@
+# benchmarks/bench_roi.py
+#
+# Whole-frame inference on the downscaled frame versus ROI crops cut from the
+# full resolution frame. The reference is whole-frame inference at full
+# resolution (scale_factor 1.0). Reports the inference stage time per frame,
+# overall throughput, detection rate and landmark error against the reference.
+#
+# Usage: python benchmarks/bench_roi.py --video wide_shot.mp4 [--scale-factor 0.5]
+
+import argparse
+
+from bench_sampling import run, compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--video', required=True, help='Clip to process, ideally a wide shot of a sparring round')
+    parser.add_argument('--scale-factor', type=float, default=0.5)
+    parser.add_argument('--input-size', type=int, default=256)
+    args = parser.parse_args()
+
+    settings = [
+        ('full frame, scale 1.0', {'scale_factor': 1.0}),
+        (f"full frame, scale {args.scale_factor}", {'scale_factor': args.scale_factor}),
+        (f"roi {args.input_size}px", {'scale_factor': args.scale_factor, 'roi_enabled': 'true',
+                                      'roi_input_size': args.input_size}),
+    ]
+
+    reference = None
+    print(f"{'setting':>24} {'infer ms':>9} {'frames/s':>9} {'detected':>9} {'mean err':>9} {'p95 err':>9}")
+    for label, overrides in settings:
+        landmarks, stats = run(args.video, overrides)
+        if reference is None:
+            reference = landmarks
+        result = compare(reference, landmarks)
+        inference_ms = 1000 * stats['stage_times'].get('inference', 0.0) / max(1, stats['processed_frames'])
+        print(f"{label:>24} {inference_ms:9.2f} {stats['total_frames'] / stats['seconds']:9.1f} "
+              f"{len(landmarks) / max(1, stats['total_frames']):9.1%} "
+              f"{result['mean_error']:9.4f} {result['p95_error']:9.4f}")
+        if stats['roi']:
+            print(f"{'':>24} {stats['roi']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# benchmarks/bench_sampling.py
+#
+# Accuracy and throughput of fixed skip_rate versus adaptive sampling. The
+# reference is inference on every frame; for every other setting the stored
+# landmarks (detected or interpolated) are compared with it on the landmarks
+# the reference sees as visible. Runs in landmarks_only mode, so the numbers
+# are decode + sampling + inference, without encoding.
+#
+# Usage: python benchmarks/bench_sampling.py --video clip.mp4
+#            [--skip-rates 2,3,5] [--target-fps 5,10,15] [--json report.json]
+
+import argparse
+import configparser
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from landmarks import landmarks_to_array
+from pose_detection import process_frames
+from sampling import VISIBILITY_THRESHOLD
+
+
+def make_config(overrides):
+    settings = {'processing_mode': 'landmarks_only', 'sampling': 'fixed', 'skip_rate': '1'}
+    settings.update({key: str(value) for key, value in overrides.items()})
+    parser = configparser.ConfigParser()
+    parser.read_dict({'DEFAULT': settings})
+    return parser['DEFAULT']
+
+
+def run(video, overrides):
+    """
+    Process the video and return its landmarks by frame number and the stats.
+    """
+    landmarks = {}
+
+    def on_landmarks(frame_number, pose_landmarks, athlete_id):
+        landmarks[frame_number] = landmarks_to_array(pose_landmarks)
+
+    def on_interpolated(frames, frame_landmarks, athlete_id):
+        landmarks.update(zip(frames.tolist(), frame_landmarks))
+
+    start = time.perf_counter()
+    stats = process_frames(video, None, make_config(overrides), on_landmarks, on_interpolated=on_interpolated)
+    stats['seconds'] = time.perf_counter() - start
+    return landmarks, stats
+
+
+def compare(reference, landmarks):
+    """
+    Mean landmark distance to the reference per frame, and the share of
+    reference frames that have landmarks.
+    """
+    errors = []
+    for frame_number, expected in reference.items():
+        actual = landmarks.get(frame_number)
+        if actual is None:
+            continue
+        visible = expected[:, 3] >= VISIBILITY_THRESHOLD
+        if visible.any():
+            errors.append(np.linalg.norm(actual[visible, :2] - expected[visible, :2], axis=1).mean())
+    errors = np.array(errors) if errors else np.zeros(1)
+    return {
+        'mean_error': float(errors.mean()),
+        'p95_error': float(np.percentile(errors, 95)),
+        'coverage': len(set(reference) & set(landmarks)) / max(1, len(reference)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--video', required=True, help='Clip to process, ideally a real sparring recording')
+    parser.add_argument('--skip-rates', default='2,3,5')
+    parser.add_argument('--target-fps', default='5,10,15')
+    parser.add_argument('--scale-factor', type=float, default=0.5)
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    common = {'scale_factor': args.scale_factor}
+    settings = [('every frame', {})]
+    settings += [(f"fixed skip_rate={rate}", {'skip_rate': rate}) for rate in args.skip_rates.split(',')]
+    settings += [(f"adaptive target_fps={fps}", {'sampling': 'adaptive', 'sampling_target_fps': fps})
+                 for fps in args.target_fps.split(',')]
+
+    reference = None
+    report = []
+    for label, overrides in settings:
+        landmarks, stats = run(args.video, dict(common, **overrides))
+        if reference is None:
+            reference = landmarks
+        row = {
+            'setting': label,
+            'frames': stats['total_frames'],
+            'inferred': stats['processed_frames'] if stats['sampling'] is None else stats['sampling']['inferred'],
+            'frames_per_second': stats['total_frames'] / stats['seconds'],
+        }
+        row['inferred_share'] = row['inferred'] / max(1, row['frames'])
+        row.update(compare(reference, landmarks))
+        report.append(row)
+
+    print(f"{'setting':>26} {'inferred':>9} {'frames/s':>9} {'mean err':>9} {'p95 err':>9} {'coverage':>9}")
+    for row in report:
+        print(f"{row['setting']:>26} {row['inferred_share']:9.1%} {row['frames_per_second']:9.1f} "
+              f"{row['mean_error']:9.4f} {row['p95_error']:9.4f} {row['coverage']:9.1%}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
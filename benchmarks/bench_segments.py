@@ -0,0 +1,104 @@
+# benchmarks/bench_segments.py
+#
+# Cost of extracting several time ranges of one video. Compares cutting each
+# range into a file of its own first (as the local downloader does) and then
+# processing it, opening the source once per range and seeking to it, and
+# reading all ranges from one SharedCapture in a single pass. Runs in
+# landmarks_only mode, so the numbers are decode + seek + inference.
+#
+# Usage: python benchmarks/bench_segments.py --video clip.mp4 [--segments 5]
+#            [--segment-seconds 2] [--max-skip-seconds 5]
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+
+from bench_sampling import make_config
+from pose_detection import process_frames
+from segments import SharedCapture
+from video_io import open_capture, video_settings, BACKEND_OPENCV
+from video_processor import LocalDownloader
+
+
+def plan(video, count, seconds):
+    """
+    Spread count ranges of the given length evenly over the video, as frame ranges.
+    """
+    cap = cv2.VideoCapture(video)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    length = int(round(seconds * fps))
+    step = max(length, (total - length) // max(1, count - 1)) if count > 1 else 0
+    return fps, [(index * step, index * step + length) for index in range(count) if index * step + length <= total]
+
+
+def discard_landmarks(frame_number, pose_landmarks, athlete_id):
+    pass
+
+
+def run_cut(video, ranges, fps, config):
+    """
+    Cut each range into its own file, then process it.
+    """
+    downloader = LocalDownloader()
+    with tempfile.TemporaryDirectory() as work_dir:
+        for index, (start, end) in enumerate(ranges):
+            path = os.path.join(work_dir, f"segment_{index}.mp4")
+            downloader.download(video, start / fps, end / fps, path)
+            process_frames(path, None, config, discard_landmarks)
+
+
+def run_separate(video, ranges, config):
+    """
+    Open the source once per range and seek to it.
+    """
+    for start, end in ranges:
+        process_frames(video, None, config, discard_landmarks, start_frame=start, end_frame=end)
+
+
+def run_shared(video, ranges, config, max_skip_frames):
+    """
+    Read all ranges from one decoder; return its stats.
+    """
+    settings = video_settings(config)
+    shared = SharedCapture(open_capture(video, settings, scale=config.getfloat('scale_factor')), max_skip_frames)
+    for start, end in ranges:
+        process_frames(video, None, config, discard_landmarks, start_frame=start, end_frame=end, capture=shared.view())
+    shared.release()
+    return shared.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--segments', type=int, default=5)
+    parser.add_argument('--segment-seconds', type=float, default=2.0)
+    parser.add_argument('--max-skip-seconds', type=float, default=5.0)
+    parser.add_argument('--scale-factor', type=float, default=0.5)
+    parser.add_argument('--video-backend', default=BACKEND_OPENCV)
+    args = parser.parse_args()
+
+    config = make_config({'scale_factor': args.scale_factor, 'video_backend': args.video_backend})
+    fps, ranges = plan(args.video, args.segments, args.segment_seconds)
+    frames = sum(end - start for start, end in ranges)
+    print(f"{len(ranges)} segments, {frames} frames: {ranges}")
+
+    runs = [
+        ('cut then process', lambda: run_cut(args.video, ranges, fps, config)),
+        ('seek per segment', lambda: run_separate(args.video, ranges, config)),
+        ('one shared pass', lambda: run_shared(args.video, ranges, config, int(args.max_skip_seconds * fps))),
+    ]
+    for label, run in runs:
+        start = time.perf_counter()
+        result = run()
+        seconds = time.perf_counter() - start
+        extra = f"  {result}" if result else ''
+        print(f"{label:>17}: {seconds:7.2f} s, {1000 * seconds / frames:6.2f} ms/frame{extra}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# benchmarks/bench_smoothing.py
+#
+# Cost per frame of landmark smoothing as it runs in the output stage of the
+# pipeline (One Euro filter, plus copying the values back into the MediaPipe
+# landmarks), and of filling gaps, together with how much jitter it removes.
+# The landmarks are synthetic: joints that hold still and then move quickly,
+# with Gaussian detection noise, so the error against the noise-free motion
+# can be measured.
+#
+# Usage: python benchmarks/bench_smoothing.py [--frames 9000] [--athletes 1]
+#            [--noise 0.004] [--min-cutoff 0.5] [--beta 20]
+
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from landmarks import write_landmarks
+from smoothing import LandmarkSmoother, fill_gap
+
+
+def make_motion(rng, frames, fps, hold_seconds=3.0, move_seconds=0.7):
+    """
+    Noise-free landmarks of shape (frames, 33, 4), moving like a roll: every
+    joint holds still for hold_seconds, then moves to a new place within
+    move_seconds, with a smooth start and stop.
+    """
+    period = int((hold_seconds + move_seconds) * fps)
+    move = int(move_seconds * fps)
+    targets = 0.5 + rng.uniform(-0.15, 0.15, (frames // period + 2, 33, 2))
+    index = np.arange(frames)
+    step = index // period
+    progress = np.clip((index % period - (period - move)) / move, 0, 1)
+    progress = ((1 - np.cos(np.pi * progress)) / 2)[:, None, None]
+    motion = np.zeros((frames, 33, 4), dtype=np.float32)
+    motion[..., :2] = (1 - progress) * targets[step] + progress * targets[step + 1]
+    motion[..., 3] = 0.9
+    return motion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=9000)
+    parser.add_argument('--athletes', type=int, default=1)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--noise', type=float, default=0.004, help='Detection noise, in frame sizes')
+    parser.add_argument('--min-cutoff', type=float, default=0.5)
+    parser.add_argument('--beta', type=float, default=20.0)
+    parser.add_argument('--gap-frames', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    truth = make_motion(rng, args.frames, args.fps)
+    detected = truth.copy()
+    detected[..., :3] += rng.normal(0, args.noise, (args.frames, 33, 3)).astype(np.float32)
+    pose_landmarks = SimpleNamespace(landmark=[SimpleNamespace(x=0.0, y=0.0, z=0.0, visibility=0.0) for _ in range(33)])
+
+    smoother = LandmarkSmoother(args.fps, args.min_cutoff, args.beta)
+    smoothed = np.empty_like(detected)
+    start = time.perf_counter()
+    for index in range(args.frames):
+        for athlete_id in range(args.athletes):
+            landmarks = smoother.filter(index + 1, detected[index], athlete_id)
+            write_landmarks(pose_landmarks, landmarks)
+        smoothed[index] = landmarks
+    seconds = time.perf_counter() - start
+    print(f"smoothing: {1e6 * seconds / args.frames:.1f} us/frame for {args.athletes} athlete(s)")
+
+    gaps = (args.frames - 1) // (args.gap_frames + 1)
+    start = time.perf_counter()
+    for gap in range(gaps):
+        first = gap * (args.gap_frames + 1)
+        last = first + args.gap_frames + 1
+        fill_gap(first, detected[first], last, detected[last], np.arange(first + 1, last))
+    seconds = time.perf_counter() - start
+    print(f"gap filling: {1e6 * seconds / (gaps * args.gap_frames):.1f} us/filled frame ({args.gap_frames}-frame gaps)")
+
+    def rms(values):
+        return float(np.sqrt(((values[..., :2] - truth[..., :2]) ** 2).mean()))
+
+    def jitter(values):
+        # Frame to frame change that the true motion does not explain
+        return float(np.sqrt((np.diff(values[..., :2] - truth[..., :2], axis=0) ** 2).mean()))
+
+    print(f"error against the true motion: detected {rms(detected):.5f}, smoothed {rms(smoothed):.5f}")
+    print(f"jitter: detected {jitter(detected):.5f}, smoothed {jitter(smoothed):.5f}")
+
+
+if __name__ == '__main__':
+    main()
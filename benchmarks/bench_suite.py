@@ -0,0 +1,284 @@
+# benchmarks/bench_suite.py
+#
+# End-to-end benchmark of process_video on synthetic videos, over a grid of
+# settings. The videos are generated offline and deterministically (a figure
+# doing jumping jacks across the frame, drawn from a fixed seed) at the given
+# resolutions, frame rates and lengths, so runs on different machines or
+# commits process the same frames.
+#
+# Every case runs in a fresh process, so its peak RSS is its own, with a
+# warmed-up Pose graph and a new SQLite database. Reported per case: busy time
+# of decode, resize, inference, draw, encode and database inserts, end-to-end
+# frames per second, peak RSS and rows inserted per second of database time.
+# The results are written as JSON; given a baseline (an earlier --json
+# file), cases are matched by video and settings, and the run exits with
+# status 1 if any got slower or bigger by more than the tolerance.
+#
+# Usage: python benchmarks/bench_suite.py [--videos 640x360@30:10,1280x720@30:10]
+#            [--scale-factors 0.5] [--skip-rates 1,3] [--batch-sizes 100]
+#            [--ingest background] [--modes full] [--repeat 1]
+#            [--json results.json] [--baseline baseline.json] [--tolerance 0.1]
+
+import argparse
+import configparser
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def parse_video_spec(spec):
+    """
+    Parse 'WIDTHxHEIGHT@FPS:SECONDS', e.g. '1280x720@30:10'.
+    """
+    size, rest = spec.split('@')
+    fps, seconds = rest.split(':')
+    width, height = size.split('x')
+    return {'width': int(width), 'height': int(height), 'fps': float(fps), 'seconds': float(seconds)}
+
+
+def video_name(video):
+    return f"{video['width']}x{video['height']}@{video['fps']:g}:{video['seconds']:g}"
+
+
+def _point(xy):
+    return int(xy[0]), int(xy[1])
+
+
+def make_video(path, width, height, fps, seconds, seed=0):
+    """
+    Write a synthetic clip of a light figure doing jumping jacks while it
+    walks across a textured mat. Identical for the same arguments.
+    """
+    rng = np.random.default_rng(seed)
+    # Fixed mat texture, so the encoder and decoder see realistic detail
+    mat = cv2.resize(rng.integers(40, 90, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8), (width, height),
+                     interpolation=cv2.INTER_NEAREST)
+    unit = height / 10
+    thickness = max(2, int(unit / 3))
+    # Written under a temporary name, so an interrupted run does not leave a clip that is reused
+    temp_path = f"{path}.tmp.mp4"
+    out = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for index in range(int(round(fps * seconds))):
+        phase = 2 * math.pi * index / fps
+        image = mat.copy()
+        hip = np.array([width * (0.3 + 0.4 * (0.5 + 0.5 * math.sin(phase / 8))), height * 0.6])
+        neck = hip - (0, 2.5 * unit)
+        spread = 0.5 + 0.5 * math.sin(phase)
+        arms = [neck + (side * unit * (1 + spread), -unit * (2 * spread - 0.5)) for side in (-1, 1)]
+        legs = [hip + (side * unit * (0.4 + spread), 3 * unit) for side in (-1, 1)]
+        cv2.line(image, _point(hip), _point(neck), (220, 220, 220), thickness)
+        for end in arms:
+            cv2.line(image, _point(neck), _point(end), (220, 220, 220), thickness)
+        for end in legs:
+            cv2.line(image, _point(hip), _point(end), (220, 220, 220), thickness)
+        cv2.circle(image, _point(neck - (0, 0.8 * unit)), int(0.6 * unit), (200, 210, 230), -1)
+        out.write(image)
+    out.release()
+    os.replace(temp_path, path)
+
+
+def make_config(settings, work_dir):
+    """
+    Configuration of one case: the grid settings, nothing cached, indexed or classified.
+    """
+    items = {
+        'processing_mode': settings['mode'],
+        'scale_factor': settings['scale_factor'],
+        'skip_rate': settings['skip_rate'],
+        'batch_size': settings['batch_size'],
+        'ingest_background': settings['ingest'] == 'background',
+        'parallel_workers': 1,
+        'cache_enabled': False,
+        'index_enabled': False,
+        'classifier_enabled': False,
+        'log_file': os.path.join(work_dir, 'bench.log'),
+    }
+    parser = configparser.ConfigParser()
+    parser.read_dict({'DEFAULT': {key: str(value) for key, value in items.items()}})
+    return parser['DEFAULT']
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(video_path, settings, work_dir):
+    """
+    Process one video with one set of settings and measure it.
+    """
+    logging.basicConfig(level=logging.ERROR)
+    from database import Database
+    from pose_detection import process_video, pose_settings
+    from pose_pool import get_pose_pool
+
+    config = make_config(settings, work_dir)
+    db_config = {'db_type': 'sqlite', 'db_name': os.path.join(work_dir, f"bench_{os.getpid()}_{time.time_ns()}.db"),
+                 'storage_mode': 'frames'}
+    # Graph construction is a one-off at startup, not part of the per-video cost
+    get_pose_pool(config).warm(pose_settings(config))
+
+    collected = {}
+    start = time.perf_counter()
+    video_id = process_video(video_path, os.path.join(work_dir, 'out.mp4'), db_config, config,
+                             stats_callback=collected.update)
+    seconds = time.perf_counter() - start
+
+    db = Database(db_config)
+    rows = len(db.read_pose_frames(video_id)[0])
+    db.close()
+
+    steps = collected.get('step_times', {})
+    stage_times = collected.get('stage_times', {})
+    ingest = collected.get('ingest')
+    # The background writer inserts on its own thread; inline, inserting is most of persisting
+    db_seconds = ingest['flush_seconds_total'] if ingest else steps.get('persist', 0.0)
+    stages = {
+        'decode': stage_times.get('decode', 0.0) - steps.get('resize', 0.0),
+        'resize': steps.get('resize', 0.0),
+        'inference': stage_times.get('inference', 0.0),
+        'draw': steps.get('draw', 0.0),
+        'encode': steps.get('encode', 0.0),
+        'db_insert': db_seconds,
+    }
+    frames = collected.get('total_frames', 0)
+    return {
+        'seconds': seconds,
+        'frames': frames,
+        'processed_frames': collected.get('processed_frames', 0),
+        'fps': frames / seconds if seconds > 0 else 0.0,
+        'stage_seconds': stages,
+        'stage_ms_per_frame': {name: 1000 * value / max(1, frames) for name, value in stages.items()},
+        'db_rows': rows,
+        'db_rows_per_second': rows / db_seconds if db_seconds > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def case_key(result):
+    settings = ','.join(f"{key}={result['settings'][key]}" for key in sorted(result['settings']))
+    return f"{result['video']}|{settings}"
+
+
+def environment():
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__}
+    try:
+        import mediapipe
+        versions['mediapipe'] = getattr(mediapipe, '__version__', None)
+    except ImportError:
+        versions['mediapipe'] = None
+    return dict(versions, platform=platform.platform(), machine=platform.machine(), cpu_count=os.cpu_count())
+
+
+def compare(results, baseline, tolerance):
+    """
+    Match results to baseline cases; return rows of (key, metric, before, after, change, regressed).
+    """
+    before = {case_key(result): result for result in baseline['results']}
+    rows = []
+    for result in results:
+        old = before.get(case_key(result))
+        if old is None:
+            continue
+        # Higher is better for fps and rows/s, lower for peak RSS
+        for metric, higher_is_better in (('fps', True), ('db_rows_per_second', True), ('peak_rss_mb', False)):
+            if not old.get(metric) or result.get(metric) is None:
+                continue
+            change = result[metric] / old[metric] - 1
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            rows.append((case_key(result), metric, old[metric], result[metric], change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--videos', default='640x360@30:10,1280x720@30:10',
+                        help='Comma separated WIDTHxHEIGHT@FPS:SECONDS')
+    parser.add_argument('--scale-factors', default='0.5')
+    parser.add_argument('--skip-rates', default='1,3')
+    parser.add_argument('--batch-sizes', default='100', help='Only used by inline inserts')
+    parser.add_argument('--ingest', default='background', help='background and/or inline')
+    parser.add_argument('--modes', default='full', help='full and/or landmarks_only')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case; the median run is reported')
+    parser.add_argument('--video-dir', help='Keep the generated videos here instead of a temporary directory')
+    parser.add_argument('--in-process', action='store_true',
+                        help='Run cases in this process; peak RSS is then the maximum so far')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Compare with the results of an earlier --json run')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative change counted as a regression')
+    args = parser.parse_args()
+
+    grid = [
+        {'scale_factor': float(scale), 'skip_rate': int(skip), 'batch_size': int(batch), 'ingest': ingest, 'mode': mode}
+        for scale, skip, batch, ingest, mode in itertools.product(
+            args.scale_factors.split(','), args.skip_rates.split(','), args.batch_sizes.split(','),
+            args.ingest.split(','), args.modes.split(','))
+    ]
+    videos = [parse_video_spec(spec) for spec in args.videos.split(',')]
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        video_dir = args.video_dir or work_dir
+        os.makedirs(video_dir, exist_ok=True)
+        context = multiprocessing.get_context('spawn')
+        for video in videos:
+            path = os.path.join(video_dir, f"synthetic_{video['width']}x{video['height']}_{video['fps']:g}fps_"
+                                           f"{video['seconds']:g}s.mp4")
+            if not os.path.exists(path):
+                make_video(path, **video)
+            for settings in grid:
+                runs = []
+                for _ in range(max(1, args.repeat)):
+                    if args.in_process:
+                        runs.append(run_case(path, settings, work_dir))
+                    else:
+                        # A fresh process per case, so the peak RSS is the case's own
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                            runs.append(executor.submit(run_case, path, settings, work_dir).result())
+                run = sorted(runs, key=lambda item: item['seconds'])[len(runs) // 2]
+                result = dict(run, video=video_name(video), settings=settings)
+                results.append(result)
+                stages = ' '.join(f"{name}={value:.2f}" for name, value in result['stage_ms_per_frame'].items())
+                rows_per_second = result['db_rows_per_second']
+                print(f"{result['video']:>18} {json.dumps(settings)}\n"
+                      f"{'':>18} {result['fps']:7.1f} fps, peak RSS {result['peak_rss_mb'] or 0:7.1f} MB, "
+                      f"{rows_per_second or 0:9.0f} rows/s, ms/frame: {stages}")
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(), 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\nCompared {len(rows)} metrics with {args.baseline} (tolerance {args.tolerance:.0%})")
+        for key, group in itertools.groupby(rows, key=lambda row: row[0]):
+            print(key)
+            for _, metric, old, new, change, regressed in group:
+                print(f"    {metric:>18}: {old:10.2f} -> {new:10.2f} ({change:+.1%}){' REGRESSION' if regressed else ''}")
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# benchmarks/bench_video_io.py
+#
+# Decode and encode throughput and output size of the OpenCV and ffmpeg video
+# backends. Decoding is timed at full size and at the processing scale (which
+# the ffmpeg decoder does itself, and OpenCV by cv2.resize afterwards); encoding
+# writes the scaled frames of the clip, held in memory, to a temporary file.
+#
+# Usage: python benchmarks/bench_video_io.py --video clip.mp4 [--scale-factor 0.5]
+#            [--presets ultrafast,veryfast,medium] [--frames 300]
+
+import argparse
+import configparser
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video_io import open_capture, open_writer, video_settings, ffmpeg_available
+
+
+def make_settings(backend, **overrides):
+    settings = {'video_backend': backend, 'video_audio': 'false'}
+    settings.update({key: str(value) for key, value in overrides.items()})
+    parser = configparser.ConfigParser()
+    parser.read_dict({'DEFAULT': settings})
+    return video_settings(parser['DEFAULT'])
+
+
+def decode(video, settings, scale, max_frames):
+    """
+    Read frames at the processing size; return them and the frames per second.
+    """
+    cap = open_capture(video, settings, scale=scale)
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) * scale), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) * scale))
+    frames = []
+    start = time.perf_counter()
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if (frame.shape[1], frame.shape[0]) != size:
+            frame = cv2.resize(frame, size)
+        frames.append(frame)
+    seconds = time.perf_counter() - start
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return frames, len(frames) / seconds, fps
+
+
+def encode(frames, fps, settings, path):
+    """
+    Write frames; return the frames per second and the file size in bytes.
+    """
+    height, width = frames[0].shape[:2]
+    start = time.perf_counter()
+    out = open_writer(path, fps, (width, height), settings)
+    for frame in frames:
+        out.write(frame)
+    out.release()
+    seconds = time.perf_counter() - start
+    return len(frames) / seconds, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--scale-factor', type=float, default=0.5)
+    parser.add_argument('--presets', default='ultrafast,veryfast,medium')
+    parser.add_argument('--frames', type=int, default=300, help='Frames decoded and encoded per run')
+    args = parser.parse_args()
+
+    if not ffmpeg_available():
+        sys.exit("ffmpeg is not installed; nothing to compare")
+
+    opencv = make_settings('opencv')
+    ffmpeg = make_settings('ffmpeg')
+
+    print(f"{'decode':>28} {'full fps':>9} {'scaled fps':>11}")
+    for label, settings in (('opencv', opencv), ('ffmpeg', ffmpeg)):
+        _, full_fps, _ = decode(args.video, settings, 1.0, args.frames)
+        frames, scaled_fps, fps = decode(args.video, settings, args.scale_factor, args.frames)
+        print(f"{label:>28} {full_fps:9.1f} {scaled_fps:11.1f}")
+
+    print(f"\n{'encode':>28} {'fps':>9} {'size KiB':>11}")
+    runs = [('opencv mp4v', opencv)]
+    runs += [(f"ffmpeg libx264 {preset}", make_settings('ffmpeg', video_preset=preset))
+             for preset in args.presets.split(',')]
+    with tempfile.TemporaryDirectory() as work_dir:
+        for index, (label, settings) in enumerate(runs):
+            encode_fps, size = encode(frames, fps, settings, os.path.join(work_dir, f"out_{index}.mp4"))
+            print(f"{label:>28} {encode_fps:9.1f} {size / 1024:11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+# checkpoint.py
+
+import os
+import json
+import shutil
+import logging
+import time
+
+from result_cache import result_key
+from video_io import concat_videos, mux_audio, video_settings, BACKEND_FFMPEG
+
+# Written to checkpoint.json; checkpoints of another version are started over
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_settings(config):
+    """
+    Read the checkpoint settings from the configuration.
+    """
+    return {
+        'checkpoint_enabled': config.getboolean('checkpoint_enabled', fallback=True),
+        'checkpoint_dir': config.get('checkpoint_dir', 'checkpoints'),
+        'checkpoint_interval_seconds': config.getfloat('checkpoint_interval_seconds', fallback=120.0),
+        'checkpoint_warmup_seconds': config.getfloat('checkpoint_warmup_seconds', fallback=2.0),
+        'checkpoint_min_seconds': config.getfloat('checkpoint_min_seconds', fallback=300.0),
+    }
+
+
+def checkpoint_key(video_path, params, start_frame=0, end_frame=None):
+    """
+    Identify a run by its input file, its settings and frame range, so that
+    running the same video again with the same settings finds its checkpoint.
+
+    The file is identified by its absolute path, size and modification time
+    rather than a hash of its content, which would take a while for long videos.
+    """
+    stat = os.stat(video_path)
+    input_key = f"path:{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return result_key(input_key, dict(params, start_frame=start_frame, end_frame=end_frame))
+
+
+def _merge_times(total, times):
+    for name, seconds in (times or {}).items():
+        total[name] = total.get(name, 0.0) + seconds
+
+
+class Checkpoint:
+    """
+    Progress of a long video processed interval by interval.
+
+    Each interval is encoded into its own segment file, and once its landmarks
+    have been committed the checkpoint records the frame the next interval
+    starts at, the segments written so far and the frame counts. The
+    checkpoint is written atomically to checkpoint.json in its directory, so a
+    run that dies at any point leaves the last complete interval behind.
+    """
+
+    def __init__(self, path, key, start_frame, end_frame):
+        """
+        Args:
+            path (str): Directory of the checkpoint and its segments.
+            key (str): From checkpoint_key().
+            start_frame (int): First frame (0-based) of the run.
+            end_frame (int): Frame after the last one of the run.
+        """
+        self.path = path
+        self.key = key
+        self.state = None
+        state_path = os.path.join(path, 'checkpoint.json')
+        if os.path.exists(state_path):
+            try:
+                with open(state_path) as f:
+                    state = json.load(f)
+                if state.get('version') == CHECKPOINT_VERSION and state.get('key') == key:
+                    self.state = state
+            except (OSError, ValueError):
+                logging.exception(f"Ignoring the unreadable checkpoint '{state_path}'.")
+        if self.state is None:
+            self.state = self._new_state(start_frame, end_frame)
+
+    def _new_state(self, start_frame, end_frame):
+        return {
+            'version': CHECKPOINT_VERSION,
+            'key': self.key,
+            'video_id': None,
+            'start_frame': start_frame,
+            'end_frame': end_frame,
+            'next_frame': start_frame,
+            'segments': [],
+            'counts': {'processed_frames': 0, 'interpolated_frames': 0, 'missed_frames': 0},
+            'stage_times': {},
+            'step_times': {},
+        }
+
+    @classmethod
+    def open(cls, config, video_path, params, start_frame, end_frame):
+        """
+        Open the checkpoint of a run, empty if there is none yet.
+        """
+        key = checkpoint_key(video_path, params, start_frame, end_frame)
+        path = os.path.join(checkpoint_settings(config)['checkpoint_dir'], key)
+        return cls(path, key, start_frame, end_frame)
+
+    @property
+    def video_id(self):
+        return self.state['video_id']
+
+    @property
+    def next_frame(self):
+        return self.state['next_frame']
+
+    @property
+    def resumed(self):
+        """
+        Whether an earlier run of the same video got somewhere.
+        """
+        return self.state['video_id'] is not None
+
+    def start(self, video_id):
+        """
+        Record the video row of a new run.
+        """
+        self.state['video_id'] = video_id
+        self._save()
+
+    def reset(self):
+        """
+        Forget the progress of an earlier run and delete its segments.
+        """
+        self.remove()
+        self.state = self._new_state(self.state['start_frame'], self.state['end_frame'])
+
+    def segment_path(self, first_frame):
+        """
+        Path of the segment of the interval starting at first_frame.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        return os.path.join(self.path, f"segment_{first_frame:09d}.mp4")
+
+    def commit(self, next_frame, segment_path, stats):
+        """
+        Record a finished interval, once its landmarks are committed.
+
+        Args:
+            next_frame (int): Frame the next interval starts at.
+            segment_path (str): Segment the interval was encoded into, or None
+                when nothing is rendered.
+            stats (dict): From process_frames() for the interval.
+        """
+        state = self.state
+        state['next_frame'] = next_frame
+        if segment_path is not None:
+            # The segment has to survive whatever the checkpoint survives
+            with open(segment_path, 'rb') as f:
+                os.fsync(f.fileno())
+            state['segments'].append(os.path.basename(segment_path))
+        for name in state['counts']:
+            state['counts'][name] += stats.get(name) or 0
+        _merge_times(state['stage_times'], stats.get('stage_times'))
+        _merge_times(state['step_times'], stats.get('step_times'))
+        self._save()
+
+    def stats(self):
+        """
+        Frame counts and busy times of every interval so far, including those
+        of earlier runs, in the form of process_frames().
+        """
+        state = self.state
+        return dict(state['counts'], total_frames=state['end_frame'] - state['start_frame'],
+                    stage_times=dict(state['stage_times']), step_times=dict(state['step_times']))
+
+    def finalize(self, output_path, video_path, config, whole_video):
+        """
+        Join the segments into the output video, with the source's audio for
+        a whole video when the ffmpeg backend keeps audio.
+        """
+        segments = [os.path.join(self.path, name) for name in self.state['segments']]
+        if not segments:
+            return
+        concat_videos(segments, output_path)
+        video = video_settings(config)
+        if whole_video and video['video_backend'] == BACKEND_FFMPEG and video['video_audio']:
+            mux_audio(output_path, video_path)
+
+    def remove(self):
+        """
+        Delete the checkpoint and its segments, once the run is complete.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _save(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.state['updated_at'] = time.time()
+        temp_path = os.path.join(self.path, 'checkpoint.json.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, os.path.join(self.path, 'checkpoint.json'))
@@ -1,8 +1,11 @@
 # database.py
 
-from sqlalchemy import create_engine, Column, Integer, Float, String
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import create_engine, inspect, text, Column, Integer, Float, String, Boolean, LargeBinary, DateTime, ForeignKey, Index, insert, select, func, false, true
+from sqlalchemy.orm import declarative_base, Session
+import json
 import logging
+import threading
+import numpy as np
 
 Base = declarative_base()
 
@@ -15,28 +18,347 @@ class PoseData(Base):
     y = Column(Float)
     visibility = Column(Float)
     position_name = Column(String)  # Added position_name column
+    interpolated = Column(Boolean, nullable=False, server_default=false())  # Filled in between detected frames
+    athlete_id = Column(Integer, nullable=False, server_default='0')  # Track of the athlete in multi-athlete mode
+    video_id = Column(Integer, ForeignKey('videos.id'))  # NULL for rows stored before the column existed
+    __table_args__ = (
+        Index('ix_pose_data_video_frame', 'video_id', 'frame'),
+        Index('ix_pose_data_video_landmark_frame', 'video_id', 'landmark_id', 'frame'),
+        Index('ix_pose_data_position_video', 'position_name', 'video_id'),
+    )
+
+class Video(Base):
+    __tablename__ = 'videos'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    source = Column(String)
+    fps = Column(Float)
+    width = Column(Integer)
+    height = Column(Integer)
+    total_frames = Column(Integer)
+    position_name = Column(String)
+    model_settings = Column(String)  # JSON encoded settings the landmarks were produced with
+    start_frame = Column(Integer)  # Frame range of the source that was processed, NULL for all of it
+    end_frame = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now())
+
+class PoseFrame(Base):
+    __tablename__ = 'pose_frames'
+    video_id = Column(Integer, ForeignKey('videos.id'), primary_key=True)
+    frame = Column(Integer, primary_key=True)
+    athlete_id = Column(Integer, primary_key=True, server_default='0')  # Track of the athlete in multi-athlete mode
+    landmarks = Column(LargeBinary)  # float32 array of shape (NUM_LANDMARKS, LANDMARK_FIELDS)
+    interpolated = Column(Boolean, nullable=False, server_default=false())  # Filled in between detected frames
+
+class RawPoseFrame(Base):
+    __tablename__ = 'pose_frames_raw'
+    video_id = Column(Integer, ForeignKey('videos.id'), primary_key=True)
+    frame = Column(Integer, primary_key=True)
+    athlete_id = Column(Integer, primary_key=True, server_default='0')
+    landmarks = Column(LargeBinary)  # Detected landmarks before smoothing, as in pose_frames
+
+class PoseFeature(Base):
+    __tablename__ = 'pose_features'
+    video_id = Column(Integer, ForeignKey('videos.id'), primary_key=True)
+    frame = Column(Integer, primary_key=True)
+    athlete_id = Column(Integer, primary_key=True, server_default='0')
+    features = Column(LargeBinary)  # float32 array of the kinematic features, in kinematics.FEATURE_NAMES order
+
+class VideoSummary(Base):
+    # Maintained as landmarks are stored, so summaries never read landmark rows
+    __tablename__ = 'video_summaries'
+    video_id = Column(Integer, ForeignKey('videos.id'), primary_key=True)
+    frames = Column(Integer, nullable=False, server_default='0')  # Stored landmark sets, of every athlete
+    detected_frames = Column(Integer, nullable=False, server_default='0')
+    interpolated_frames = Column(Integer, nullable=False, server_default='0')
+    visibility_sum = Column(Float, nullable=False, server_default='0')  # Over every landmark, for the mean
+    first_frame = Column(Integer)
+    last_frame = Column(Integer)
+
+class PositionSummary(Base):
+    # Frames stored with a position name, or covered by a segment label, per video and athlete
+    __tablename__ = 'position_summaries'
+    position_name = Column(String, primary_key=True)
+    video_id = Column(Integer, ForeignKey('videos.id'), primary_key=True)
+    athlete_id = Column(Integer, primary_key=True, server_default='0')
+    frames = Column(Integer, nullable=False, server_default='0')
+    detected_frames = Column(Integer, nullable=False, server_default='0')
+    interpolated_frames = Column(Integer, nullable=False, server_default='0')
+    visibility_sum = Column(Float, nullable=False, server_default='0')
+    first_frame = Column(Integer)
+    last_frame = Column(Integer)
+    __table_args__ = (
+        Index('ix_position_summaries_video', 'video_id'),
+    )
+
+class IngestWatermark(Base):
+    # Last frame of each track whose landmarks were committed, in the same
+    # transaction as them, so a resumed run knows which inserts already happened
+    __tablename__ = 'ingest_watermarks'
+    video_id = Column(Integer, ForeignKey('videos.id'), primary_key=True)
+    athlete_id = Column(Integer, primary_key=True, server_default='0')
+    frame = Column(Integer, nullable=False)
+
+class SegmentLabel(Base):
+    __tablename__ = 'segment_labels'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    batch_id = Column(String, index=True)  # Job that processed the labelled ranges together
+    video_id = Column(Integer, ForeignKey('videos.id'), index=True)  # Video whose pose_frames cover the range
+    position_name = Column(String)
+    start_time = Column(Float)
+    end_time = Column(Float)
+    start_frame = Column(Integer)  # Frame range of the video's source, as Video.start_frame/end_frame
+    end_frame = Column(Integer)
+    created_at = Column(DateTime, server_default=func.now())
+
+class PositionPrediction(Base):
+    __tablename__ = 'position_predictions'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    video_id = Column(Integer, ForeignKey('videos.id'), index=True)
+    athlete_id = Column(Integer, nullable=False, server_default='0')
+    start_frame = Column(Integer)  # Window of stored frame numbers the prediction is for
+    end_frame = Column(Integer)
+    start_time = Column(Float)  # Seconds into the source
+    end_time = Column(Float)
+    position_name = Column(String)
+    confidence = Column(Float)
+
+# Landmarks per frame and values stored per landmark (x, y, z, visibility)
+NUM_LANDMARKS = 33
+LANDMARK_FIELDS = 4
+
+# Storage modes: compact per-frame rows, the per-landmark pose_data table, or both
+STORAGE_FRAMES = 'frames'
+STORAGE_LANDMARKS = 'landmarks'
+STORAGE_BOTH = 'both'
+
+# Columns added up by the summary tables
+SUMMARY_COUNTS = ('frames', 'detected_frames', 'interpolated_frames', 'visibility_sum')
+
+# Engines shared by every Database of the process, keyed by URL. Each holds a
+# connection pool, and its tables are created once when it is first used.
+_engines = {}
+_engines_lock = threading.Lock()
+
+def database_url(db_config):
+    """
+    Build the SQLAlchemy URL for a database configuration.
+    """
+    db_type = db_config.get('db_type', 'sqlite')
+    if db_type == 'postgres':
+        user = db_config['db_user']
+        password = db_config['db_password']
+        host = db_config['db_host']
+        port = db_config['db_port']
+        db_name = db_config['db_name']
+        return f'postgresql://{user}:{password}@{host}:{port}/{db_name}'
+    return f"sqlite:///{db_config['db_name']}"
+
+def get_engine(db_config):
+    """
+    Return the shared engine for a database configuration, creating it and the
+    tables on first use.
+
+    Args:
+        db_config (dict): Database configuration parameters; db_pool_size and
+            db_max_overflow size the connection pool of PostgreSQL engines.
+
+    Returns:
+        sqlalchemy.engine.Engine: The engine.
+    """
+    url = database_url(db_config)
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            options = {'pool_pre_ping': True}
+            if url.startswith('postgresql'):
+                options['pool_size'] = int(db_config.get('db_pool_size', 5))
+                options['max_overflow'] = int(db_config.get('db_max_overflow', 10))
+            engine = create_engine(url, **options)
+            Base.metadata.create_all(engine)
+            _add_missing_columns(engine)
+            _extend_primary_keys(engine)
+            _create_missing_indexes(engine)
+            _engines[url] = engine
+            logging.info(f"Connected to database '{db_config['db_name']}' successfully.")
+        return engine
+
+def _add_missing_columns(engine):
+    """
+    Add columns that were introduced after a table was created, since
+    create_all only creates missing tables.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    if not isinstance(default, str):
+                        default = default.compile(dialect=engine.dialect)
+                    ddl += f" DEFAULT {default}"
+                connection.execute(text(ddl))
+                logging.info(f"Added column {column.name} to table {table.name}.")
+
+def _extend_primary_keys(engine):
+    """
+    Make the primary key of existing tables include columns that were added to
+    it later, e.g. athlete_id of pose_frames. PostgreSQL swaps the constraint;
+    SQLite cannot alter a primary key, so the table is copied into a new one.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        wanted = [column.name for column in table.primary_key.columns]
+        constraint = inspector.get_pk_constraint(table.name)
+        if set(constraint['constrained_columns']) == set(wanted):
+            continue
+        with engine.begin() as connection:
+            if engine.dialect.name == 'postgresql':
+                connection.execute(text(f"ALTER TABLE {table.name} DROP CONSTRAINT {constraint['name']}"))
+                connection.execute(text(f"ALTER TABLE {table.name} ADD PRIMARY KEY ({', '.join(wanted)})"))
+            else:
+                columns = ', '.join(column.name for column in table.columns)
+                connection.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_old"))
+                table.create(connection)
+                connection.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old"))
+                connection.execute(text(f"DROP TABLE {table.name}_old"))
+        logging.info(f"Changed the primary key of table {table.name} to ({', '.join(wanted)}).")
+
+def _create_missing_indexes(engine):
+    """
+    Create indexes that were introduced after a table was created, since
+    create_all only creates the indexes of tables it creates.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                logging.info(f"Created index {index.name} on table {table.name}.")
+
+def summarize_landmarks(chunks):
+    """
+    Add up chunks of stored landmarks into increments of the summary tables.
+
+    Args:
+        chunks (iterable): (video_id, frames, landmarks, interpolated, athlete_id,
+            position_name) per chunk of one athlete; position_name may be None.
+
+    Returns:
+        tuple: (video rows, position rows), lists of dicts with the key columns,
+        SUMMARY_COUNTS and first_frame/last_frame of video_summaries and
+        position_summaries, one per key.
+    """
+    videos = {}
+    positions = {}
+    for video_id, frames, landmarks, interpolated, athlete_id, position_name in chunks:
+        if len(frames) == 0:
+            continue
+        frames = np.asarray(frames)
+        flags = np.zeros(len(frames), dtype=bool) if interpolated is None else np.asarray(interpolated, dtype=bool)
+        interpolated_frames = int(flags.sum())
+        values = {
+            'frames': len(frames),
+            'detected_frames': len(frames) - interpolated_frames,
+            'interpolated_frames': interpolated_frames,
+            'visibility_sum': float(np.asarray(landmarks)[..., 3].sum(dtype=np.float64)),
+            'first_frame': int(frames.min()),
+            'last_frame': int(frames.max()),
+        }
+        _accumulate(videos, {'video_id': int(video_id)}, values)
+        if position_name:
+            _accumulate(positions, {'position_name': position_name, 'video_id': int(video_id),
+                                    'athlete_id': int(athlete_id)}, values)
+    return list(videos.values()), list(positions.values())
+
+def _accumulate(rows, key, values):
+    row = rows.get(tuple(key.values()))
+    if row is None:
+        rows[tuple(key.values())] = dict(key, **values)
+        return
+    for name in SUMMARY_COUNTS:
+        row[name] += values[name]
+    row['first_frame'] = min(row['first_frame'], values['first_frame'])
+    row['last_frame'] = max(row['last_frame'], values['last_frame'])
+
+def summary_upsert_sql(table, keys, marker=':{}'):
+    """
+    Build the statement that adds one row of increments to a summary table.
+
+    Uses INSERT ... ON CONFLICT, which SQLite and PostgreSQL share.
+
+    Args:
+        table (str): video_summaries or position_summaries.
+        keys (tuple): Its key columns.
+        marker (str): Format of a named parameter, ':{}' for SQLAlchemy and
+            sqlite3, '%({})s' for psycopg2.
+    """
+    columns = keys + SUMMARY_COUNTS + ('first_frame', 'last_frame')
+    updates = [f"{name} = {table}.{name} + excluded.{name}" for name in SUMMARY_COUNTS]
+    updates.append(f"first_frame = CASE WHEN excluded.first_frame < {table}.first_frame "
+                   f"THEN excluded.first_frame ELSE {table}.first_frame END")
+    updates.append(f"last_frame = CASE WHEN excluded.last_frame > {table}.last_frame "
+                   f"THEN excluded.last_frame ELSE {table}.last_frame END")
+    return (f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(marker.format(name) for name in columns)}) "
+            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(updates)}")
+
+def landmark_watermarks(chunks):
+    """
+    Last frame per video and athlete of chunks of stored landmarks.
+
+    Args:
+        chunks (iterable): (video_id, frames, athlete_id) per chunk.
+
+    Returns:
+        list of dict: video_id, athlete_id and frame rows of ingest_watermarks.
+    """
+    last = {}
+    for video_id, frames, athlete_id in chunks:
+        if len(frames) == 0:
+            continue
+        key = (int(video_id), int(athlete_id))
+        last[key] = max(last.get(key, 0), int(np.max(frames)))
+    return [{'video_id': video_id, 'athlete_id': athlete_id, 'frame': frame}
+            for (video_id, athlete_id), frame in last.items()]
+
+def watermark_upsert_sql(marker=':{}'):
+    """
+    Build the statement that moves the watermark of a track forward, as
+    summary_upsert_sql() does for the summaries.
+    """
+    values = ', '.join(marker.format(name) for name in ('video_id', 'athlete_id', 'frame'))
+    return (f"INSERT INTO ingest_watermarks (video_id, athlete_id, frame) VALUES ({values}) "
+            f"ON CONFLICT (video_id, athlete_id) DO UPDATE SET frame = CASE WHEN excluded.frame > "
+            f"ingest_watermarks.frame THEN excluded.frame ELSE ingest_watermarks.frame END")
+
+def _summary_columns(summary):
+    return {name: getattr(summary, name) for name in SUMMARY_COUNTS + ('first_frame', 'last_frame')}
+
+def dispose_engines():
+    """
+    Close the connection pools of all shared engines, e.g. at shutdown.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
 
 class Database:
     def __init__(self, db_config):
         """
-        Initialize the database connection.
+        Open a session on the shared engine of the configured database.
         """
         try:
-            db_type = db_config.get('db_type', 'sqlite')
-            if db_type == 'postgres':
-                user = db_config['db_user']
-                password = db_config['db_password']
-                host = db_config['db_host']
-                port = db_config['db_port']
-                db_name = db_config['db_name']
-                self.engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{db_name}')
-            else:
-                db_name = db_config['db_name']
-                self.engine = create_engine(f'sqlite:///{db_name}')
-            Base.metadata.create_all(self.engine)
-            self.Session = sessionmaker(bind=self.engine)
-            self.session = self.Session()
-            logging.info(f"Connected to database '{db_name}' successfully.")
+            self.engine = get_engine(db_config)
+            self.storage_mode = db_config.get('storage_mode', STORAGE_FRAMES)
+            if self.storage_mode not in (STORAGE_FRAMES, STORAGE_LANDMARKS, STORAGE_BOTH):
+                raise ValueError(f"Unknown storage_mode: {self.storage_mode}")
+            self.session = Session(bind=self.engine)
         except Exception as e:
             logging.exception("Failed to initialize the database.")
             raise e
@@ -44,6 +366,9 @@ class Database:
     def create_tables(self):
         """
         Create database tables if they do not exist.
+
+        The shared engine already did when it was created, so this only matters
+        after tables were dropped behind its back.
         """
         try:
             Base.metadata.create_all(self.engine)
@@ -60,22 +385,687 @@ class Database:
             data (list of dict): List of pose data dictionaries.
         """
         try:
-            records = [PoseData(**item) for item in data]
-            self.session.bulk_save_objects(records)
+            # Core executemany; building ORM objects per landmark is much slower
+            self.session.execute(insert(PoseData), data)
             self.session.commit()
-            logging.info(f"Inserted {len(records)} records into the database.")
+            logging.debug(f"Inserted {len(data)} records into the database.")
         except Exception as e:
             logging.exception("Failed to insert pose data into the database.")
             self.session.rollback()
             raise e
 
+    def create_video(self, source, fps, width, height, total_frames, position_name=None, model_settings=None,
+                     start_frame=None, end_frame=None):
+        """
+        Register a processed video and return its id.
+
+        Args:
+            source (str): Path or URL of the input video.
+            fps (float): Frame rate of the input video.
+            width (int): Frame width in pixels.
+            height (int): Frame height in pixels.
+            total_frames (int): Number of frames in the input video.
+            position_name (str): Name of the BJJ position or technique.
+            model_settings (dict): Pose model settings used for the landmarks.
+            start_frame (int): First frame (0-based) of the source that was processed,
+                for a segment of it. Stored frame numbers stay those of the source.
+            end_frame (int): Frame after the last one processed, for a segment.
+
+        Returns:
+            int: The id of the new video row.
+        """
+        try:
+            video = Video(
+                source=source,
+                fps=fps,
+                width=width,
+                height=height,
+                total_frames=total_frames,
+                position_name=position_name,
+                model_settings=json.dumps(model_settings or {}),
+                start_frame=start_frame,
+                end_frame=end_frame
+            )
+            self.session.add(video)
+            self.session.commit()
+            logging.info(f"Registered video {video.id} from '{source}'.")
+            return video.id
+        except Exception as e:
+            logging.exception("Failed to register the video.")
+            self.session.rollback()
+            raise e
+
+    def update_video(self, video_id, **fields):
+        """
+        Update columns of a video row, e.g. total_frames once a stream has ended.
+        """
+        try:
+            self.session.query(Video).filter(Video.id == video_id).update(fields)
+            self.session.commit()
+        except Exception as e:
+            logging.exception(f"Failed to update video {video_id}.")
+            self.session.rollback()
+            raise e
+
+    def get_video(self, video_id):
+        """
+        Return the metadata of a video as a dict, or None if it does not exist.
+        """
+        video = self.session.get(Video, video_id)
+        if video is None:
+            return None
+        return {
+            'id': video.id,
+            'source': video.source,
+            'fps': video.fps,
+            'width': video.width,
+            'height': video.height,
+            'total_frames': video.total_frames,
+            'position_name': video.position_name,
+            'model_settings': json.loads(video.model_settings or '{}'),
+            'start_frame': video.start_frame,
+            'end_frame': video.end_frame,
+            'created_at': video.created_at.isoformat() if video.created_at else None,
+        }
+
+    def create_segment_labels(self, labels):
+        """
+        Register labelled ranges of processed videos.
+
+        Several labels may point at the same video and overlapping frames; they
+        share its landmark rows instead of storing copies.
+
+        Args:
+            labels (list of dict): batch_id, video_id, position_name, start_time,
+                end_time, start_frame and end_frame of each label.
+
+        Returns:
+            list of int: The ids of the new label rows, in the order given.
+        """
+        try:
+            rows = [SegmentLabel(**label) for label in labels]
+            self.session.add_all(rows)
+            self.session.commit()
+            logging.info(f"Registered {len(rows)} segment labels.")
+            self.summarize_labels(labels)
+            return [row.id for row in rows]
+        except Exception as e:
+            logging.exception("Failed to register the segment labels.")
+            self.session.rollback()
+            raise e
+
+    def summarize_labels(self, labels):
+        """
+        Recompute the position_summaries rows of the videos of some labels
+        from all the labels registered for them, for videos whose landmarks
+        were stored without a position name (those with one were counted as
+        they were stored).
+
+        The labels of a video are merged per position first, so frames under
+        overlapping labels of the same position count once, and registering
+        the same labels again changes nothing.
+
+        Args:
+            labels (list of dict): video_id of each label.
+        """
+        # segments imports this module
+        from segments import merge_ranges
+
+        chunks = []
+        position_rows = []
+        video_ids = []
+        for video_id in sorted({label['video_id'] for label in labels}):
+            video = self.session.get(Video, video_id)
+            if video is None or video.position_name:
+                continue
+            video_ids.append(video_id)
+            ranges = {}
+            for label in self.get_segment_labels(video_id=video_id):
+                if label['position_name']:
+                    ranges.setdefault(label['position_name'], []).append((label['start_frame'], label['end_frame']))
+            for position_name, spans in ranges.items():
+                for start_frame, end_frame, _ in merge_ranges(spans):
+                    # Label frames are 0-based and exclusive, stored frame numbers 1-based
+                    first, last = start_frame + 1, end_frame
+                    if self.storage_mode == STORAGE_LANDMARKS:
+                        position_rows += self.summarize_pose_data(video_id, position_name, first, last)
+                        continue
+                    frames, landmarks, interpolated, athlete_ids = self.read_pose_frames(
+                        video_id, first, last, with_flags=True, with_athletes=True)
+                    for athlete_id in np.unique(athlete_ids).tolist():
+                        rows = athlete_ids == athlete_id
+                        chunks.append((video_id, frames[rows], landmarks[rows], interpolated[rows], athlete_id,
+                                       position_name))
+        # The frames are already in video_summaries
+        self.update_summaries([], summarize_landmarks(chunks)[1] + position_rows, replace_positions=video_ids)
+
+    def summarize_pose_data(self, video_id, position_name, start_frame=None, end_frame=None):
+        """
+        Add up the per-landmark rows of a frame range into position_summaries
+        rows, one per athlete, for videos stored without pose_frames.
+        """
+        frames = func.count(func.distinct(PoseData.frame))
+        interpolated = func.count(func.distinct(PoseData.frame)).filter(PoseData.interpolated == true())
+        query = select(PoseData.athlete_id, frames, interpolated, func.sum(PoseData.visibility),
+                       func.min(PoseData.frame), func.max(PoseData.frame))
+        query = query.where(PoseData.video_id == video_id)
+        if start_frame is not None:
+            query = query.where(PoseData.frame >= start_frame)
+        if end_frame is not None:
+            query = query.where(PoseData.frame <= end_frame)
+        return [
+            {'position_name': position_name, 'video_id': video_id, 'athlete_id': athlete_id, 'frames': count,
+             'detected_frames': count - filled, 'interpolated_frames': filled, 'visibility_sum': visibility or 0.0,
+             'first_frame': first, 'last_frame': last}
+            for athlete_id, count, filled, visibility, first, last
+            in self.session.execute(query.group_by(PoseData.athlete_id)).all()
+        ]
+
+    def update_summaries(self, video_rows, position_rows, watermarks=None, replace_positions=None):
+        """
+        Add increments from summarize_landmarks() to the summary tables, and
+        move the watermarks from landmark_watermarks() forward in the same transaction.
+        The position_summaries rows of the videos in replace_positions are
+        deleted first, so that position_rows replace them.
+        """
+        try:
+            if replace_positions:
+                self.session.query(PositionSummary).filter(
+                    PositionSummary.video_id.in_(replace_positions)).delete(synchronize_session=False)
+            if video_rows:
+                self.session.execute(text(summary_upsert_sql('video_summaries', ('video_id',))), video_rows)
+            if position_rows:
+                self.session.execute(
+                    text(summary_upsert_sql('position_summaries', ('position_name', 'video_id', 'athlete_id'))),
+                    position_rows)
+            if watermarks:
+                self.session.execute(text(watermark_upsert_sql()), watermarks)
+            self.session.commit()
+        except Exception as e:
+            logging.exception("Failed to update the summaries.")
+            self.session.rollback()
+            raise e
+
+    def delete_summaries(self, video_id):
+        """
+        Remove the summary rows of a video, before they are rebuilt.
+        """
+        try:
+            self.session.query(PositionSummary).filter(PositionSummary.video_id == video_id).delete()
+            self.session.query(VideoSummary).filter(VideoSummary.video_id == video_id).delete()
+            self.session.commit()
+        except Exception as e:
+            logging.exception(f"Failed to delete the summaries of video {video_id}.")
+            self.session.rollback()
+            raise e
+
+    def get_video_summaries(self, video_id=None, position_name=None, limit=None, offset=0):
+        """
+        Read video_summaries rows joined with their video, ordered by video id.
+
+        Args:
+            video_id (int): Only this video, or None for all.
+            position_name (str): Only videos with frames in this position.
+            limit (int): Maximum number of rows, or None for all.
+            offset (int): Rows to skip, for paging.
+
+        Returns:
+            list of dict: The summary columns plus the source, fps and
+            position_name of the video.
+        """
+        query = select(VideoSummary, Video.source, Video.fps, Video.position_name).join(
+            Video, Video.id == VideoSummary.video_id)
+        if video_id is not None:
+            query = query.where(VideoSummary.video_id == video_id)
+        if position_name is not None:
+            videos = select(PositionSummary.video_id).where(PositionSummary.position_name == position_name)
+            query = query.where(VideoSummary.video_id.in_(videos))
+        query = query.order_by(VideoSummary.video_id).offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return [
+            dict(_summary_columns(summary), video_id=summary.video_id, source=source, fps=fps,
+                 position_name=video_position)
+            for summary, source, fps, video_position in self.session.execute(query).all()
+        ]
+
+    def get_position_summaries(self, position_name=None, video_id=None):
+        """
+        Read position_summaries rows with the fps of their video, ordered by
+        position, video and athlete.
+
+        Returns:
+            list of dict: position_name, video_id, athlete_id, fps and the summary columns.
+        """
+        query = select(PositionSummary, Video.fps).join(Video, Video.id == PositionSummary.video_id)
+        if position_name is not None:
+            query = query.where(PositionSummary.position_name == position_name)
+        if video_id is not None:
+            query = query.where(PositionSummary.video_id == video_id)
+        query = query.order_by(PositionSummary.position_name, PositionSummary.video_id, PositionSummary.athlete_id)
+        return [
+            dict(_summary_columns(summary), position_name=summary.position_name, video_id=summary.video_id,
+                 athlete_id=summary.athlete_id, fps=fps)
+            for summary, fps in self.session.execute(query).all()
+        ]
+
+    def read_landmark_track(self, video_id, landmark_id, start_frame=None, end_frame=None, athlete_id=None):
+        """
+        Read one landmark over a frame range, from the per-landmark table when
+        the storage mode keeps it, through the (video_id, landmark_id, frame) index.
+
+        Returns:
+            tuple: (frames, values, athlete_ids), values of shape (N, 3) holding
+            x, y and visibility, ordered by frame and athlete.
+        """
+        if self.storage_mode == STORAGE_FRAMES:
+            frames, landmarks, athlete_ids = self.read_pose_frames(video_id, start_frame, end_frame,
+                                                                   athlete_id=athlete_id, with_athletes=True)
+            return frames, landmarks[:, landmark_id, [0, 1, 3]], athlete_ids
+        query = select(PoseData.frame, PoseData.x, PoseData.y, PoseData.visibility, PoseData.athlete_id)
+        query = query.where(PoseData.video_id == video_id, PoseData.landmark_id == landmark_id)
+        if start_frame is not None:
+            query = query.where(PoseData.frame >= start_frame)
+        if end_frame is not None:
+            query = query.where(PoseData.frame <= end_frame)
+        if athlete_id is not None:
+            query = query.where(PoseData.athlete_id == athlete_id)
+        rows = self.session.execute(query.order_by(PoseData.frame, PoseData.athlete_id)).all()
+        frames = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        values = np.array([row[1:4] for row in rows], dtype=np.float32).reshape(len(rows), 3)
+        athlete_ids = np.fromiter((row[4] for row in rows), dtype=np.int64, count=len(rows))
+        return frames, values, athlete_ids
+
+    def get_watermarks(self, video_id):
+        """
+        Return the last committed frame of every track of a video, as {athlete_id: frame}.
+        """
+        query = select(IngestWatermark.athlete_id, IngestWatermark.frame).where(IngestWatermark.video_id == video_id)
+        return {athlete_id: frame for athlete_id, frame in self.session.execute(query).all()}
+
+    def discard_uncommitted(self, video_id, resume_frame):
+        """
+        Before a video is resumed, delete the rows its watermarks do not
+        cover: landmarks committed without their watermark (inline inserts
+        interrupted between the two), unsmoothed landmarks after resume_frame,
+        and the kinematic features, which are computed again.
+
+        Args:
+            video_id (int): Id of the video.
+            resume_frame (int): Stored frame number processing resumes after.
+        """
+        try:
+            watermarks = self.get_watermarks(video_id)
+            for model in (PoseFrame, PoseData):
+                query = self.session.query(model).filter(model.video_id == video_id)
+                query.filter(model.athlete_id.notin_(list(watermarks))).delete(synchronize_session=False)
+                for athlete_id, frame in watermarks.items():
+                    query.filter(model.athlete_id == athlete_id, model.frame > frame).delete(synchronize_session=False)
+            self.session.query(RawPoseFrame).filter(
+                RawPoseFrame.video_id == video_id, RawPoseFrame.frame > resume_frame).delete(synchronize_session=False)
+            self.session.query(PoseFeature).filter(PoseFeature.video_id == video_id).delete(synchronize_session=False)
+            self.session.commit()
+        except Exception as e:
+            logging.exception(f"Failed to discard the uncommitted rows of video {video_id}.")
+            self.session.rollback()
+            raise e
+
+    def get_segment_labels(self, batch_id=None, video_id=None):
+        """
+        Return the labels of a batch, or of a video, as dicts in the order they
+        were registered.
+        """
+        query = self.session.query(SegmentLabel)
+        if batch_id is not None:
+            query = query.filter(SegmentLabel.batch_id == batch_id)
+        if video_id is not None:
+            query = query.filter(SegmentLabel.video_id == video_id)
+        rows = query.order_by(SegmentLabel.id).all()
+        return [
+            {
+                'id': row.id,
+                'batch_id': row.batch_id,
+                'video_id': row.video_id,
+                'position_name': row.position_name,
+                'start_time': row.start_time,
+                'end_time': row.end_time,
+                'start_frame': row.start_frame,
+                'end_frame': row.end_frame,
+            }
+            for row in rows
+        ]
+
+    def insert_position_predictions(self, video_id, predictions):
+        """
+        Store predicted positions of a video.
+
+        Args:
+            video_id (int): Id of the video.
+            predictions (list of dict): athlete_id, start_frame, end_frame,
+                start_time, end_time, position_name and confidence of each window.
+        """
+        if not predictions:
+            return
+        try:
+            self.session.execute(insert(PositionPrediction), [dict(prediction, video_id=video_id) for prediction in predictions])
+            self.session.commit()
+            logging.info(f"Inserted {len(predictions)} position predictions for video {video_id}.")
+        except Exception as e:
+            logging.exception("Failed to insert position predictions into the database.")
+            self.session.rollback()
+            raise e
+
+    def get_position_predictions(self, video_id, athlete_id=None):
+        """
+        Return the predicted positions of a video as dicts, ordered by frame and athlete.
+        """
+        query = self.session.query(PositionPrediction).filter(PositionPrediction.video_id == video_id)
+        if athlete_id is not None:
+            query = query.filter(PositionPrediction.athlete_id == athlete_id)
+        rows = query.order_by(PositionPrediction.start_frame, PositionPrediction.athlete_id).all()
+        return [
+            {
+                'athlete_id': row.athlete_id,
+                'start_frame': row.start_frame,
+                'end_frame': row.end_frame,
+                'start_time': row.start_time,
+                'end_time': row.end_time,
+                'position_name': row.position_name,
+                'confidence': row.confidence,
+            }
+            for row in rows
+        ]
+
+    def list_video_ids(self):
+        """
+        Return the ids of all video rows in increasing order.
+        """
+        return [row[0] for row in self.session.execute(select(Video.id).order_by(Video.id)).all()]
+
+    def store_landmarks(self, video_id, frames, landmarks, position_name=None, interpolated=None, athlete_id=0):
+        """
+        Store the landmarks of several frames according to the storage mode.
+
+        Args:
+            video_id (int): Id of the video the frames belong to.
+            frames (array-like): Frame numbers, shape (N,).
+            landmarks (numpy.ndarray): Landmarks, shape (N, NUM_LANDMARKS, LANDMARK_FIELDS).
+            position_name (str): Name of the BJJ position, for the per-landmark table.
+            interpolated (array-like): Booleans of shape (N,) marking interpolated
+                frames, or None if all were detected.
+            athlete_id (int): Track of the athlete the landmarks belong to.
+
+        Returns:
+            int: Number of rows inserted.
+        """
+        if len(frames) == 0:
+            return 0
+        rows = 0
+        flags = [False] * len(frames) if interpolated is None else [bool(flag) for flag in interpolated]
+        if self.storage_mode in (STORAGE_FRAMES, STORAGE_BOTH):
+            self.insert_pose_frames(video_id, frames, landmarks, flags, athlete_id)
+            rows += len(frames)
+        if self.storage_mode in (STORAGE_LANDMARKS, STORAGE_BOTH):
+            data = []
+            for frame, frame_landmarks, flag in zip(frames, landmarks.tolist(), flags):
+                for idx, (x, y, z, visibility) in enumerate(frame_landmarks):
+                    item = {'video_id': video_id, 'frame': int(frame), 'landmark_id': idx, 'x': x, 'y': y,
+                            'visibility': visibility, 'interpolated': flag, 'athlete_id': int(athlete_id)}
+                    if position_name:
+                        item['position_name'] = position_name
+                    data.append(item)
+            self.insert_pose_data(data)
+            rows += len(data)
+        self.update_summaries(*summarize_landmarks([(video_id, frames, landmarks, interpolated, athlete_id, position_name)]),
+                              watermarks=landmark_watermarks([(video_id, frames, athlete_id)]))
+        return rows
+
+    def insert_pose_frames(self, video_id, frames, landmarks, interpolated=None, athlete_id=0):
+        """
+        Insert one compact row per frame.
+
+        Args:
+            video_id (int): Id of the video the frames belong to.
+            frames (array-like): Frame numbers, shape (N,).
+            landmarks (numpy.ndarray): Landmarks, shape (N, NUM_LANDMARKS, LANDMARK_FIELDS).
+            interpolated (array-like): Booleans of shape (N,) marking interpolated
+                frames, or None if all were detected.
+            athlete_id (int): Track of the athlete the landmarks belong to.
+        """
+        try:
+            landmarks = np.ascontiguousarray(landmarks, dtype=np.float32)
+            flags = [False] * len(landmarks) if interpolated is None else [bool(flag) for flag in interpolated]
+            rows = [
+                {'video_id': video_id, 'frame': int(frame), 'athlete_id': int(athlete_id),
+                 'landmarks': frame_landmarks.tobytes(), 'interpolated': flag}
+                for frame, frame_landmarks, flag in zip(frames, landmarks, flags)
+            ]
+            self.session.execute(insert(PoseFrame), rows)
+            self.session.commit()
+            logging.debug(f"Inserted {len(rows)} frames into the database.")
+        except Exception as e:
+            logging.exception("Failed to insert pose frames into the database.")
+            self.session.rollback()
+            raise e
+
+    def insert_raw_pose_frames(self, video_id, frames, landmarks, athlete_ids=None):
+        """
+        Insert the detected landmarks of several frames as they were before smoothing.
+
+        Args:
+            video_id (int): Id of the video the frames belong to.
+            frames (array-like): Frame numbers, shape (N,).
+            landmarks (numpy.ndarray): Landmarks, shape (N, NUM_LANDMARKS, LANDMARK_FIELDS).
+            athlete_ids (array-like): Athlete of each frame, shape (N,), or None for athlete 0.
+        """
+        if len(frames) == 0:
+            return
+        try:
+            landmarks = np.ascontiguousarray(landmarks, dtype=np.float32)
+            athlete_ids = [0] * len(frames) if athlete_ids is None else athlete_ids
+            rows = [
+                {'video_id': video_id, 'frame': int(frame), 'athlete_id': int(athlete_id),
+                 'landmarks': frame_landmarks.tobytes()}
+                for frame, frame_landmarks, athlete_id in zip(frames, landmarks, athlete_ids)
+            ]
+            self.session.execute(insert(RawPoseFrame), rows)
+            self.session.commit()
+            logging.debug(f"Inserted {len(rows)} raw frames into the database.")
+        except Exception as e:
+            logging.exception("Failed to insert raw pose frames into the database.")
+            self.session.rollback()
+            raise e
+
+    def read_raw_pose_frames(self, video_id, start_frame=None, end_frame=None, athlete_id=None):
+        """
+        Read the landmarks of a frame range as they were detected, before
+        smoothing, for videos processed with smoothing_keep_raw.
+
+        Returns:
+            tuple: (frames, landmarks, athlete_ids) as NumPy arrays, ordered by frame and athlete.
+        """
+        query = select(RawPoseFrame.frame, RawPoseFrame.landmarks, RawPoseFrame.athlete_id)
+        query = query.where(RawPoseFrame.video_id == video_id)
+        if athlete_id is not None:
+            query = query.where(RawPoseFrame.athlete_id == athlete_id)
+        if start_frame is not None:
+            query = query.where(RawPoseFrame.frame >= start_frame)
+        if end_frame is not None:
+            query = query.where(RawPoseFrame.frame <= end_frame)
+        rows = self.session.execute(query.order_by(RawPoseFrame.frame, RawPoseFrame.athlete_id)).all()
+
+        frames = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        landmarks = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32)
+        landmarks = landmarks.reshape(len(rows), NUM_LANDMARKS, LANDMARK_FIELDS)
+        athlete_ids = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+        return frames, landmarks, athlete_ids
+
+    def insert_pose_features(self, video_id, frames, features, athlete_id=0):
+        """
+        Insert the kinematic features of several frames, one row per frame.
+
+        Args:
+            video_id (int): Id of the video the frames belong to.
+            frames (array-like): Frame numbers, shape (N,).
+            features (numpy.ndarray): Features, shape (N, F).
+            athlete_id (int): Track of the athlete the features belong to.
+        """
+        if len(frames) == 0:
+            return
+        try:
+            features = np.ascontiguousarray(features, dtype=np.float32)
+            rows = [
+                {'video_id': video_id, 'frame': int(frame), 'athlete_id': int(athlete_id),
+                 'features': frame_features.tobytes()}
+                for frame, frame_features in zip(frames, features)
+            ]
+            self.session.execute(insert(PoseFeature), rows)
+            self.session.commit()
+            logging.info(f"Inserted features of {len(rows)} frames into the database.")
+        except Exception as e:
+            logging.exception("Failed to insert pose features into the database.")
+            self.session.rollback()
+            raise e
+
+    def read_pose_features(self, video_id, start_frame=None, end_frame=None, athlete_id=None):
+        """
+        Read the kinematic features of a frame range as NumPy arrays.
+
+        Args:
+            video_id (int): Id of the video.
+            start_frame (int): First frame number to include, or None for the start.
+            end_frame (int): Last frame number to include, or None for the end.
+            athlete_id (int): Only read the features of this athlete, or None for all athletes.
+
+        Returns:
+            tuple: (frames, features, athlete_ids) with frames and athlete_ids of
+            shape (N,) and features of shape (N, F), ordered by frame and athlete.
+        """
+        query = select(PoseFeature.frame, PoseFeature.features, PoseFeature.athlete_id)
+        query = query.where(PoseFeature.video_id == video_id)
+        if athlete_id is not None:
+            query = query.where(PoseFeature.athlete_id == athlete_id)
+        if start_frame is not None:
+            query = query.where(PoseFeature.frame >= start_frame)
+        if end_frame is not None:
+            query = query.where(PoseFeature.frame <= end_frame)
+        rows = self.session.execute(query.order_by(PoseFeature.frame, PoseFeature.athlete_id)).all()
+
+        frames = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        features = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32)
+        features = features.reshape(len(rows), -1) if rows else features.reshape(0, 0)
+        athlete_ids = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+        return frames, features, athlete_ids
+
+    def iter_pose_features(self, video_id, chunk_rows=10000):
+        """
+        Stream the kinematic features of a video in chunks, ordered by frame and athlete.
+
+        Yields:
+            tuple: (frames, features, athlete_ids) NumPy arrays of at most chunk_rows rows.
+        """
+        query = select(PoseFeature.frame, PoseFeature.features, PoseFeature.athlete_id)
+        query = query.where(PoseFeature.video_id == video_id).order_by(PoseFeature.frame, PoseFeature.athlete_id)
+        result = self.session.execute(query.execution_options(yield_per=chunk_rows))
+        for rows in result.partitions():
+            frames = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            features = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            athlete_ids = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+            yield frames, features, athlete_ids
+
+    def count_pose_features(self, video_id):
+        """
+        Return the number of feature rows stored for a video.
+        """
+        query = select(func.count()).select_from(PoseFeature).where(PoseFeature.video_id == video_id)
+        return self.session.execute(query).scalar()
+
+    def has_pose_features(self, video_id):
+        """
+        Return whether features are stored for any frame of a video.
+        """
+        query = select(PoseFeature.frame).where(PoseFeature.video_id == video_id).limit(1)
+        return self.session.execute(query).first() is not None
+
+    def read_pose_frames(self, video_id, start_frame=None, end_frame=None, include_interpolated=True,
+                         with_flags=False, athlete_id=None, with_athletes=False):
+        """
+        Read the landmarks of a frame range as NumPy arrays.
+
+        Args:
+            video_id (int): Id of the video.
+            start_frame (int): First frame number to include, or None for the start.
+            end_frame (int): Last frame number to include, or None for the end.
+            include_interpolated (bool): False to only read detected frames.
+            with_flags (bool): Also return which frames were interpolated.
+            athlete_id (int): Only read the landmarks of this athlete, or None for
+                all athletes.
+            with_athletes (bool): Also return the athlete of each row.
+
+        Returns:
+            tuple: (frames, landmarks) with frames of shape (N,) and landmarks of
+            shape (N, NUM_LANDMARKS, LANDMARK_FIELDS), ordered by frame and
+            athlete; with with_flags, a boolean array of shape (N,) follows, and
+            with with_athletes an int array of shape (N,) of athlete ids.
+        """
+        query = select(PoseFrame.frame, PoseFrame.landmarks, PoseFrame.interpolated, PoseFrame.athlete_id)
+        query = query.where(PoseFrame.video_id == video_id)
+        if athlete_id is not None:
+            query = query.where(PoseFrame.athlete_id == athlete_id)
+        if start_frame is not None:
+            query = query.where(PoseFrame.frame >= start_frame)
+        if end_frame is not None:
+            query = query.where(PoseFrame.frame <= end_frame)
+        if not include_interpolated:
+            query = query.where(PoseFrame.interpolated == false())
+        rows = self.session.execute(query.order_by(PoseFrame.frame, PoseFrame.athlete_id)).all()
+
+        frames = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        landmarks = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32)
+        landmarks = landmarks.reshape(len(rows), NUM_LANDMARKS, LANDMARK_FIELDS)
+        result = (frames, landmarks)
+        if with_flags:
+            result += (np.fromiter((bool(row[2]) for row in rows), dtype=bool, count=len(rows)),)
+        if with_athletes:
+            result += (np.fromiter((row[3] for row in rows), dtype=np.int64, count=len(rows)),)
+        return result
+
+    def iter_pose_frames(self, video_id, chunk_rows=10000):
+        """
+        Stream the landmarks of a video in chunks, ordered by frame and athlete,
+        so a whole video can be read in constant memory. Rows are fetched
+        chunk_rows at a time, through a server-side cursor on PostgreSQL.
+
+        Yields:
+            tuple: (frames, landmarks, interpolated, athlete_ids) NumPy arrays of
+            at most chunk_rows rows, as read_pose_frames() with with_flags and with_athletes.
+        """
+        query = select(PoseFrame.frame, PoseFrame.landmarks, PoseFrame.interpolated, PoseFrame.athlete_id)
+        query = query.where(PoseFrame.video_id == video_id).order_by(PoseFrame.frame, PoseFrame.athlete_id)
+        result = self.session.execute(query.execution_options(yield_per=chunk_rows))
+        for rows in result.partitions():
+            frames = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            landmarks = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32)
+            landmarks = landmarks.reshape(len(rows), NUM_LANDMARKS, LANDMARK_FIELDS)
+            interpolated = np.fromiter((bool(row[2]) for row in rows), dtype=bool, count=len(rows))
+            athlete_ids = np.fromiter((row[3] for row in rows), dtype=np.int64, count=len(rows))
+            yield frames, landmarks, interpolated, athlete_ids
+
+    def count_pose_frames(self, video_id):
+        """
+        Return the number of landmark rows stored for a video in pose_frames.
+        """
+        query = select(func.count()).select_from(PoseFrame).where(PoseFrame.video_id == video_id)
+        return self.session.execute(query).scalar()
+
     def close(self):
         """
         Close the database session.
         """
         try:
+            # Returns the connection to the pool of the shared engine
             self.session.close()
-            logging.info("Database session closed.")
+            logging.debug("Database session closed.")
         except Exception as e:
             logging.exception("Failed to close the database session.")
             raise e
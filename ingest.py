@@ -0,0 +1,325 @@
+# ingest.py
+
+import io
+import queue
+import threading
+import time
+import logging
+
+import numpy as np
+
+from database import (STORAGE_FRAMES, STORAGE_LANDMARKS, STORAGE_BOTH, summarize_landmarks, summary_upsert_sql,
+                      landmark_watermarks, watermark_upsert_sql)
+from metrics import get_metrics
+
+# Marks the end of the stream for the writer thread
+_END = object()
+
+
+class IngestError(Exception):
+    """Raised when the background writer failed to store landmarks."""
+
+
+class BulkIngestor:
+    """
+    Writes landmarks to the database on a background thread in large batches.
+
+    The frame loop only hands arrays over through a bounded queue, so it never
+    waits on the database unless the writer falls behind by more than
+    queue_size submitted chunks (each of one or more frames, up to
+    landmark_chunk_frames from the frame loop). Batches are flushed once flush_rows frames are pending or
+    flush_seconds have passed since the oldest pending frame arrived, each in a
+    single transaction. PostgreSQL uses COPY; SQLite uses a prepared executemany
+    with the write-ahead log enabled. The video and position summaries, and
+    the watermark of each track, are updated in the same transaction.
+    """
+
+    def __init__(self, db, flush_rows=500, flush_seconds=2.0, queue_size=1000):
+        """
+        Args:
+            db (Database): Database whose engine and storage mode are used.
+            flush_rows (int): Number of pending frames that triggers a flush.
+            flush_seconds (float): Maximum time a frame waits before it is flushed.
+            queue_size (int): Maximum number of submitted chunks waiting for the
+                writer; a chunk holds the frames of one submit() call.
+        """
+        self.engine = db.engine
+        self.storage_mode = db.storage_mode
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._error = None
+        self._stats = {
+            'frames': 0,
+            'rows': 0,
+            'flushes': 0,
+            'flush_seconds_total': 0.0,
+            'flush_seconds_max': 0.0,
+        }
+        self._started = time.perf_counter()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ingest', daemon=True)
+        self._thread.start()
+        # SQLite refuses to switch to the write-ahead log while another
+        # connection writes, so nothing else may write before the writer is set up
+        self._ready.wait()
+
+    @classmethod
+    def from_config(cls, db, config):
+        """
+        Create an ingestor with the ingest_* settings of the configuration.
+        """
+        return cls(
+            db,
+            flush_rows=config.getint('ingest_flush_rows', fallback=500),
+            flush_seconds=config.getfloat('ingest_flush_seconds', fallback=2.0),
+            queue_size=config.getint('ingest_queue_size', fallback=1000)
+        )
+
+    def submit(self, video_id, frames, landmarks, position_name=None, release=None, interpolated=None, athlete_id=0):
+        """
+        Queue the landmarks of one or more frames for storage.
+
+        Args:
+            video_id (int): Id of the video the frames belong to.
+            frames (array-like): Frame numbers, shape (N,).
+            landmarks (numpy.ndarray): Landmarks, shape (N, 33, 4).
+            position_name (str): Name of the BJJ position, for the per-landmark table.
+            release (callable): Optional, called once the arrays have been written
+                (or dropped after a failure), so their buffer can be reused.
+            interpolated (array-like): Booleans of shape (N,) marking interpolated
+                frames, or None if all were detected.
+            athlete_id (int): Track of the athlete the landmarks belong to.
+
+        Raises:
+            IngestError: If the writer thread has failed.
+        """
+        if self._error is not None:
+            if release is not None:
+                release()
+            raise IngestError("Background ingest failed") from self._error
+        frames = np.asarray(frames)
+        if interpolated is None:
+            interpolated = np.zeros(len(frames), dtype=bool)
+        self._queue.put((video_id, frames, np.asarray(landmarks, dtype=np.float32), position_name, release,
+                         np.asarray(interpolated, dtype=bool), int(athlete_id)))
+
+    def sync(self):
+        """
+        Wait until everything submitted so far has been committed.
+
+        Raises:
+            IngestError: If the writer thread has failed.
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+        if self._error is not None:
+            raise IngestError("Background ingest failed") from self._error
+
+    def close(self):
+        """
+        Flush everything that is pending and stop the writer thread.
+
+        Raises:
+            IngestError: If the writer thread has failed.
+        """
+        self._queue.put(_END)
+        self._thread.join()
+        if self._error is not None:
+            raise IngestError("Background ingest failed") from self._error
+        logging.info(f"Ingest stats: {self.stats()}")
+
+    def stats(self):
+        """
+        Return ingest statistics: frames and rows written, flush count,
+        rows per second since start and flush latency.
+        """
+        stats = dict(self._stats)
+        elapsed = time.perf_counter() - self._started
+        stats['rows_per_second'] = stats['rows'] / elapsed if elapsed > 0 else 0.0
+        stats['flush_seconds_mean'] = (
+            stats['flush_seconds_total'] / stats['flushes'] if stats['flushes'] else 0.0
+        )
+        return stats
+
+    def _run(self):
+        pending = []
+        pending_frames = 0
+        deadline = None
+        connection = None
+        try:
+            connection = self.engine.raw_connection()
+            if self.engine.dialect.name == 'sqlite':
+                cursor = connection.cursor()
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+                cursor.close()
+            self._ready.set()
+
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+
+                if item is _END:
+                    break
+                if isinstance(item, threading.Event):
+                    # A sync(): commit what is pending now instead of waiting for the batch to fill
+                    if pending:
+                        self._flush(connection, pending)
+                        _release(pending)
+                        pending = []
+                        pending_frames = 0
+                        deadline = None
+                    item.set()
+                    continue
+                if item is not None:
+                    if not pending:
+                        deadline = time.monotonic() + self.flush_seconds
+                    pending.append(item)
+                    pending_frames += len(item[1])
+
+                if pending and (pending_frames >= self.flush_rows or time.monotonic() >= deadline):
+                    self._flush(connection, pending)
+                    _release(pending)
+                    pending = []
+                    pending_frames = 0
+                    deadline = None
+
+            if pending:
+                self._flush(connection, pending)
+                _release(pending)
+        except Exception as e:
+            logging.exception("Background ingest failed.")
+            self._error = e
+            self._ready.set()
+            _release(pending)
+            # Keep draining so producers blocked on a full queue are released
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, threading.Event):
+                    item.set()
+                    continue
+                _release([item])
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _flush(self, connection, items):
+        start = time.perf_counter()
+        rows = 0
+        cursor = connection.cursor()
+        try:
+            if self.storage_mode in (STORAGE_FRAMES, STORAGE_BOTH):
+                rows += self._write_frames(cursor, items)
+            if self.storage_mode in (STORAGE_LANDMARKS, STORAGE_BOTH):
+                rows += self._write_landmarks(cursor, items)
+            self._write_summaries(cursor, items)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        seconds = time.perf_counter() - start
+        self._stats['frames'] += sum(len(item[1]) for item in items)
+        self._stats['rows'] += rows
+        self._stats['flushes'] += 1
+        self._stats['flush_seconds_total'] += seconds
+        self._stats['flush_seconds_max'] = max(self._stats['flush_seconds_max'], seconds)
+        registry = get_metrics()
+        registry.observe('pose_db_flush_seconds', seconds, writer='background')
+        registry.inc('pose_db_rows_total', rows, writer='background')
+        registry.set('pose_queue_depth', self._queue.qsize(), queue='ingest')
+        logging.debug(f"Flushed {rows} rows in {seconds:.4f} seconds.")
+
+    def _write_frames(self, cursor, items):
+        if self.engine.dialect.name == 'postgresql':
+            buffer = io.StringIO()
+            count = 0
+            for video_id, frames, landmarks, _, _, interpolated, athlete_id in items:
+                for frame, frame_landmarks, flag in zip(frames.tolist(), landmarks, interpolated.tolist()):
+                    # bytea in COPY text format: hex with an escaped backslash
+                    buffer.write(f"{video_id}\t{frame}\t{athlete_id}\t\\\\x{frame_landmarks.tobytes().hex()}"
+                                 f"\t{'t' if flag else 'f'}\n")
+                    count += 1
+            buffer.seek(0)
+            cursor.copy_expert('COPY pose_frames (video_id, frame, athlete_id, landmarks, interpolated) FROM STDIN', buffer)
+            return count
+
+        rows = [
+            (video_id, frame, athlete_id, frame_landmarks.tobytes(), flag)
+            for video_id, frames, landmarks, _, _, interpolated, athlete_id in items
+            for frame, frame_landmarks, flag in zip(frames.tolist(), landmarks, interpolated.tolist())
+        ]
+        columns = ('video_id', 'frame', 'athlete_id', 'landmarks', 'interpolated')
+        cursor.executemany(self._insert_sql('pose_frames', columns), rows)
+        return len(rows)
+
+    def _write_summaries(self, cursor, items):
+        video_rows, position_rows = summarize_landmarks(
+            (video_id, frames, landmarks, interpolated, athlete_id, position_name)
+            for video_id, frames, landmarks, position_name, _, interpolated, athlete_id in items
+        )
+        marker = ':{}' if self.engine.dialect.name == 'sqlite' else '%({})s'
+        if video_rows:
+            cursor.executemany(summary_upsert_sql('video_summaries', ('video_id',), marker), video_rows)
+        if position_rows:
+            cursor.executemany(
+                summary_upsert_sql('position_summaries', ('position_name', 'video_id', 'athlete_id'), marker),
+                position_rows)
+        watermarks = landmark_watermarks((video_id, frames, athlete_id) for video_id, frames, *_, athlete_id in items)
+        if watermarks:
+            cursor.executemany(watermark_upsert_sql(marker), watermarks)
+
+    def _write_landmarks(self, cursor, items):
+        columns = ('video_id', 'frame', 'landmark_id', 'x', 'y', 'visibility', 'position_name', 'interpolated',
+                   'athlete_id')
+        rows = [
+            (video_id, frame, idx, x, y, visibility, position_name, flag, athlete_id)
+            for video_id, frames, landmarks, position_name, _, interpolated, athlete_id in items
+            for frame, frame_landmarks, flag in zip(frames.tolist(), landmarks.tolist(), interpolated.tolist())
+            for idx, (x, y, _z, visibility) in enumerate(frame_landmarks)
+        ]
+        if self.engine.dialect.name == 'postgresql':
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write('\t'.join(_copy_value(value) for value in row) + '\n')
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY pose_data ({', '.join(columns)}) FROM STDIN", buffer)
+            return len(rows)
+
+        cursor.executemany(self._insert_sql('pose_data', columns), rows)
+        return len(rows)
+
+    def _insert_sql(self, table, columns):
+        marker = '?' if self.engine.dialect.paramstyle == 'qmark' else '%s'
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([marker] * len(columns))})"
+
+
+def _release(items):
+    """
+    Call the release callbacks of queued items.
+    """
+    for item in items:
+        if item[4] is not None:
+            item[4]()
+
+
+def _copy_value(value):
+    """
+    Format a value for PostgreSQL COPY text format.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,257 @@
+# jobs.py
+
+import os
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+from metrics import RunProfile, collect_profiles
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its limit."""
+
+
+class JobStore:
+    """
+    Persists jobs in a local SQLite file so they survive an API restart.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the SQLite file.
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    frames_done INTEGER NOT NULL DEFAULT 0,
+                    total_frames INTEGER,
+                    ranges TEXT,
+                    result TEXT,
+                    result_path TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, created_at)')
+            # Job files written before per-range progress existed
+            columns = [row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')]
+            if 'ranges' not in columns:
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN ranges TEXT')
+
+    def create(self, job_id, kind, params):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO jobs (id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), QUEUED, now, now)
+            )
+
+    def update(self, job_id, **fields):
+        for name in ('result', 'ranges'):
+            if fields.get(name) is not None:
+                fields[name] = json.dumps(fields[name])
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, status=None, limit=100):
+        query = 'SELECT * FROM jobs'
+        args = []
+        if status:
+            query += ' WHERE status = ?'
+            args.append(status)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count(self, status):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (status,)).fetchone()[0]
+
+    def unfinished(self):
+        """
+        Return the ids of queued and running jobs, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at',
+                (QUEUED, RUNNING)
+            ).fetchall()
+        return [row['id'] for row in rows]
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['ranges'] = json.loads(job['ranges']) if job['ranges'] else None
+        return job
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a bounded pool of background threads.
+
+    Jobs are looked up by kind in ``handlers``. A handler is called as
+    handler(params, progress_callback) and returns a dict describing the result;
+    its 'output_video' entry is recorded as the job's result path, and the
+    profiles of the videos it processed are summed up as its 'metrics'. Handlers of
+    jobs made of several ranges may pass the progress of each as
+    progress_callback(frames_done, total_frames, ranges). Jobs started
+    with run_now() may pass extra keyword arguments to their handler.
+    """
+
+    def __init__(self, store, handlers, max_workers=2, max_queued=20):
+        """
+        Args:
+            store (JobStore): Where jobs are persisted.
+            handlers (dict): Maps a job kind to the function that runs it.
+            max_workers (int): Number of jobs that may run at the same time.
+            max_queued (int): Number of jobs that may wait; more are rejected.
+        """
+        self.store = store
+        self.handlers = handlers
+        self.max_workers = max(1, max_workers)
+        self.max_queued = max(1, max_queued)
+        self._queue = queue.Queue()
+        self._submit_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """
+        Requeue jobs left over from a previous run and start the worker threads.
+        """
+        pending = self.store.unfinished()
+        for job_id in pending:
+            # Jobs interrupted by a restart are run again from the beginning;
+            # long videos resume from their last checkpoint (checkpoint.py)
+            self.store.update(job_id, status=QUEUED, frames_done=0, ranges=None)
+            self._queue.put(job_id)
+        if pending:
+            logging.info(f"Requeued {len(pending)} unfinished jobs.")
+
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def new_job_id(self):
+        return uuid.uuid4().hex
+
+    def submit(self, kind, params, job_id=None):
+        """
+        Queue a job and return its id without waiting for it to run.
+
+        Raises:
+            QueueFullError: If max_queued jobs are already waiting.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._submit_lock:
+            if self.store.count(QUEUED) >= self.max_queued:
+                raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting)")
+            job_id = job_id or self.new_job_id()
+            self.store.create(job_id, kind, params)
+        self._queue.put(job_id)
+        logging.info(f"Queued {kind} job {job_id}.")
+        return job_id
+
+    def run_now(self, kind, params, job_id=None, **handler_kwargs):
+        """
+        Start a job on its own thread right away instead of queueing it.
+
+        For jobs that consume a live request body and so cannot wait for a free
+        worker. Extra keyword arguments are passed to the handler but not
+        persisted; if such a job is requeued after a restart, its handler is
+        called without them.
+
+        Returns:
+            threading.Thread: The thread running the job.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = job_id or self.new_job_id()
+        self.store.create(job_id, kind, params)
+        thread = threading.Thread(target=self._run, args=(job_id,), kwargs=handler_kwargs,
+                                  name=f"job-{job_id}", daemon=True)
+        thread.start()
+        logging.info(f"Started {kind} job {job_id}.")
+        return thread
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception:
+                logging.exception(f"Job worker failed on job {job_id}.")
+
+    def _run(self, job_id, **handler_kwargs):
+        job = self.store.get(job_id)
+        if job is None or job['status'] != QUEUED:
+            return
+        self.store.update(job_id, status=RUNNING, error=None)
+        logging.info(f"Running {job['kind']} job {job_id}.")
+
+        last_update = 0.0
+
+        def progress_callback(frames_done, total_frames, ranges=None):
+            nonlocal last_update
+            # Persist progress at most once per second
+            now = time.monotonic()
+            if now - last_update >= 1.0 or frames_done == total_frames:
+                last_update = now
+                if ranges is None:
+                    self.store.update(job_id, frames_done=frames_done, total_frames=total_frames)
+                else:
+                    self.store.update(job_id, frames_done=frames_done, total_frames=total_frames, ranges=ranges)
+
+        try:
+            with collect_profiles() as profiles:
+                result = self.handlers[job['kind']](job['params'], progress_callback, **handler_kwargs)
+            if profiles and isinstance(result, dict):
+                result = dict(result, metrics=RunProfile.combine(profiles, name=job_id).summary())
+            self.store.update(
+                job_id,
+                status=DONE,
+                result=result,
+                result_path=(result or {}).get('output_video')
+            )
+            logging.info(f"Job {job_id} finished.")
+        except Exception as e:
+            logging.exception(f"Job {job_id} failed.")
+            self.store.update(job_id, status=FAILED, error=str(e))
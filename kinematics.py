@@ -0,0 +1,238 @@
+# kinematics.py
+
+import logging
+
+import numpy as np
+
+from position_classifier import ANGLE_JOINTS
+
+# Stored per frame, in this order. Angles are in degrees; hip_height, hip_x and
+# hip_y in normalized frame coordinates, hip_height measured up from the bottom
+# edge; speeds in frame heights per second.
+FEATURE_NAMES = [
+    'left_elbow_angle', 'right_elbow_angle', 'left_shoulder_angle', 'right_shoulder_angle',
+    'left_hip_angle', 'right_hip_angle', 'left_knee_angle', 'right_knee_angle',
+    'torso_angle', 'hip_height', 'hip_x', 'hip_y',
+    'hip_speed', 'left_wrist_speed', 'right_wrist_speed', 'left_ankle_speed', 'right_ankle_speed',
+]
+NUM_FEATURES = len(FEATURE_NAMES)
+
+# Landmarks whose speed is tracked, after the hip centre
+SPEED_LANDMARKS = [15, 16, 27, 28]
+
+
+def kinematics_settings(config):
+    """
+    Read the kinematics settings from the configuration.
+    """
+    return {
+        'kinematics_enabled': config.getboolean('kinematics_enabled', fallback=True),
+        'kinematics_flush_frames': config.getint('kinematics_flush_frames', fallback=500),
+    }
+
+
+def frame_kinematics(frames, landmarks, fps, aspect=1.0):
+    """
+    Compute the features of FEATURE_NAMES for consecutive frames of one athlete.
+
+    Speeds are central differences over the neighbouring frames, weighted by
+    their actual spacing, so frames that were not stored are allowed for.
+    The first and last frame only have a one-sided difference.
+
+    Args:
+        frames (numpy.ndarray): Frame numbers in increasing order, shape (N,).
+        landmarks (numpy.ndarray): Landmarks, shape (N, 33, 4), normalized coordinates.
+        fps (float): Frame rate, to turn frame numbers into seconds.
+        aspect (float): Frame width over height.
+
+    Returns:
+        numpy.ndarray: float32 features, shape (N, NUM_FEATURES).
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32)
+    points = landmarks[..., :2] * np.array([aspect, 1.0], dtype=np.float32)
+
+    joints = np.array(ANGLE_JOINTS)
+    first = points[:, joints[:, 0]] - points[:, joints[:, 1]]
+    second = points[:, joints[:, 2]] - points[:, joints[:, 1]]
+    cross = first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0]
+    angles = np.degrees(np.abs(np.arctan2(cross, (first * second).sum(axis=-1))))
+
+    hips = (points[:, 23] + points[:, 24]) / 2
+    torso = (points[:, 11] + points[:, 12]) / 2 - hips
+    # 0 degrees upright, 90 lying, 180 upside down; image y grows downwards
+    torso_angle = np.degrees(np.arctan2(np.abs(torso[:, 0]), -torso[:, 1]))
+    hip_y = (landmarks[:, 23, 1] + landmarks[:, 24, 1]) / 2
+    hip_x = (landmarks[:, 23, 0] + landmarks[:, 24, 0]) / 2
+
+    tracked = np.concatenate([hips[:, None], points[:, SPEED_LANDMARKS]], axis=1)
+    if len(frames) > 1:
+        seconds = np.asarray(frames, dtype=np.float64) / (fps or 30.0)
+        speeds = np.linalg.norm(np.gradient(tracked, seconds, axis=0), axis=-1)
+    else:
+        speeds = np.zeros(tracked.shape[:2])
+
+    return np.column_stack([angles, torso_angle, 1.0 - hip_y, hip_x, hip_y, speeds]).astype(np.float32)
+
+
+class KinematicsStage:
+    """
+    Computes the kinematic features of every stored frame while a video is processed.
+
+    Fed with the chunks of landmarks as they are persisted, detected and
+    interpolated alike, in any order within the stream of one athlete. A frame
+    is final once every frame before the second-to-last detected frame has
+    arrived: interpolated frames of a gap are stored with the detection that
+    ends it. Final frames are computed once, in one vectorized call per chunk,
+    together with their stored neighbours, so appending frames only computes
+    the new frames and the one before them whose speed waited on them.
+    """
+
+    def __init__(self, fps, aspect=1.0, on_features=None, flush_frames=500):
+        """
+        Args:
+            fps (float): Frame rate of the video.
+            aspect (float): Frame width over height.
+            on_features (callable): Called as on_features(frames, features, athlete_id)
+                with batches of at least flush_frames final frames, and with the
+                rest on close().
+            flush_frames (int): Final frames collected before on_features is called.
+        """
+        self.fps = fps or 30.0
+        self.aspect = aspect
+        self.on_features = on_features
+        self.flush_frames = max(1, flush_frames)
+        self._frames = {}
+        self._landmarks = {}
+        self._detected = {}
+        # Last final frame per athlete, the left neighbour of the next one
+        self._previous = {}
+        self._ready = {}
+        self.frames_computed = 0
+
+    def update(self, frames, landmarks, interpolated=None, athlete_id=0):
+        """
+        Add a chunk of stored landmarks of one athlete and compute the frames
+        that became final.
+        """
+        if len(frames) == 0:
+            return
+        frames = np.asarray(frames, dtype=np.int64)
+        flags = np.zeros(len(frames), dtype=bool) if interpolated is None else np.asarray(interpolated, dtype=bool)
+        # Copied, since the ring buffers the chunks live in are reused
+        landmarks = np.array(landmarks, dtype=np.float32)
+        detected = frames[~flags]
+        if athlete_id in self._frames:
+            frames = np.concatenate([self._frames[athlete_id], frames])
+            landmarks = np.concatenate([self._landmarks[athlete_id], landmarks])
+        order = np.argsort(frames, kind='stable')
+        self._frames[athlete_id], self._landmarks[athlete_id] = frames[order], landmarks[order]
+
+        # The two latest detected frames
+        detected = np.concatenate([self._detected.get(athlete_id, np.zeros(0, dtype=np.int64)), detected])
+        self._detected[athlete_id] = np.unique(detected)[-2:]
+        if len(self._detected[athlete_id]) == 2:
+            self._compute(athlete_id, self._detected[athlete_id][0])
+
+    def _compute(self, athlete_id, until=None):
+        """
+        Compute the pending frames before until (all of them for None).
+        """
+        frames, landmarks = self._frames[athlete_id], self._landmarks[athlete_id]
+        count = len(frames) if until is None else int(np.searchsorted(frames, until))
+        if count == 0:
+            return
+        # The neighbours the speeds of the first and last frame depend on
+        previous = self._previous.get(athlete_id)
+        offset = 0 if previous is None else 1
+        window = slice(0, min(count + 1, len(frames)))
+        window_frames = frames[window]
+        window_landmarks = landmarks[window]
+        if previous is not None:
+            window_frames = np.concatenate([[previous[0]], window_frames])
+            window_landmarks = np.concatenate([previous[1][None], window_landmarks])
+        features = frame_kinematics(window_frames, window_landmarks, self.fps, self.aspect)[offset:offset + count]
+
+        self._previous[athlete_id] = (frames[count - 1], landmarks[count - 1])
+        self._frames[athlete_id], self._landmarks[athlete_id] = frames[count:], landmarks[count:]
+        self.frames_computed += count
+        ready = self._ready.setdefault(athlete_id, [])
+        ready.append((frames[:count], features))
+        if sum(len(chunk[0]) for chunk in ready) >= self.flush_frames:
+            self._emit(athlete_id)
+
+    def _emit(self, athlete_id):
+        ready = self._ready.pop(athlete_id, [])
+        if ready and self.on_features is not None:
+            self.on_features(np.concatenate([chunk[0] for chunk in ready]),
+                             np.concatenate([chunk[1] for chunk in ready]), athlete_id)
+
+    def close(self):
+        """
+        Compute the frames still pending, at the end of the video, and hand over the rest.
+        """
+        for athlete_id in list(self._frames):
+            self._compute(athlete_id)
+        for athlete_id in list(self._ready):
+            self._emit(athlete_id)
+
+
+def kinematics_stage(db, config, video_id, video_info):
+    """
+    Create a KinematicsStage that stores the features of a video through db,
+    or return None if kinematics are disabled.
+    """
+    settings = kinematics_settings(config)
+    if not settings['kinematics_enabled']:
+        return None
+    width, height = video_info.get('width'), video_info.get('height')
+
+    def store(frames, features, athlete_id):
+        db.insert_pose_features(video_id, frames, features, athlete_id)
+
+    return KinematicsStage(
+        video_info.get('fps'),
+        aspect=width / height if width and height else 1.0,
+        on_features=store,
+        flush_frames=settings['kinematics_flush_frames']
+    )
+
+
+def compute_video_features(db, config, video_id):
+    """
+    Compute and store the features of a video from its stored landmarks.
+
+    Returns:
+        int: Number of frames computed.
+    """
+    video = db.get_video(video_id)
+    stage = kinematics_stage(db, config, video_id, video)
+    if stage is None:
+        return 0
+    frames, landmarks, interpolated, athlete_ids = db.read_pose_frames(video_id, with_flags=True, with_athletes=True)
+    for athlete_id in np.unique(athlete_ids).tolist():
+        rows = athlete_ids == athlete_id
+        stage.update(frames[rows], landmarks[rows], interpolated[rows], athlete_id)
+    stage.close()
+    return stage.frames_computed
+
+
+def backfill_features(db, config, progress_callback=None):
+    """
+    Compute the features of stored videos that have landmarks but no features,
+    e.g. videos processed before kinematics were enabled.
+
+    Returns:
+        int: Number of videos computed.
+    """
+    missing = [video_id for video_id in db.list_video_ids() if not db.has_pose_features(video_id)]
+    computed = 0
+    for done, video_id in enumerate(missing, 1):
+        try:
+            if compute_video_features(db, config, video_id):
+                computed += 1
+        except Exception:
+            logging.exception(f"Failed to compute the kinematic features of video {video_id}.")
+        if progress_callback:
+            progress_callback(done, len(missing))
+    logging.info(f"Computed kinematic features of {computed} of {len(missing)} videos.")
+    return computed
@@ -0,0 +1,161 @@
+# landmarks.py
+
+import threading
+from itertools import chain
+from operator import attrgetter
+
+import numpy as np
+
+from database import NUM_LANDMARKS, LANDMARK_FIELDS
+
+# Reads (x, y, z, visibility) of a landmark in one C-level call
+_landmark_fields = attrgetter('x', 'y', 'z', 'visibility')
+
+
+def landmarks_to_array(pose_landmarks, out=None):
+    """
+    Convert MediaPipe pose landmarks to a (NUM_LANDMARKS, LANDMARK_FIELDS) float32 array.
+
+    Args:
+        pose_landmarks: MediaPipe NormalizedLandmarkList.
+        out (numpy.ndarray): Optional preallocated array to write into.
+
+    Returns:
+        numpy.ndarray: The landmark array (``out`` when given).
+    """
+    values = np.fromiter(
+        chain.from_iterable(map(_landmark_fields, pose_landmarks.landmark)),
+        dtype=np.float32,
+        count=NUM_LANDMARKS * LANDMARK_FIELDS
+    )
+    if out is None:
+        return values.reshape(NUM_LANDMARKS, LANDMARK_FIELDS)
+    out.reshape(-1)[:] = values
+    return out
+
+
+def write_landmarks(pose_landmarks, landmarks):
+    """
+    Copy a (NUM_LANDMARKS, LANDMARK_FIELDS) array back into MediaPipe pose
+    landmarks, e.g. after smoothing, so drawing and storage see the new values.
+    """
+    for landmark, (x, y, z, visibility) in zip(pose_landmarks.landmark, landmarks.tolist()):
+        landmark.x = x
+        landmark.y = y
+        landmark.z = z
+        landmark.visibility = visibility
+
+
+class LandmarkChunk:
+    """
+    A filled part of one ring buffer, handed to persistence and analytics.
+
+    ``frames``, ``landmarks`` and ``interpolated`` are views into the
+    preallocated buffer, which is reused once release() has been called.
+    """
+
+    def __init__(self, ring, index, count):
+        self._ring = ring
+        self._index = index
+        self.count = count
+        self.frames = ring.frames[index][:count]
+        self.landmarks = ring.landmarks[index][:count]
+        self.interpolated = ring.interpolated[index][:count]
+
+    def release(self):
+        """
+        Give the buffer back to the ring. Call once the data is no longer needed.
+        """
+        if self._ring is not None:
+            self._ring._release(self._index)
+            self._ring = None
+
+
+class LandmarkRing:
+    """
+    A ring of preallocated landmark buffers.
+
+    Each buffer holds chunk_frames frames as a (chunk_frames, 33, 4) float32
+    array plus vectors of frame numbers and interpolated flags. Landmarks are written straight into
+    the next free row, so no Python object is created per landmark. Once a
+    buffer is full it is handed out as a LandmarkChunk; if every buffer is still
+    held by a consumer, append() waits, which bounds memory to ``chunks`` buffers.
+    """
+
+    def __init__(self, chunk_frames=64, chunks=8):
+        """
+        Args:
+            chunk_frames (int): Number of frames per buffer.
+            chunks (int): Number of buffers in the ring.
+        """
+        self.chunk_frames = max(1, chunk_frames)
+        chunks = max(2, chunks)
+        self.frames = np.zeros((chunks, self.chunk_frames), dtype=np.int64)
+        self.landmarks = np.zeros((chunks, self.chunk_frames, NUM_LANDMARKS, LANDMARK_FIELDS), dtype=np.float32)
+        self.interpolated = np.zeros((chunks, self.chunk_frames), dtype=bool)
+        self._free = list(range(chunks))
+        self._available = threading.Condition()
+        self._current = None
+        self._count = 0
+
+    def append(self, frame_number, pose_landmarks):
+        """
+        Write the landmarks of one frame into the ring.
+
+        Args:
+            frame_number (int): Frame number of the landmarks.
+            pose_landmarks: MediaPipe NormalizedLandmarkList.
+
+        Returns:
+            LandmarkChunk: The buffer if this frame filled it, otherwise None.
+        """
+        index = self._reserve()
+        landmarks_to_array(pose_landmarks, out=self.landmarks[index, self._count])
+        return self._commit(index, frame_number, False)
+
+    def append_array(self, frame_number, landmarks, interpolated=False):
+        """
+        Same as append() for landmarks that are already an array.
+
+        Args:
+            interpolated (bool): Whether the landmarks were interpolated rather than detected.
+        """
+        index = self._reserve()
+        self.landmarks[index, self._count] = landmarks
+        return self._commit(index, frame_number, interpolated)
+
+    def flush(self):
+        """
+        Hand out the partly filled buffer, if any.
+
+        Returns:
+            LandmarkChunk: The pending frames, or None if there are none.
+        """
+        if self._current is None or self._count == 0:
+            return None
+        chunk = LandmarkChunk(self, self._current, self._count)
+        self._current = None
+        self._count = 0
+        return chunk
+
+    def _reserve(self):
+        if self._current is None:
+            with self._available:
+                while not self._free:
+                    self._available.wait()
+                self._current = self._free.pop(0)
+            self._count = 0
+        return self._current
+
+    def _commit(self, index, frame_number, interpolated):
+        self.frames[index, self._count] = frame_number
+        self.interpolated[index, self._count] = interpolated
+        self._count += 1
+        if self._count == self.chunk_frames:
+            return self.flush()
+        return None
+
+    def _release(self, index):
+        with self._available:
+            self._free.append(index)
+            self._available.notify()
@@ -0,0 +1,462 @@
+# metrics.py
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the buckets of every timing histogram
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# One registry and one trace writer per file, per process, shared by all jobs
+_registry = None
+_registry_lock = threading.Lock()
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+# Runs being processed, for the fps gauge, and the profiles collected by the job on each thread
+_active_runs = set()
+_active_runs_lock = threading.Lock()
+_local = threading.local()
+
+
+def metrics_settings(config):
+    """
+    Read the metrics settings from the configuration.
+    """
+    return {
+        'metrics_enabled': config.getboolean('metrics_enabled', fallback=True),
+        'metrics_log_seconds': config.getfloat('metrics_log_seconds', fallback=10.0),
+        'metrics_trace_rate': config.getfloat('metrics_trace_rate', fallback=0.0),
+        'metrics_trace_file': config.get('metrics_trace_file', 'traces.jsonl'),
+    }
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, with their sum and maximum.
+
+    Not locked: either written by a single thread, or guarded by its owner.
+    Quantiles are estimated from the buckets, interpolating within one.
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket, and a last one for values above every bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+    def summary(self):
+        """
+        Return count, mean, estimated p50/p95/p99 and maximum.
+        """
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms of the process, in the Prometheus text format.
+
+    Every metric is declared once with its label names; a value is kept per
+    combination of label values. Updates take one lock, so they are cheap
+    enough for every frame. Collectors are called before rendering, to set
+    gauges from statistics that are kept elsewhere.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name: (type, help, label names, {label values: value})
+        self._metrics = {}
+        self._collectors = []
+
+    def declare(self, kind, name, help_text, labels=()):
+        """
+        Declare a metric of kind 'counter', 'gauge' or 'histogram'; repeated declarations are ignored.
+        """
+        with self._lock:
+            self._metrics.setdefault(name, (kind, help_text, tuple(labels), {}))
+
+    def add_collector(self, collector):
+        """
+        Register collector(registry), called before every render().
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _values(self, name, labels):
+        kind, _, label_names, values = self._metrics[name]
+        return kind, values, tuple(str(labels[label]) for label in label_names)
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            _, values, key = self._values(name, labels)
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            _, values, key = self._values(name, labels)
+            values[key] = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            _, values, key = self._values(name, labels)
+            histogram = values.get(key)
+            if histogram is None:
+                histogram = values[key] = Histogram()
+            histogram.observe(value)
+
+    def merge(self, name, histogram, **labels):
+        """
+        Add the observations of a Histogram collected elsewhere, e.g. in a worker process.
+        """
+        with self._lock:
+            _, values, key = self._values(name, labels)
+            if key not in values:
+                values[key] = Histogram(histogram.buckets)
+            values[key].merge(histogram)
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        for collector in list(self._collectors):
+            try:
+                collector(self)
+            except Exception:
+                logging.exception("Metrics collector failed.")
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, label_names, values) in self._metrics.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(values.items()):
+                    labels = [f'{label}="{_escape(text)}"' for label, text in zip(label_names, key)]
+                    if kind != 'histogram':
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + (float('inf'),), value.counts):
+                        cumulative += count
+                        bucket_labels = _labels(labels + ['le="' + _number(bound) + '"'])
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(value.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def get_metrics():
+    """
+    Return the process-wide registry, with the metrics of the pipeline declared.
+    """
+    global _registry
+    if _registry is not None:
+        return _registry
+    with _registry_lock:
+        if _registry is None:
+            registry = MetricsRegistry()
+            registry.declare('histogram', 'pose_stage_seconds', 'Time a pipeline stage spent on one frame.', ['stage'])
+            registry.declare('histogram', 'pose_frame_latency_seconds',
+                             'Time from the start of inference on a frame until it was written.')
+            registry.declare('counter', 'pose_frames_total', 'Frames handled, by outcome.', ['kind'])
+            registry.declare('counter', 'pose_frames_over_budget_total',
+                             'Detected frames whose latency exceeded the frame duration of their video.')
+            registry.declare('gauge', 'pose_queue_depth', 'Frames waiting in front of a pipeline stage.', ['queue'])
+            registry.declare('gauge', 'pose_processing_fps', 'Frames per second of all videos being processed.')
+            registry.declare('gauge', 'pose_active_videos', 'Videos being processed.')
+            registry.declare('counter', 'pose_videos_total', 'Videos finished, by outcome.', ['status'])
+            registry.declare('histogram', 'pose_db_flush_seconds', 'Time to insert one batch of landmarks.',
+                             ['writer'])
+            registry.declare('counter', 'pose_db_rows_total', 'Landmark rows inserted.', ['writer'])
+            registry.declare('counter', 'pose_cache_requests_total', 'Result cache lookups, by result.', ['result'])
+            registry.add_collector(_collect_runs)
+            _registry = registry
+        return _registry
+
+
+def _collect_runs(registry):
+    with _active_runs_lock:
+        runs = list(_active_runs)
+    registry.set('pose_active_videos', len(runs))
+    registry.set('pose_processing_fps', sum(run.current_fps for run in runs))
+
+
+class RunProfile:
+    """
+    Timings of one process_frames() run: per-stage and per-frame latency
+    histograms, frame counts and the deepest queues.
+
+    Every observation also goes to the process-wide registry. Instead of a
+    line per frame, an aggregate line with throughput, latency percentiles and
+    queue depths is logged every log_seconds. The profile can be pickled once
+    closed, so worker processes can hand theirs back.
+    """
+
+    def __init__(self, name, total_frames=None, frame_duration=None, log_seconds=10.0, queue_depths=None):
+        """
+        Args:
+            name (str): Shown in the log lines, e.g. the video path.
+            total_frames (int): Frames to process, or None if unknown.
+            frame_duration (float): Seconds per frame of the video; slower frames are counted as over budget.
+            log_seconds (float): Interval of the aggregate log lines, 0 for none.
+            queue_depths (callable): Returns {queue name: depth}, sampled with every frame.
+        """
+        self.name = name
+        self.total_frames = total_frames
+        self.frame_duration = frame_duration
+        self.log_seconds = log_seconds
+        self._queue_depths = queue_depths
+        self.stages = {}
+        self.latency = Histogram()
+        self.frames = 0
+        self.over_budget = 0
+        self.queue_depth_max = {}
+        self.current_fps = 0.0
+        self.started = time.time()
+        self.finished = None
+        self._interval = Histogram()
+        self._interval_frames = 0
+        self._interval_over_budget = 0
+        self._next_report = time.monotonic() + log_seconds
+        self._last_report = time.monotonic()
+        with _active_runs_lock:
+            _active_runs.add(self)
+
+    def observe_stage(self, stage, seconds):
+        """
+        Record the time a stage spent on one item; each stage calls this from its own thread.
+        """
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+        get_metrics().observe('pose_stage_seconds', seconds, stage=stage)
+
+    def frame_done(self, latency=None):
+        """
+        Record a frame written by the output stage, with its latency if it was inferred.
+        """
+        registry = get_metrics()
+        self.frames += 1
+        self._interval_frames += 1
+        registry.inc('pose_frames_total', kind='written')
+        if latency is not None:
+            self.latency.observe(latency)
+            self._interval.observe(latency)
+            registry.observe('pose_frame_latency_seconds', latency)
+            if self.frame_duration and latency > self.frame_duration:
+                self.over_budget += 1
+                self._interval_over_budget += 1
+                registry.inc('pose_frames_over_budget_total')
+        if self._queue_depths is not None:
+            for queue_name, depth in self._queue_depths().items():
+                if depth > self.queue_depth_max.get(queue_name, 0):
+                    self.queue_depth_max[queue_name] = depth
+        if self.log_seconds and time.monotonic() >= self._next_report:
+            self.report()
+
+    def report(self):
+        """
+        Log throughput, latency and queue depths since the previous report.
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_report
+        self.current_fps = self._interval_frames / elapsed if elapsed > 0 else 0.0
+        depths = self._queue_depths() if self._queue_depths is not None else {}
+        for queue_name, depth in depths.items():
+            get_metrics().set('pose_queue_depth', depth, queue=queue_name)
+        progress = f"{self.frames}/{self.total_frames}" if self.total_frames else f"{self.frames}"
+        latency = self._interval.summary()
+        logging.info(
+            f"{self.name}: frames {progress}, {self.current_fps:.1f} fps, latency p50 {latency['p50']:.4f} s, "
+            f"p95 {latency['p95']:.4f} s, max {latency['max']:.4f} s, {self._interval_over_budget} over the frame "
+            f"duration, queues " + (' '.join(f"{name}={depth}" for name, depth in depths.items()) or '-')
+        )
+        self._interval = Histogram()
+        self._interval_frames = 0
+        self._interval_over_budget = 0
+        self._last_report = now
+        self._next_report = now + self.log_seconds
+
+    def close(self):
+        """
+        Finish the run: stop counting it as active and drop the queue sampler.
+        """
+        self.finished = time.time()
+        self._queue_depths = None
+        with _active_runs_lock:
+            _active_runs.discard(self)
+        registry = get_metrics()
+        for queue_name in self.queue_depth_max:
+            registry.set('pose_queue_depth', 0, queue=queue_name)
+
+    def publish(self):
+        """
+        Add the observations to this process's registry, for a profile made in another process.
+        """
+        registry = get_metrics()
+        for stage, histogram in self.stages.items():
+            registry.merge('pose_stage_seconds', histogram, stage=stage)
+        registry.merge('pose_frame_latency_seconds', self.latency)
+        registry.inc('pose_frames_total', self.frames, kind='written')
+        registry.inc('pose_frames_over_budget_total', self.over_budget)
+
+    def summary(self):
+        """
+        Return the figures of the run, for job results and logs.
+        """
+        seconds = (self.finished or time.time()) - self.started
+        return {
+            'frames': self.frames,
+            'seconds': seconds,
+            'fps': self.frames / seconds if seconds > 0 else 0.0,
+            'latency': self.latency.summary(),
+            'frames_over_budget': self.over_budget,
+            'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()},
+            'queue_depth_max': dict(self.queue_depth_max),
+        }
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_queue_depths'] = None
+        return state
+
+    @classmethod
+    def combine(cls, profiles, name='combined'):
+        """
+        Merge the profiles of several runs, e.g. the segments of one video.
+
+        The combined run spans from the first start to the last finish.
+        """
+        combined = cls(name, log_seconds=0)
+        with _active_runs_lock:
+            _active_runs.discard(combined)
+        for profile in profiles:
+            for stage, histogram in profile.stages.items():
+                combined.stages.setdefault(stage, Histogram(histogram.buckets)).merge(histogram)
+            combined.latency.merge(profile.latency)
+            combined.frames += profile.frames
+            combined.over_budget += profile.over_budget
+            for queue_name, depth in profile.queue_depth_max.items():
+                combined.queue_depth_max[queue_name] = max(depth, combined.queue_depth_max.get(queue_name, 0))
+        if profiles:
+            combined.started = min(profile.started for profile in profiles)
+            combined.finished = max(profile.finished or time.time() for profile in profiles)
+        return combined
+
+
+@contextmanager
+def collect_profiles():
+    """
+    Collect the profiles recorded with record_profile() on this thread while the block runs.
+
+    Yields:
+        list: The RunProfile objects, in the order they were recorded.
+    """
+    previous = getattr(_local, 'profiles', None)
+    _local.profiles = []
+    try:
+        yield _local.profiles
+    finally:
+        _local.profiles = previous
+
+
+def record_profile(profile):
+    """
+    Hand a finished profile to the enclosing collect_profiles() block, if any.
+    """
+    profiles = getattr(_local, 'profiles', None)
+    if profiles is not None:
+        profiles.append(profile)
+
+
+class Tracer:
+    """
+    Appends sampled per-frame traces to a file, one JSON object per line.
+    """
+
+    def __init__(self, path, rate):
+        """
+        Args:
+            path (str): File the traces are appended to.
+            rate (float): Fraction of frames traced.
+        """
+        self.path = path
+        self.rate = rate
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1)
+
+    def write(self, record):
+        line = json.dumps(record)
+        with self._lock:
+            self._file.write(line + '\n')
+
+
+def get_tracer(config):
+    """
+    Return the shared tracer of the configured trace file, or None if tracing is off.
+    """
+    settings = metrics_settings(config)
+    if settings['metrics_trace_rate'] <= 0:
+        return None
+    path = settings['metrics_trace_file']
+    with _tracers_lock:
+        tracer = _tracers.get(path)
+        if tracer is None:
+            tracer = _tracers[path] = Tracer(path, settings['metrics_trace_rate'])
+        tracer.rate = settings['metrics_trace_rate']
+        return tracer
@@ -0,0 +1,217 @@
+# parallel_processing.py
+
+import os
+import shutil
+import tempfile
+import logging
+import configparser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+
+import cv2
+import numpy as np
+
+from database import NUM_LANDMARKS, LANDMARK_FIELDS
+from landmarks import landmarks_to_array
+from metrics import RunProfile
+from pose_detection import process_frames, processing_mode, MODE_FULL
+from video_io import concat_videos, mux_audio, video_settings, BACKEND_FFMPEG
+
+
+def plan_segments(total_frames, workers, overlap_frames, min_segment_frames):
+    """
+    Split a video into contiguous frame ranges, one per worker.
+
+    Args:
+        total_frames (int): Number of frames in the video.
+        workers (int): Number of worker processes available.
+        overlap_frames (int): Frames each segment runs through the model before its
+            range starts, so tracking is settled at the boundary.
+        min_segment_frames (int): Do not create segments shorter than this.
+
+    Returns:
+        list of tuple: (start_frame, end_frame, warmup_frames) for each segment.
+    """
+    count = max(1, min(workers, total_frames // max(1, min_segment_frames)))
+    bounds = [round(i * total_frames / count) for i in range(count + 1)]
+    segments = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        segments.append((start, end, min(start, overlap_frames)))
+    return segments
+
+
+def _config_section(config_items):
+    """
+    Rebuild a config section in a worker process from a plain dict.
+    """
+    parser = configparser.ConfigParser()
+    parser.read_dict({'DEFAULT': config_items})
+    return parser['DEFAULT']
+
+
+def _process_segment(video_path, segment_path, landmarks_path, config_items, start_frame, end_frame, warmup_frames,
+                     progress_callback=None, keep_raw=False):
+    """
+    Worker entry point: process one frame range with its own MediaPipe Pose.
+
+    The frame numbers, landmark arrays and interpolated flags are saved to
+    ``landmarks_path`` as an .npz file, using global frame numbers. With
+    keep_raw, the detections before smoothing are saved too, as raw_frames
+    and raw_landmarks.
+
+    Returns:
+        tuple: (segment_path, landmarks_path, processed_frames, profile), the
+        profile being the RunProfile of the range.
+    """
+    # At most one row per frame of the range, preallocated
+    frames = np.zeros(end_frame - start_frame, dtype=np.int64)
+    landmarks = np.zeros((end_frame - start_frame, NUM_LANDMARKS, LANDMARK_FIELDS), dtype=np.float32)
+    interpolated = np.zeros(end_frame - start_frame, dtype=bool)
+    count = 0
+    raw_frames = np.zeros(end_frame - start_frame if keep_raw else 0, dtype=np.int64)
+    raw_landmarks = np.zeros((len(raw_frames), NUM_LANDMARKS, LANDMARK_FIELDS), dtype=np.float32)
+    raw_count = 0
+
+    # Videos are only split across workers with a single athlete, whose id is always 0
+    def collect_landmarks(frame_number, pose_landmarks, athlete_id):
+        nonlocal count
+        frames[count] = frame_number
+        landmarks_to_array(pose_landmarks, out=landmarks[count])
+        count += 1
+
+    def collect_raw(frame_number, frame_landmarks, athlete_id):
+        nonlocal raw_count
+        raw_frames[raw_count] = frame_number
+        raw_landmarks[raw_count] = frame_landmarks
+        raw_count += 1
+
+    def collect_interpolated(frame_numbers, frame_landmarks, athlete_id):
+        nonlocal count
+        end = count + len(frame_numbers)
+        frames[count:end] = frame_numbers
+        landmarks[count:end] = frame_landmarks
+        interpolated[count:end] = True
+        count = end
+
+    stats = process_frames(
+        video_path=video_path,
+        output_path=segment_path,
+        config=_config_section(config_items),
+        on_landmarks=collect_landmarks,
+        start_frame=start_frame,
+        end_frame=end_frame,
+        warmup_frames=warmup_frames,
+        progress_callback=progress_callback,
+        on_interpolated=collect_interpolated,
+        on_raw_landmarks=collect_raw if keep_raw else None
+    )
+    np.savez(landmarks_path, frames=frames[:count], landmarks=landmarks[:count], interpolated=interpolated[:count],
+             raw_frames=raw_frames[:raw_count], raw_landmarks=raw_landmarks[:raw_count])
+    return segment_path, landmarks_path, stats['processed_frames'], stats['profile']
+
+
+def process_video_parallel(video_path, output_path, config, on_landmarks, progress_callback=None, on_raw_landmarks=None):
+    """
+    Process a long video on several worker processes.
+
+    The video is split into time ranges. Each range is handled by its own worker
+    with its own MediaPipe Pose instance, starting a little before the range so
+    tracking is warmed up at the boundary. The annotated segments are joined into
+    one output file and the landmarks are handed over in frame order.
+
+    Args:
+        video_path (str): Path to the input video file.
+        output_path (str): Path to save the output video file.
+        config (dict): Additional configuration parameters.
+        on_landmarks (callable): Called as on_landmarks(frames, landmarks, interpolated)
+            once per segment, in frame order, with arrays of shape (N,), (N, 33, 4)
+            and (N,) for the interpolated flags.
+        progress_callback (callable): Optional, called as progress_callback(frames_done, total_frames)
+            each time a segment finishes.
+        on_raw_landmarks (callable): Optional, called as on_raw_landmarks(frames, landmarks) once
+            per segment with the detections before smoothing, when smoothing is enabled.
+    """
+    logger = logging.getLogger()
+
+    workers = config.getint('parallel_workers', fallback=1)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    overlap_seconds = config.getfloat('parallel_overlap_seconds', fallback=2.0)
+    min_segment_seconds = config.getfloat('parallel_min_segment_seconds', fallback=30.0)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        logger.error(f"Error opening video file {video_path}")
+        raise FileNotFoundError(f"Cannot open video file: {video_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    segments = plan_segments(
+        total_frames,
+        workers,
+        overlap_frames=int(overlap_seconds * fps),
+        min_segment_frames=int(min_segment_seconds * fps)
+    )
+    logger.info(f"Processing {total_frames} frames in {len(segments)} segments on up to {workers} workers.")
+
+    # Worker processes cannot receive the config section itself
+    config_items = {key: value for key, value in config.items()}
+
+    work_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        jobs = []
+        for i, (start, end, warmup) in enumerate(segments):
+            jobs.append((
+                video_path,
+                os.path.join(work_dir, f"segment_{i:04d}.mp4"),
+                os.path.join(work_dir, f"segment_{i:04d}.npz"),
+                config_items,
+                start,
+                end,
+                warmup
+            ))
+
+        keep_raw = on_raw_landmarks is not None
+        if len(jobs) == 1:
+            results = [_process_segment(*jobs[0], progress_callback=progress_callback, keep_raw=keep_raw)]
+        else:
+            # Spawned workers do not inherit the parent's threads or MediaPipe state
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=context) as executor:
+                futures = [executor.submit(_process_segment, *job, keep_raw=keep_raw) for job in jobs]
+                if progress_callback:
+                    segment_frames = {future: end - start for future, (start, end, _) in zip(futures, segments)}
+                    frames_done = 0
+                    for future in as_completed(futures):
+                        future.result()
+                        frames_done += segment_frames[future]
+                        progress_callback(frames_done, total_frames)
+                results = [future.result() for future in futures]
+            # Worker processes observed into their own registries
+            for _, _, _, profile in results:
+                profile.publish()
+
+        if processing_mode(config) == MODE_FULL:
+            concat_videos([segment_path for segment_path, _, _, _ in results], output_path)
+            # Segments are written without audio; the source's is added to the joined video
+            video = video_settings(config)
+            if video['video_backend'] == BACKEND_FFMPEG and video['video_audio']:
+                mux_audio(output_path, video_path)
+
+        # Merge the landmarks in segment order; frame numbers are already global
+        for _, landmarks_path, _, _ in results:
+            with np.load(landmarks_path) as segment:
+                on_landmarks(segment['frames'], segment['landmarks'], segment['interpolated'])
+                if on_raw_landmarks is not None:
+                    on_raw_landmarks(segment['raw_frames'], segment['raw_landmarks'])
+
+        return {
+            'total_frames': total_frames,
+            'processed_frames': sum(count for _, _, count, _ in results),
+            'fps': fps,
+            'stage_times': {},
+            'profile': RunProfile.combine([profile for _, _, _, profile in results], name=video_path),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
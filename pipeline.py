@@ -0,0 +1,157 @@
+# pipeline.py
+
+import queue
+import threading
+import time
+import logging
+
+# Marks the end of the stream between two stages
+_END = object()
+
+
+class PipelineError(Exception):
+    """Raised in the calling thread when one of the pipeline stages fails."""
+
+
+class Pipeline:
+    """
+    A chain of processing stages joined by bounded queues.
+
+    Every stage runs on its own thread and handles items in the order the
+    previous stage produced them, so the output order always matches the input
+    order. The queue size caps how many items can wait between two stages,
+    which keeps memory use fixed no matter how long the input is.
+    """
+
+    def __init__(self, queue_size=8, observer=None):
+        """
+        Args:
+            queue_size (int): Maximum number of items waiting between two stages.
+            observer (callable): Optional, called as observer(stage_name, seconds) with the
+                time the source or a stage spent on each item, from that stage's thread.
+        """
+        self.queue_size = max(1, int(queue_size))
+        self.observer = observer
+        self.stages = []
+        self.stage_times = {}
+        self._queues = []
+        self._stop = threading.Event()
+        self._errors = []
+
+    def add_stage(self, name, func):
+        """
+        Append a stage to the pipeline.
+
+        Args:
+            name (str): Name of the stage, used for its thread and in log messages.
+            func (callable): Called with each item. The return value is passed to
+                the next stage; returning None drops the item.
+
+        Returns:
+            Pipeline: The pipeline itself, so calls can be chained.
+        """
+        self.stages.append((name, func))
+        self.stage_times[name] = 0.0
+        return self
+
+    def queue_depths(self):
+        """
+        Return the number of items waiting in front of each stage while the pipeline runs.
+        """
+        return {name: q.qsize() for (name, _), q in zip(self.stages, self._queues)}
+
+    def run(self, source, source_name='source'):
+        """
+        Feed every item of ``source`` through all stages and wait until done.
+
+        Args:
+            source (iterable): Produces the input items. It is iterated on its own thread.
+            source_name (str): Name of the source thread.
+
+        Raises:
+            PipelineError: If the source or any stage raised an exception.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self._queues = queues
+        threads = [threading.Thread(
+            target=self._feed, args=(source_name, source, queues[0]),
+            name=source_name, daemon=True
+        )]
+        for i, (name, func) in enumerate(self.stages):
+            out_q = queues[i + 1] if i + 1 < len(queues) else None
+            threads.append(threading.Thread(
+                target=self._work, args=(name, func, queues[i], out_q),
+                name=name, daemon=True
+            ))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            name, error = self._errors[0]
+            raise PipelineError(f"Pipeline stage '{name}' failed: {error}") from error
+
+    def _fail(self, name, error):
+        logging.exception(f"Pipeline stage '{name}' failed.")
+        self._errors.append((name, error))
+        self._stop.set()
+
+    def _put(self, q, item):
+        # Block while the queue is full, but give up once the pipeline is stopping
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _feed(self, name, source, out_q):
+        self.stage_times[name] = 0.0
+        try:
+            iterator = iter(source)
+            while True:
+                # Only time the source itself, not the wait on a full queue
+                start = time.perf_counter()
+                item = next(iterator, _END)
+                seconds = time.perf_counter() - start
+                self.stage_times[name] += seconds
+                if item is not _END and self.observer is not None:
+                    self.observer(name, seconds)
+                if item is _END or not self._put(out_q, item):
+                    break
+        except Exception as e:
+            self._fail(name, e)
+        finally:
+            self._put(out_q, _END)
+
+    def _work(self, name, func, in_q, out_q):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _END:
+                    break
+                start = time.perf_counter()
+                result = func(item)
+                seconds = time.perf_counter() - start
+                self.stage_times[name] += seconds
+                if self.observer is not None:
+                    self.observer(name, seconds)
+                if result is not None and out_q is not None:
+                    if not self._put(out_q, result):
+                        break
+        except Exception as e:
+            self._fail(name, e)
+        finally:
+            if out_q is not None:
+                self._put(out_q, _END)
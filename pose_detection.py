@@ -5,11 +5,201 @@ import mediapipe as mp
 import time
 import logging
 import configparser
-import sys
 import os
-from database import Database
+import shutil
+import itertools
+import random
+import numpy as np
+from database import Database, NUM_LANDMARKS, LANDMARK_FIELDS, STORAGE_LANDMARKS
+from pipeline import Pipeline
+from ingest import BulkIngestor
+from landmarks import LandmarkRing, landmarks_to_array, write_landmarks
+from pose_pool import get_pose_pool
+from sampling import AdaptiveSampler, sampling_settings, interpolate_landmarks, SAMPLING_ADAPTIVE
+from smoothing import LandmarkSmoother, smoothing_settings, fill_gap, SMOOTHING_NONE
+from renderer import draw_pose, athlete_color
+from roi import RoiTracker, roi_settings
+from athletes import AthleteTracker, athlete_settings, ATHLETES_MULTI
+from video_io import open_capture, open_writer, video_settings
+from result_cache import get_result_cache, file_key, result_key
+from pose_index import index_video
+from position_classifier import get_classifier, classifier_settings, PositionTracker
+from kinematics import kinematics_stage
+from metrics import RunProfile, get_metrics, get_tracer, metrics_settings, record_profile
+from checkpoint import Checkpoint, checkpoint_settings
 
-def process_video(video_path, output_path, db_config, config, position_name=None):
+# Processing modes: render the annotated video, or only produce landmark data
+MODE_FULL = 'full'
+MODE_LANDMARKS_ONLY = 'landmarks_only'
+
+def processing_mode(config):
+    """
+    Read the processing mode from the configuration.
+    """
+    mode = config.get('processing_mode', MODE_FULL)
+    if mode not in (MODE_FULL, MODE_LANDMARKS_ONLY):
+        raise ValueError(f"Unknown processing_mode: {mode}")
+    return mode
+
+def config_with_overrides(config, overrides):
+    """
+    Return a copy of a config section with some settings replaced, e.g. per request.
+
+    Args:
+        config (dict): Configuration section to copy.
+        overrides (dict): Settings to replace; None values are ignored.
+    """
+    items = {key: value for key, value in config.items()}
+    items.update({key: str(value) for key, value in overrides.items() if value is not None})
+    parser = configparser.ConfigParser()
+    parser.read_dict({'DEFAULT': items})
+    return parser['DEFAULT']
+
+def pose_settings(config):
+    """
+    Read the MediaPipe Pose settings from the configuration.
+
+    Returns:
+        dict: Keyword arguments for mp.solutions.pose.Pose.
+    """
+    return {
+        'model_complexity': config.getint('model_complexity', fallback=0),  # Lightest model for fastest processing
+        'min_detection_confidence': config.getfloat('min_detection_confidence', fallback=0.5),
+        'min_tracking_confidence': config.getfloat('min_tracking_confidence', fallback=0.5),
+    }
+
+def processing_params(config):
+    """
+    Collect the settings that change the processing result, for cache keys.
+
+    Returns:
+        dict: Frame scaling, frame sampling, smoothing, ROI and athlete tracking,
+        the Pose model and the video I/O settings.
+    """
+    params = {
+        'processing_mode': processing_mode(config),
+        'scale_factor': config.getfloat('scale_factor', fallback=0.5),
+        'skip_rate': config.getint('skip_rate', fallback=1),
+    }
+    params.update(sampling_settings(config))
+    params.update(smoothing_settings(config))
+    params.update(roi_settings(config))
+    params.update(athlete_settings(config))
+    params.update(pose_settings(config))
+    params.update(video_settings(config))
+    return params
+
+def decode_scale(config):
+    """
+    Scale at which frames can be decoded: the scale_factor, or None when ROI or
+    athlete crops need the full resolution frame.
+    """
+    if roi_settings(config)['roi_enabled'] or athlete_settings(config)['athletes'] == ATHLETES_MULTI:
+        return None
+    return config.getfloat('scale_factor', fallback=0.5)
+
+def probe_video(video_path, capture=None):
+    """
+    Read the frame rate, resolution and frame count of a video file.
+
+    Args:
+        video_path (str): Path to the video file.
+        capture: Already opened capture to read the properties from instead,
+            e.g. a streaming.StreamCapture. It is left open.
+
+    Returns:
+        dict: fps, width, height and total_frames (None if not known yet).
+    """
+    cap = capture if capture is not None else cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        logging.error(f"Error opening video file {video_path}")
+        raise FileNotFoundError(f"Cannot open video file: {video_path}")
+    info = {
+        'fps': cap.get(cv2.CAP_PROP_FPS),
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None,
+    }
+    if capture is None:
+        cap.release()
+    return info
+
+def position_tracker(config, video_info):
+    """
+    Create a PositionTracker for a video, or return None if no classifier has been trained.
+    """
+    classifier = get_classifier(config)
+    if classifier is None:
+        return None
+    width, height = video_info.get('width'), video_info.get('height')
+    return PositionTracker(
+        classifier,
+        video_info.get('fps'),
+        aspect=width / height if width and height else 1.0,
+        stride_frames=classifier_settings(config)['classifier_stride_frames']
+    )
+
+def restore_cached_result(cache, entry, output_path, db_config, config, position_name=None, source=None):
+    """
+    Reuse a cached result: copy the annotated video and store the cached
+    landmarks under a new video row.
+
+    Args:
+        cache (ResultCache): The cache the entry came from.
+        entry (dict): Cache entry from ResultCache.get().
+        output_path (str): Path to save the output video file.
+        db_config (dict): Database configuration parameters.
+        config (dict): Additional configuration parameters.
+        position_name (str): Name of the BJJ position or technique.
+        source (str): Path or URL of the input, recorded with the video row.
+
+    Returns:
+        int: Id of the new video row.
+    """
+    meta = entry['meta']
+    if entry['video_path']:
+        shutil.copyfile(entry['video_path'], output_path)
+
+    db = Database(db_config)
+    video_id = db.create_video(
+        source=source or meta.get('source'),
+        fps=meta.get('fps'),
+        width=meta.get('width'),
+        height=meta.get('height'),
+        total_frames=meta.get('total_frames'),
+        position_name=position_name,
+        model_settings=meta.get('model_settings'),
+        start_frame=meta.get('start_frame'),
+        end_frame=meta.get('end_frame')
+    )
+    frames, landmarks, interpolated, athlete_ids = cache.load_landmarks(entry)
+    tracker = position_tracker(config, meta)
+    kinematics = kinematics_stage(db, config, video_id, meta)
+    ingestor = BulkIngestor.from_config(db, config)
+    try:
+        for athlete_id in np.unique(athlete_ids).tolist():
+            rows = athlete_ids == athlete_id
+            ingestor.submit(video_id, frames[rows], landmarks[rows], position_name, interpolated=interpolated[rows],
+                            athlete_id=athlete_id)
+            if tracker is not None:
+                detected = rows & ~interpolated
+                tracker.update(frames[detected], landmarks[detected], athlete_id)
+            if kinematics is not None:
+                kinematics.update(frames[rows], landmarks[rows], interpolated[rows], athlete_id)
+    finally:
+        ingestor.close()
+    if kinematics is not None:
+        kinematics.close()
+    if tracker is not None:
+        db.insert_position_predictions(video_id, tracker.take_predictions())
+    db.close()
+    index_video(db_config, config, video_id)
+
+    logging.info(f"Reused cached result {entry['key']} for video {video_id}. Output saved to '{output_path}'")
+    return video_id
+
+def process_video(video_path, output_path, db_config, config, position_name=None, progress_callback=None,
+                  cache_key=None, capture=None, start_frame=0, end_frame=None, stats_callback=None):
     """
     Process the video for pose detection and log data to the database.
 
@@ -19,11 +209,47 @@ def process_video(video_path, output_path, db_config, config, position_name=None
         db_config (dict): Database configuration parameters.
         config (dict): Additional configuration parameters.
         position_name (str): Name of the BJJ position or technique.
+        progress_callback (callable): Optional, called as progress_callback(frames_done, total_frames).
+        cache_key (str): Input key for the result cache, given by callers that have
+            already looked it up and missed; the result is stored under it. By
+            default the file content is hashed and looked up here.
+        capture: Open capture to read the frames from instead of video_path, e.g.
+            a streaming.StreamCapture for an upload that is still arriving. Such
+            input is processed sequentially, and only cached when cache_key
+            is given; video_path is only recorded as the source.
+        start_frame (int): First frame (0-based) to process, for a segment of the video.
+        end_frame (int): Frame after the last one to process, or None for the end.
+            Landmarks of a segment keep the frame numbers of the whole video.
+        stats_callback (callable): Optional, called once as stats_callback(stats) after the
+            landmarks are stored, with the dict of process_frames() plus 'ingest', the
+            statistics of the background writer (None when landmarks were inserted inline),
+            and 'metrics', the summary of the run's profile. Not called when a cached result
+            is reused.
+
+    With athletes = multi, every athlete's landmarks are stored under their own
+    athlete_id, and the video is processed sequentially so ids stay the same
+    throughout.
+
+    Files longer than checkpoint_min_seconds that are processed sequentially
+    with a single athlete are processed in intervals of checkpoint_interval_seconds,
+    each encoded into its own segment, with a checkpoint once its landmarks are
+    committed. Running the same file with the same settings again after a
+    failure resumes at the last checkpoint under the same video row: landmarks
+    at or before the watermark of their track were already stored and are
+    skipped, and the segments are joined into the output at the end.
+
+    Returns:
+        int: Id of the video row the landmarks are stored under.
+
+    Raises:
+        Exception: Any error raised while processing, after it has been logged.
     """
+    db = None
     try:
-        scale_factor = config.getfloat('scale_factor', fallback=0.5)
-        skip_rate = config.getint('skip_rate', fallback=1)
+        render = processing_mode(config) == MODE_FULL
         batch_size = config.getint('batch_size', fallback=100)
+        parallel_workers = config.getint('parallel_workers', fallback=1)
+        multi = athlete_settings(config)['athletes'] == ATHLETES_MULTI
         log_file = config.get('log_file', 'app.log')
 
         # Use the existing logger
@@ -31,138 +257,350 @@ def process_video(video_path, output_path, db_config, config, position_name=None
 
         logger.info("Starting video processing.")
 
-        # Initialize MediaPipe Pose
-        mp_pose = mp.solutions.pose
-        pose = mp_pose.Pose(
-            static_image_mode=False,
-            model_complexity=0,           # Lightest model for fastest processing
-            enable_segmentation=False,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
-        mp_drawing = mp.solutions.drawing_utils
+        video_info = probe_video(video_path, capture)
 
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            logger.error(f"Error opening video file {video_path}")
-            raise FileNotFoundError(f"Cannot open video file: {video_path}")
+        # A segment of the video: record its range and length
+        segment = start_frame > 0 or end_frame is not None
+        if segment and video_info['total_frames'] is not None:
+            end = video_info['total_frames'] if end_frame is None else min(end_frame, video_info['total_frames'])
+            video_info['total_frames'] = max(0, end - start_frame)
+        if segment:
+            video_info['start_frame'] = start_frame
+            video_info['end_frame'] = end_frame
 
-        # Get video properties
-        frame_width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps          = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Return a stored result if the same input was processed with the same settings
+        cache = get_result_cache(config) if capture is None or cache_key is not None else None
+        key = None
+        if cache is not None and cache_key is not None:
+            key = result_key(cache_key, processing_params(config))
+        elif cache is not None:
+            key = result_key(file_key(video_path), processing_params(config))
+            entry = cache.get(key)
+            if entry is not None:
+                video_id = restore_cached_result(cache, entry, output_path, db_config, config, position_name, video_path)
+                if progress_callback:
+                    progress_callback(video_info['total_frames'], video_info['total_frames'])
+                get_metrics().inc('pose_videos_total', status='cached')
+                return video_id
 
-        logger.info(f"Input video FPS: {fps}")
-        frame_duration = 1 / fps
-        logger.info(f"Frame duration based on FPS: {frame_duration:.4f} seconds")
+        # Copies of the landmarks for the cache, since the ring buffers are reused
+        cached_frames = []
+        cached_landmarks = []
+        cached_interpolated = []
+        cached_athletes = []
 
-        # Reduce frame resolution
-        frame_width = int(frame_width * scale_factor)
-        frame_height = int(frame_height * scale_factor)
+        # Open a session on the shared engine; its tables were created on first use
+        db = Database(db_config)
 
-        # Define the codec and create VideoWriter object
-        out = cv2.VideoWriter(
-            output_path,
-            cv2.VideoWriter_fourcc(*'mp4v'),
-            fps,
-            (frame_width, frame_height)
-        )
+        parallel = parallel_workers != 1 and capture is None and not multi and not segment
 
-        # Initialize database
-        db = Database(db_config)
-        db.create_tables()
+        # Long files are processed interval by interval with a checkpoint after
+        # each, so a rerun after a failure resumes instead of starting over.
+        # Resuming replays landmarks from pose_frames, which storage_mode = landmarks lacks.
+        checkpoint = None
+        checkpoints = checkpoint_settings(config)
+        if (checkpoints['checkpoint_enabled'] and capture is None and not multi and not parallel
+                and db.storage_mode != STORAGE_LANDMARKS and video_info['total_frames']
+                and video_info['total_frames'] >= checkpoints['checkpoint_min_seconds'] * (video_info['fps'] or 30.0)):
+            checkpoint = Checkpoint.open(config, video_path, processing_params(config), start_frame,
+                                         start_frame + video_info['total_frames'])
+            if checkpoint.resumed and db.get_video(checkpoint.video_id) is None:
+                logger.info(f"Video {checkpoint.video_id} of checkpoint '{checkpoint.path}' no longer exists.")
+                checkpoint.reset()
 
-        # Initialize counters
-        processed_frames = 0
-        frame_counter = 0
+        if checkpoint is not None and checkpoint.resumed:
+            video_id = checkpoint.video_id
+            logger.info(f"Resuming video {video_id} at frame {checkpoint.next_frame} of "
+                        f"{checkpoint.state['end_frame']} from checkpoint '{checkpoint.path}'.")
+        else:
+            video_id = db.create_video(
+                source=video_path,
+                fps=video_info['fps'],
+                width=video_info['width'],
+                height=video_info['height'],
+                total_frames=video_info['total_frames'],
+                position_name=position_name,
+                model_settings=processing_params(config),
+                start_frame=video_info.get('start_frame'),
+                end_frame=video_info.get('end_frame')
+            )
+            if checkpoint is not None:
+                checkpoint.start(video_id)
 
-        # Batch for database inserts
-        batch_data = []
+        # Classify positions from the landmarks as they are stored, when a model has been trained
+        tracker = position_tracker(config, video_info)
 
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+        # Joint angles, hip height and speeds of every stored frame, computed as the landmarks are stored
+        kinematics = kinematics_stage(db, config, video_id, video_info)
 
-            frame_counter += 1
+        # Hand landmarks to a background writer so the frame loop never waits on
+        # the database. Without it, batches of batch_size records are inserted inline.
+        ingestor = None
+        if config.getboolean('ingest_background', fallback=True):
+            ingestor = BulkIngestor.from_config(db, config)
 
-            # Skip frames if necessary
-            if frame_counter % skip_rate != 0:
-                # Optionally, write the original frame without processing
-                out.write(frame)
-                continue
+        # Landmarks are written straight into preallocated buffers and handed to
+        # persistence a chunk at a time, without Python objects per landmark
+        if ingestor is not None:
+            chunk_frames = config.getint('landmark_chunk_frames', fallback=64)
+            chunks = config.getint('landmark_chunks', fallback=8)
+        else:
+            # batch_size counts landmark records, as in the per-landmark table
+            chunk_frames = max(1, batch_size // NUM_LANDMARKS)
+            chunks = 2
 
-            start_time_proc = time.time()
+        # One ring per athlete, so that every chunk belongs to a single athlete
+        rings = {}
 
-            # Resize frame to reduce processing time
-            frame = cv2.resize(frame, (frame_width, frame_height))
+        # Detections as they were before smoothing, when they are kept as well
+        keep_raw = smoothing_settings(config)['smoothing'] != SMOOTHING_NONE and \
+            config.getboolean('smoothing_keep_raw', fallback=False)
+        raw_rows = []
 
-            # Convert the BGR frame to RGB for processing
-            image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        def ring_for(athlete_id):
+            ring = rings.get(athlete_id)
+            if ring is None:
+                ring = rings[athlete_id] = LandmarkRing(chunk_frames=chunk_frames, chunks=chunks)
+            return ring
 
-            # Process the image and find pose landmarks
-            results = pose.process(image_rgb)
+        # Last frame per athlete whose landmarks an interrupted run already committed
+        watermarks = {}
 
-            # Draw the pose annotation on the original frame
-            if results.pose_landmarks:
-                mp_drawing.draw_landmarks(
-                    frame,                      # Image to draw on
-                    results.pose_landmarks,     # Pose landmarks
-                    mp_pose.POSE_CONNECTIONS,   # Connections between landmarks
-                    mp_drawing.DrawingSpec(color=(0, 255, 0), thickness=2, circle_radius=2),  # Landmarks style
-                    mp_drawing.DrawingSpec(color=(0, 0, 255), thickness=2)                    # Connections style
-                )
+        def persist(frames, landmarks, interpolated, release=None, athlete_id=0):
+            """
+            Store a chunk of landmarks, on the background writer when enabled.
+            """
+            watermark = watermarks.get(athlete_id)
+            if watermark is not None and len(frames) and frames[0] <= watermark:
+                # Frames are in order; the ones up to the watermark are stored already
+                stored = int(np.searchsorted(frames, watermark, side='right'))
+                if stored == len(frames):
+                    if release is not None:
+                        release()
+                    return
+                frames, landmarks, interpolated = frames[stored:], landmarks[stored:], interpolated[stored:]
+            observe(frames, landmarks, interpolated, athlete_id)
+            if ingestor is not None:
+                ingestor.submit(video_id, frames, landmarks, position_name, release=release, interpolated=interpolated,
+                                athlete_id=athlete_id)
+                return
+            started = time.perf_counter()
+            rows = db.store_landmarks(video_id, frames, landmarks, position_name, interpolated, athlete_id)
+            get_metrics().observe('pose_db_flush_seconds', time.perf_counter() - started, writer='inline')
+            get_metrics().inc('pose_db_rows_total', rows, writer='inline')
+            if release is not None:
+                release()
 
-                # Collect pose data for batch insert
-                frame_number = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-                data_to_insert = []
-                for idx, landmark in enumerate(results.pose_landmarks.landmark):
-                    data = {
-                        'frame': frame_number,
-                        'landmark_id': idx,
-                        'x': landmark.x,
-                        'y': landmark.y,
-                        'visibility': landmark.visibility
-                    }
-                    if position_name:
-                        data['position_name'] = position_name
-                    data_to_insert.append(data)
-                batch_data.extend(data_to_insert)
-
-                # Insert batch data when batch size is reached
-                if len(batch_data) >= batch_size:
-                    db.insert_pose_data(batch_data)
-                    batch_data = []
-
-            # Write the frame to the output video
-            out.write(frame)
-            processed_frames += 1
+        def observe(frames, landmarks, interpolated, athlete_id):
+            """
+            Hand stored landmarks to the position classifier, the kinematics and the cache.
+            """
+            if tracker is not None:
+                detected = ~np.asarray(interpolated, dtype=bool)
+                tracker.update(np.asarray(frames)[detected], np.asarray(landmarks)[detected], athlete_id)
+            if kinematics is not None:
+                kinematics.update(frames, landmarks, interpolated, athlete_id)
+            if cache is not None:
+                cached_frames.append(np.array(frames))
+                cached_landmarks.append(np.array(landmarks))
+                cached_interpolated.append(np.array(interpolated))
+                cached_athletes.append(np.full(len(frames), athlete_id, dtype=np.int64))
 
-            end_time_proc = time.time()
-            processing_time = end_time_proc - start_time_proc
-            logger.info(f"Frame {processed_frames}/{total_frames}, Processing time: {processing_time:.4f} seconds")
+        def store_landmarks(frame_number, pose_landmarks, athlete_id):
+            """
+            Collect the landmarks of one frame and insert them in batches.
+            """
+            chunk = ring_for(athlete_id).append(frame_number, pose_landmarks)
 
-            # Check if processing time exceeds frame duration
-            if processing_time > frame_duration:
-                logger.warning("Processing time exceeds frame duration. Synchronization issues may occur.")
+            # Insert batch data when batch size is reached
+            if chunk is not None:
+                persist(chunk.frames, chunk.landmarks, chunk.interpolated, chunk.release, athlete_id)
 
-        # Insert any remaining data
-        if batch_data:
-            db.insert_pose_data(batch_data)
+        def store_interpolated(frames, landmarks, athlete_id):
+            """
+            Collect landmarks interpolated for frames that were not inferred.
+            """
+            ring = ring_for(athlete_id)
+            for frame_number, frame_landmarks in zip(frames, landmarks):
+                chunk = ring.append_array(frame_number, frame_landmarks, interpolated=True)
+                if chunk is not None:
+                    persist(chunk.frames, chunk.landmarks, chunk.interpolated, chunk.release, athlete_id)
 
-        # Release resources
-        cap.release()
-        out.release()
-        pose.close()
-        db.close()
+        def store_raw(frame_number, landmarks, athlete_id):
+            """
+            Collect the unsmoothed landmarks of one detection and insert them in batches.
+            """
+            raw_rows.append((frame_number, landmarks, athlete_id))
+            if len(raw_rows) >= chunk_frames:
+                flush_raw()
+
+        def flush_raw():
+            if raw_rows:
+                frames, landmarks, athlete_ids = zip(*raw_rows)
+                db.insert_raw_pose_frames(video_id, frames, np.stack(landmarks), athlete_ids)
+                raw_rows.clear()
+
+        def store_raw_arrays(frames, landmarks):
+            """
+            Insert unsmoothed landmarks that were collected by a worker process.
+            """
+            for offset in range(0, len(frames), chunk_frames):
+                db.insert_raw_pose_frames(video_id, frames[offset:offset + chunk_frames],
+                                          landmarks[offset:offset + chunk_frames])
+
+        def store_landmark_arrays(frames, landmarks, interpolated):
+            """
+            Insert landmarks that were collected by a worker process.
+            """
+            step = len(frames) if ingestor is not None else chunk_frames
+            for offset in range(0, len(frames), max(1, step)):
+                persist(frames[offset:offset + step], landmarks[offset:offset + step], interpolated[offset:offset + step])
+
+        def flush_rings():
+            for athlete_id, ring in rings.items():
+                chunk = ring.flush()
+                if chunk is not None:
+                    persist(chunk.frames, chunk.landmarks, chunk.interpolated, chunk.release, athlete_id)
+
+        def process_intervals():
+            """
+            Process the frames after the checkpoint an interval at a time,
+            committing the landmarks of each before it is checkpointed.
+            """
+            fps = video_info['fps'] or 30.0
+            skip_rate = max(1, config.getint('skip_rate', fallback=1))
+            # Whole multiples of skip_rate, so every interval ends on an inferred frame
+            interval = max(skip_rate, int(checkpoints['checkpoint_interval_seconds'] * fps) // skip_rate * skip_rate)
+            warmup = int(checkpoints['checkpoint_warmup_seconds'] * fps)
+            end = checkpoint.state['end_frame']
+            profiles = []
+            while checkpoint.next_frame < end:
+                first = checkpoint.next_frame
+                last = min(first + interval, end)
+                segment_path = checkpoint.segment_path(first) if render else None
+
+                def interval_progress(frames_done, total, first=first):
+                    if progress_callback:
+                        progress_callback(first - start_frame + frames_done, end - start_frame)
+
+                # Every interval after the first starts with warm-up frames, so tracking is settled at its start
+                interval_stats = process_frames(video_path, segment_path or output_path, config, store_landmarks,
+                                                start_frame=first, end_frame=last,
+                                                warmup_frames=min(first, warmup) if first > start_frame else 0,
+                                                progress_callback=interval_progress,
+                                                on_interpolated=store_interpolated,
+                                                on_raw_landmarks=store_raw if keep_raw else None)
+                flush_rings()
+                flush_raw()
+                if ingestor is not None:
+                    ingestor.sync()
+                checkpoint.commit(last, segment_path, interval_stats)
+                profiles.append(interval_stats['profile'])
+            if render:
+                checkpoint.finalize(output_path, video_path, config, whole_video=not segment)
+            return dict(checkpoint.stats(), fps=video_info['fps'], profile=RunProfile.combine(profiles, name=video_path))
 
-        logger.info(f"Processing complete. Output saved to '{output_path}'")
-        logger.info(f"Total frames: {total_frames}, Processed frames: {processed_frames}")
+        if checkpoint is not None and checkpoint.resumed:
+            # Drop what is not covered by the watermarks, and let the classifier,
+            # kinematics and cache catch up on the landmarks stored before
+            db.discard_uncommitted(video_id, checkpoint.next_frame)
+            watermarks.update(db.get_watermarks(video_id))
+            for frames, landmarks, interpolated, athlete_ids in db.iter_pose_frames(video_id):
+                for athlete_id in np.unique(athlete_ids).tolist():
+                    rows = athlete_ids == athlete_id
+                    observe(frames[rows], landmarks[rows], interpolated[rows], athlete_id)
+
+        try:
+            if parallel:
+                # Split long videos across worker processes when configured
+                from parallel_processing import process_video_parallel
+                stats = process_video_parallel(video_path, output_path, config, store_landmark_arrays, progress_callback,
+                                               on_raw_landmarks=store_raw_arrays if keep_raw else None)
+            elif checkpoint is not None:
+                stats = process_intervals()
+            else:
+                stats = process_frames(video_path, output_path, config, store_landmarks, start_frame=start_frame,
+                                       end_frame=end_frame, progress_callback=progress_callback, capture=capture,
+                                       on_interpolated=store_interpolated,
+                                       on_raw_landmarks=store_raw if keep_raw else None)
+            flush_raw()
+
+            # Insert any remaining data
+            flush_rings()
+        finally:
+            # Flush whatever the background writer still holds
+            if ingestor is not None:
+                ingestor.close()
+        stats['ingest'] = ingestor.stats() if ingestor is not None else None
+
+        if kinematics is not None:
+            kinematics.close()
+        if tracker is not None:
+            db.insert_position_predictions(video_id, tracker.take_predictions())
+
+        if video_info['total_frames'] is None:
+            # Length of a stream is only known once it has been read
+            video_info['total_frames'] = stats['total_frames']
+            db.update_video(video_id, total_frames=stats['total_frames'])
+
+        if cache is not None:
+            cache.put(
+                key,
+                output_path if render else None,
+                np.concatenate(cached_frames) if cached_frames else np.zeros(0, dtype=np.int64),
+                np.concatenate(cached_landmarks) if cached_landmarks else np.zeros((0, NUM_LANDMARKS, LANDMARK_FIELDS), dtype=np.float32),
+                meta=dict(video_info, source=video_path, model_settings=processing_params(config)),
+                interpolated=np.concatenate(cached_interpolated) if cached_interpolated else np.zeros(0, dtype=bool),
+                athlete_ids=np.concatenate(cached_athletes) if cached_athletes else np.zeros(0, dtype=np.int64)
+            )
+
+        # Make the new landmarks searchable
+        index_video(db_config, config, video_id)
+
+        if render:
+            logger.info(f"Processing complete. Output saved to '{output_path}'")
+        else:
+            logger.info(f"Processing complete. Landmarks stored for video {video_id}")
+        logger.info(f"Total frames: {stats['total_frames']}, Processed frames: {stats['processed_frames']}")
+        logger.info("Stage busy time (seconds): " + ", ".join(
+            f"{name}={seconds:.2f}" for name, seconds in stats['stage_times'].items()
+        ))
+        if stats.get('step_times'):
+            logger.info("Step busy time (seconds): " + ", ".join(
+                f"{name}={seconds:.2f}" for name, seconds in stats['step_times'].items()
+            ))
+        if stats.get('sampling'):
+            logger.info(f"Adaptive sampling: {stats['sampling']}")
+        if stats.get('athletes'):
+            logger.info(f"Athlete tracking: {stats['athletes']}")
+
+        registry = get_metrics()
+        registry.inc('pose_videos_total', status='done')
+        for kind in ('processed_frames', 'interpolated_frames', 'missed_frames'):
+            registry.inc('pose_frames_total', stats.get(kind) or 0, kind=kind[:-len('_frames')])
+        profile = stats.pop('profile', None)
+        if profile is not None:
+            stats['metrics'] = profile.summary()
+            logger.info(f"Run summary: {stats['metrics']}")
+            # The job this runs in reports the summary with its result
+            record_profile(profile)
+        if stats_callback:
+            stats_callback(stats)
+        if checkpoint is not None:
+            # Everything is stored; the next run of the same file starts afresh
+            checkpoint.remove()
+        return video_id
 
     except Exception as e:
         logger.exception("An error occurred during video processing.")
-        sys.exit(1)
+        get_metrics().inc('pose_videos_total', status='failed')
+        raise e
+    finally:
+        # Give the connection back to the shared pool, also after a failure.
+        # Features and predictions still pending are dropped with the stages:
+        # their landmarks may not have been committed.
+        if db is not None:
+            db.close()
 
     if __name__ == '__main__':
         # Read configuration
@@ -178,6 +616,7 @@ def process_video(video_path, output_path, db_config, config, position_name=None
             'db_user': config.get('DATABASE', 'db_user', fallback='user'),
             'db_password': config.get('DATABASE', 'db_password', fallback='password'),
             'db_name': config.get('DATABASE', 'db_name', fallback='pose_db'),
+            'storage_mode': config.get('DATABASE', 'storage_mode', fallback='frames'),
         }
 
         # Define input and output paths
@@ -192,3 +631,499 @@ def process_video(video_path, output_path, db_config, config, position_name=None
             config=config,
             position_name=None  # No position name in this context
         )
+
+def process_frames(video_path, output_path, config, on_landmarks, start_frame=0, end_frame=None, warmup_frames=0,
+                   progress_callback=None, capture=None, on_interpolated=None, on_raw_landmarks=None):
+    """
+    Run pose detection over a range of frames and write the annotated video.
+
+    Decoding, inference and annotate/encode run on separate threads joined by
+    bounded queues, so at most queue_size frames wait between two stages. With
+    processing_mode = landmarks_only nothing is drawn or encoded and skipped
+    frames are not even converted.
+
+    With roi_enabled, the model only sees a region around the athlete tracked by
+    a RoiTracker, cut from the full resolution frame, and the whole frame is
+    searched again by a detector whenever the athlete is lost.
+
+    With athletes = multi, an AthleteTracker follows up to max_athletes athletes,
+    each in their own crop with their own Pose graph; roi_enabled is then implied.
+
+    Frames are read and written with the video_backend: with ffmpeg the decoder
+    already scales them (unless crops need the full resolution) and the output
+    is encoded with video_codec and gets the source's audio back.
+
+    Frames to infer are every skip_rate-th frame, or with sampling = adaptive
+    chosen by an AdaptiveSampler from image and landmark motion. Frames in
+    between get landmarks interpolated from the detections around them (up to
+    interpolate_max_gap frames apart), which are drawn like detected ones.
+
+    With smoothing = one_euro, the landmarks of every track go through a
+    LandmarkSmoother before they are drawn, stored or used to interpolate, and
+    gaps are filled weighting each end by its visibility. With
+    smoothing_fill_gaps, frames where the model found nobody are filled like
+    skipped frames instead of being left without landmarks.
+
+    Args:
+        video_path (str): Path to the input video file.
+        output_path (str): Path to save the output video file, unused in landmarks_only mode.
+        config (dict): Additional configuration parameters.
+        on_landmarks (callable): Called as on_landmarks(frame_number, pose_landmarks, athlete_id)
+            for every athlete detected in a frame, in frame order. athlete_id is
+            always 0 unless athletes = multi.
+        start_frame (int): Index of the first frame to write (0-based).
+        end_frame (int): Index after the last frame to write, or None for the whole video.
+        warmup_frames (int): Number of frames before start_frame that go through the
+            model but are not written or stored, so tracking is settled at start_frame.
+        progress_callback (callable): Optional, called as progress_callback(frames_done, total_frames)
+            after every written frame. total_frames is None while the length is unknown.
+        capture: Open capture to read from instead of video_path, e.g. a
+            streaming.StreamCapture. It is released when done.
+        on_interpolated (callable): Optional, called as on_interpolated(frames, landmarks, athlete_id)
+            with arrays for each run of skipped frames that could be interpolated,
+            per athlete, in frame order with the on_landmarks calls.
+        on_raw_landmarks (callable): Optional, called as on_raw_landmarks(frame_number, landmarks, athlete_id)
+            with the (33, 4) array of every detection before smoothing, when smoothing is enabled.
+
+    Returns:
+        dict: Frame counts, fps, busy time of each stage and step, and 'profile',
+        the RunProfile with the latency histograms of the run.
+    """
+    scale_factor = config.getfloat('scale_factor', fallback=0.5)
+    skip_rate = config.getint('skip_rate', fallback=1)
+    queue_size = config.getint('queue_size', fallback=8)
+    render = processing_mode(config) == MODE_FULL
+    sampling = sampling_settings(config)
+    adaptive = sampling['sampling'] == SAMPLING_ADAPTIVE
+    interpolate_max_gap = sampling['interpolate_max_gap']
+    smoothing = smoothing_settings(config)
+    roi = roi_settings(config)
+    athletes = athlete_settings(config)
+    multi = athletes['athletes'] == ATHLETES_MULTI
+    video = video_settings(config)
+
+    # Models that see crops of the full resolution frame rather than the resized frame
+    crops = decode_scale(config) is None
+
+    # Per-frame timings go to histograms and periodic aggregate lines, and a
+    # sample of frames to the trace file when tracing is enabled
+    log_seconds = metrics_settings(config)['metrics_log_seconds']
+    tracer = get_tracer(config)
+
+    logger = logging.getLogger()
+
+    # Without crops, the decoder can hand over frames at the processing size
+    cap = capture if capture is not None else open_capture(video_path, video, scale=decode_scale(config))
+    if not cap.isOpened():
+        logger.error(f"Error opening video file {video_path}")
+        cap.release()
+        raise FileNotFoundError(f"Cannot open video file: {video_path}")
+
+    # Get video properties
+    frame_width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps          = cap.get(cv2.CAP_PROP_FPS)
+    video_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # The source's audio only fits an output of the whole video
+    whole_video = capture is None and start_frame == 0 and (end_frame is None or end_frame >= video_frames)
+
+    # Streams report no frame count; they are read until they end
+    if video_frames > 0 and (end_frame is None or end_frame > video_frames):
+        end_frame = video_frames
+    total_frames = end_frame - start_frame if end_frame is not None else None
+
+    logger.info(f"Input video FPS: {fps}")
+    frame_duration = 1 / fps
+    logger.info(f"Frame duration based on FPS: {frame_duration:.4f} seconds")
+
+    # Reduce frame resolution
+    frame_width = int(frame_width * scale_factor)
+    frame_height = int(frame_height * scale_factor)
+
+    mp_pose = mp.solutions.pose
+    mp_drawing = mp.solutions.drawing_utils
+
+    sampler = None
+    if adaptive:
+        sampler = AdaptiveSampler(
+            fps,
+            target_fps=sampling['sampling_target_fps'],
+            motion_threshold=sampling['sampling_motion_threshold'],
+            landmark_threshold=sampling['sampling_landmark_threshold'],
+            max_gap=sampling['sampling_max_gap']
+        )
+
+    # A track that was lost for longer than a gap that could be filled starts afresh
+    smoother = LandmarkSmoother.from_settings(fps, smoothing, reset_frames=interpolate_max_gap + 1)
+    interpolate = fill_gap if smoother is not None else interpolate_landmarks
+    fill_missed = smoother is not None and smoothing['smoothing_fill_gaps'] and on_interpolated is not None
+
+    tracker = None
+    if roi['roi_enabled'] and not multi:
+        tracker = RoiTracker(
+            margin=roi['roi_margin'],
+            input_size=roi['roi_input_size'],
+            min_size=roi['roi_min_size'],
+            redetect_interval=roi['roi_redetect_interval']
+        )
+
+    # Create the writer of the configured backend
+    out = None
+    if render:
+        out = open_writer(
+            output_path,
+            fps,
+            (frame_width, frame_height),
+            video,
+            audio_source=video_path if whole_video else None
+        )
+
+    # Initialize counters
+    processed_frames = 0
+    written_frames = 0
+    interpolated_frames = 0
+    missed_frames = 0
+
+    # Busy time of the steps that share a pipeline stage: resizing in the
+    # decoder, drawing, encoding and handing over landmarks in the output stage
+    step_times = {'resize': 0.0, 'draw': 0.0, 'encode': 0.0, 'persist': 0.0}
+
+    # Skipped frames waiting for the next detection, and the last detection of
+    # each athlete as {athlete_id: (frame_number, landmarks array)}, to interpolate between
+    pending = []
+    previous = {}
+
+    def decode_frames():
+        """
+        Decoder stage: read and resize frames, marking the ones to skip.
+        """
+        read_start = max(0, start_frame - warmup_frames)
+        # A capture that was handed over may already be past the start
+        if cap.get(cv2.CAP_PROP_POS_FRAMES) != read_start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, read_start)
+
+        frame_indices = range(read_start, end_frame) if end_frame is not None else itertools.count(read_start)
+        for frame_index in frame_indices:
+            if not cap.isOpened():
+                break
+            read_started = time.perf_counter()
+
+            # Frame numbers are 1-based and count from the start of the video
+            frame_counter = frame_index + 1
+            warmup = frame_index < start_frame
+            # Warm-up frames always go through the model to settle tracking.
+            # The adaptive sampler decides in the inference stage instead.
+            skip = not warmup and not adaptive and frame_counter % skip_rate != 0
+
+            full_frame = None
+            if skip and not render:
+                # Nothing to draw or write: advance without converting the frame
+                if not cap.grab():
+                    break
+                frame = None
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+
+                # ROI crops are cut from the full resolution frame
+                if crops:
+                    full_frame = frame
+
+                # Resize frame to reduce processing time. Skipped frames are resized
+                # as well so they match the size of the output video. The ffmpeg
+                # decoder has already done so unless crops need the full frame.
+                if not crops or render:
+                    if frame.shape[1] != frame_width or frame.shape[0] != frame_height:
+                        started = time.perf_counter()
+                        frame = cv2.resize(frame, (frame_width, frame_height))
+                        step_times['resize'] += time.perf_counter() - started
+                else:
+                    frame = None
+
+            item = {
+                'frame_number': frame_counter,
+                'image': frame,
+                'full_frame': full_frame,
+                'warmup': warmup,
+                'skip': skip,
+            }
+            if tracer is not None and not skip and not warmup and random.random() < tracer.rate:
+                item['trace'] = {'decode': [read_started, time.perf_counter()]}
+            yield item
+
+    def detect_pose(item):
+        """
+        Inference stage: run MediaPipe Pose on frames that are not skipped.
+        """
+        # (athlete_id, pose_landmarks, landmarks array) of every athlete found
+        item['athletes'] = []
+        if sampler is not None and not item['warmup']:
+            image = item['image'] if item['image'] is not None else item['full_frame']
+            item['skip'] = not sampler.should_infer(item['frame_number'], image)
+        if item['skip']:
+            item['full_frame'] = None
+            return item
+
+        item['start_time'] = time.perf_counter()
+
+        if multi:
+            full_frame = item.pop('full_frame')
+            image = item['image'] if item['image'] is not None else cv2.resize(full_frame, (frame_width, frame_height))
+            item['athletes'] = athlete_tracker.process(item['frame_number'], full_frame, image)
+            if sampler is not None:
+                sampler.update(item['frame_number'], athlete_tracker.slot_landmarks())
+            return item
+
+        if tracker is not None:
+            results = detect_in_roi(item)
+        else:
+            # Convert the BGR frame to RGB for processing
+            image_rgb = cv2.cvtColor(item['image'], cv2.COLOR_BGR2RGB)
+
+            # Process the image and find pose landmarks
+            results = pose.process(image_rgb)
+        landmarks = None
+        if results.pose_landmarks:
+            landmarks = landmarks_to_array(results.pose_landmarks)
+            item['athletes'] = [(0, results.pose_landmarks, landmarks)]
+        if sampler is not None:
+            sampler.update(item['frame_number'], landmarks)
+        return item
+
+    def detect_in_roi(item):
+        """
+        Run the model on the tracked region, or search the whole frame when
+        there is no region or the athlete was not found in it.
+        """
+        full_frame = item.pop('full_frame')
+        height, width = full_frame.shape[:2]
+        results = None
+        box = tracker.next_box(item['frame_number'])
+        if box is not None:
+            crop = tracker.crop(full_frame, box)
+            results = pose.process(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))
+            if results.pose_landmarks:
+                tracker.to_frame(results.pose_landmarks, box, width, height)
+        if results is None or not results.pose_landmarks:
+            image = item['image'] if item['image'] is not None else cv2.resize(full_frame, (frame_width, frame_height))
+            results = detector.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        tracker.update(landmarks_to_array(results.pose_landmarks) if results.pose_landmarks else None, width, height)
+        return results
+
+    def write_frame(frame, latency=None):
+        nonlocal written_frames
+        if render:
+            started = time.perf_counter()
+            out.write(frame)
+            step_times['encode'] += time.perf_counter() - started
+        written_frames += 1
+        profile.frame_done(latency)
+        if progress_callback:
+            progress_callback(written_frames, total_frames)
+
+    def flush_pending(following):
+        """
+        Write the waiting skipped frames, with the landmarks of each athlete
+        interpolated between their previous detection and their detection in
+        ``following`` when both exist and are close enough.
+        """
+        nonlocal pending, interpolated_frames
+        if not pending:
+            return
+        frames = [item['frame_number'] for item in pending]
+        interpolated = []
+        if on_interpolated is not None:
+            for athlete_id, (previous_frame, previous_landmarks) in previous.items():
+                if athlete_id not in following:
+                    continue
+                following_frame, following_landmarks = following[athlete_id]
+                if following_frame - previous_frame > interpolate_max_gap + 1:
+                    continue
+                landmarks = interpolate(previous_frame, previous_landmarks, following_frame, following_landmarks,
+                                        frames)
+                started = time.perf_counter()
+                on_interpolated(np.asarray(frames, dtype=np.int64), landmarks, athlete_id)
+                step_times['persist'] += time.perf_counter() - started
+                interpolated.append((athlete_id, landmarks))
+        if interpolated:
+            interpolated_frames += len(frames)
+        for index, item in enumerate(pending):
+            if render:
+                started = time.perf_counter()
+                for athlete_id, landmarks in interpolated:
+                    draw_pose(item['image'], landmarks[index], mp_pose.POSE_CONNECTIONS, athlete_color(athlete_id))
+                step_times['draw'] += time.perf_counter() - started
+            write_frame(item['image'])
+        pending = []
+
+    def smooth(item, athlete):
+        """
+        Filter the landmarks of one detected athlete, and put the filtered
+        values into the MediaPipe landmarks that are drawn and stored.
+        """
+        athlete_id, pose_landmarks, landmarks = athlete
+        if on_raw_landmarks is not None and not item['warmup']:
+            on_raw_landmarks(item['frame_number'], landmarks, athlete_id)
+        landmarks = smoother.filter(item['frame_number'], landmarks, athlete_id)
+        write_landmarks(pose_landmarks, landmarks)
+        return athlete_id, pose_landmarks, landmarks
+
+    def annotate_and_write(item):
+        """
+        Output stage: draw landmarks, encode the frame and hand over the pose data.
+        """
+        nonlocal processed_frames, missed_frames, previous
+
+        if smoother is not None:
+            item['athletes'] = [smooth(item, athlete) for athlete in item['athletes']]
+
+        # Detections of this frame, as the next interpolation anchor
+        following = {athlete_id: (item['frame_number'], landmarks) for athlete_id, _, landmarks in item['athletes']}
+
+        # Warm-up frames only feed the tracker, and give the first interpolation anchor
+        if item['warmup']:
+            previous = following
+            return None
+
+        frame = item['image']
+
+        # Frames where nobody was found are filled like skipped ones
+        missed = fill_missed and not item['skip'] and not item['athletes']
+        if missed:
+            processed_frames += 1
+            missed_frames += 1
+
+        # Skipped frames wait for the next detection to interpolate their landmarks
+        if item['skip'] or missed:
+            if on_interpolated is None:
+                write_frame(frame)
+                return None
+            if not render:
+                item['image'] = None
+            pending.append(item)
+            if len(pending) > interpolate_max_gap:
+                # Too far from any detection to interpolate
+                flush_pending({})
+                previous = {}
+            return None
+
+        flush_pending(following)
+        previous = following
+
+        for athlete_id, pose_landmarks, _ in item['athletes']:
+            # Draw the pose annotation on the original frame
+            if render:
+                started = time.perf_counter()
+                mp_drawing.draw_landmarks(
+                    frame,                      # Image to draw on
+                    pose_landmarks,             # Pose landmarks
+                    mp_pose.POSE_CONNECTIONS,   # Connections between landmarks
+                    mp_drawing.DrawingSpec(color=athlete_color(athlete_id), thickness=2, circle_radius=2),  # Landmarks style
+                    mp_drawing.DrawingSpec(color=(0, 0, 255), thickness=2)                                  # Connections style
+                )
+                step_times['draw'] += time.perf_counter() - started
+            started = time.perf_counter()
+            on_landmarks(item['frame_number'], pose_landmarks, athlete_id)
+            step_times['persist'] += time.perf_counter() - started
+
+        # Write the frame to the output video; latencies over the frame duration are counted in the profile
+        write_frame(frame, time.perf_counter() - item['start_time'])
+        processed_frames += 1
+        return None
+
+    def traced(name, func):
+        """
+        Wrap a stage to record when it started and finished on traced frames,
+        and write the trace once the last stage is done with the frame.
+        """
+        def run(item):
+            trace = item.get('trace')
+            if trace is None:
+                return func(item)
+            trace[name] = [time.perf_counter()]
+            result = func(item)
+            trace[name].append(time.perf_counter())
+            if result is None:
+                origin = trace['decode'][0]
+                tracer.write({
+                    'video': video_path,
+                    'frame': item['frame_number'],
+                    'skipped': item['skip'],
+                    'time': time.time(),
+                    # Seconds since the frame started decoding
+                    'stages': {stage: [round(t - origin, 6) for t in times] for stage, times in trace.items()},
+                })
+            return result
+        return run
+
+    # Take initialized MediaPipe Pose graphs from the process-wide pool: one per
+    # athlete, and for whole frame searches one that does not rely on tracking state
+    pose_pool = get_pose_pool(config)
+    settings = pose_settings(config)
+    detector_settings = dict(settings, static_image_mode=True)
+    graph_settings = [settings] * (athletes['max_athletes'] if multi else 1)
+    if crops:
+        graph_settings.append(detector_settings)
+    graphs = pose_pool.checkout_many(graph_settings)
+    pose = graphs[0]
+    detector = graphs[-1] if crops else None
+
+    athlete_tracker = None
+    if multi:
+        athlete_tracker = AthleteTracker(
+            graphs[:-1],
+            detector,
+            mp_pose.POSE_CONNECTIONS,
+            detect_interval=athletes['athlete_detect_interval'],
+            match_iou=athletes['athlete_match_iou'],
+            max_misses=athletes['athlete_max_misses'],
+            max_lost=athletes['athlete_max_lost'],
+            margin=athletes['roi_margin'],
+            input_size=athletes['roi_input_size'],
+            min_size=athletes['roi_min_size']
+        )
+
+    pipeline = Pipeline(queue_size=queue_size)
+    profile = RunProfile(video_path, total_frames, frame_duration, log_seconds, queue_depths=pipeline.queue_depths)
+    pipeline.observer = profile.observe_stage
+    if tracer is not None:
+        pipeline.add_stage('inference', traced('inference', detect_pose))
+        pipeline.add_stage('annotate_encode_persist', traced('annotate_encode_persist', annotate_and_write))
+    else:
+        pipeline.add_stage('inference', detect_pose)
+        pipeline.add_stage('annotate_encode_persist', annotate_and_write)
+    completed = False
+    try:
+        pipeline.run(decode_frames(), source_name='decode')
+        # Frames after the last detection have nothing to interpolate towards
+        flush_pending({})
+        completed = True
+    finally:
+        # Release resources
+        cap.release()
+        if out is not None:
+            out.release()
+        if athlete_tracker is not None:
+            athlete_tracker.close()
+        profile.close()
+        for graph, graph_setting in zip(graphs, graph_settings):
+            if completed:
+                pose_pool.checkin(graph, graph_setting)
+            else:
+                pose_pool.discard(graph)
+
+    return {
+        'total_frames': total_frames if total_frames is not None else written_frames,
+        'processed_frames': processed_frames,
+        'interpolated_frames': interpolated_frames,
+        'missed_frames': missed_frames,
+        'sampling': sampler.stats() if sampler is not None else None,
+        'roi': tracker.stats() if tracker is not None else None,
+        'athletes': athlete_tracker.stats() if athlete_tracker is not None else None,
+        'fps': fps,
+        'stage_times': dict(pipeline.stage_times),
+        'step_times': step_times,
+        'profile': profile,
+    }
@@ -0,0 +1,577 @@
+# pose_index.py
+
+import os
+import threading
+import logging
+
+import numpy as np
+
+from database import Database
+
+# Index types: exact brute force, or inverted lists over k-means clusters
+INDEX_FLAT = 'flat'
+INDEX_IVF = 'ivf'
+
+VISIBILITY_THRESHOLD = 0.5
+
+# Landmarks that describe the pose: nose, shoulders, elbows, wrists, hips,
+# knees, ankles, heels and feet. Face and finger points add noise, not shape.
+BODY_LANDMARKS = [0, 11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32]
+
+# Index of each landmark's counterpart on the other side of the body
+MIRROR_ORDER = [0, 4, 5, 6, 1, 2, 3, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15, 18, 17, 20, 19, 22, 21,
+                24, 23, 26, 25, 28, 27, 30, 29, 32, 31]
+
+# Vectors per cluster needed before the IVF index trains, and per cluster used for training
+IVF_MIN_PER_LIST = 39
+IVF_TRAIN_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+
+# One index per directory, shared by ingestion and queries
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_settings(config):
+    """
+    Read the pose index settings from the configuration.
+    """
+    index_type = config.get('index_type', INDEX_FLAT)
+    if index_type not in (INDEX_FLAT, INDEX_IVF):
+        raise ValueError(f"Unknown index type: {index_type}")
+    return {
+        'index_enabled': config.getboolean('index_enabled', fallback=True),
+        'index_dir': config.get('index_dir', 'index'),
+        'index_type': index_type,
+        'index_window_frames': config.getint('index_window_frames', fallback=15),
+        'index_window_samples': config.getint('index_window_samples', fallback=4),
+        'index_stride_frames': config.getint('index_stride_frames', fallback=15),
+        'index_nlist': config.getint('index_nlist', fallback=256),
+        'index_nprobe': config.getint('index_nprobe', fallback=8),
+    }
+
+
+def get_pose_index(config):
+    """
+    Return the shared index for the configured directory, loading it on first use,
+    or None if indexing is disabled.
+    """
+    settings = index_settings(config)
+    if not settings['index_enabled']:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(settings['index_dir'])
+        if index is None:
+            index = _indexes[settings['index_dir']] = PoseIndex(
+                index_dir=settings['index_dir'],
+                index_type=settings['index_type'],
+                window_frames=settings['index_window_frames'],
+                window_samples=settings['index_window_samples'],
+                stride_frames=settings['index_stride_frames'],
+                nlist=settings['index_nlist'],
+                nprobe=settings['index_nprobe']
+            )
+        return index
+
+
+def index_video(db_config, config, video_id):
+    """
+    Add a processed video to the pose index, if indexing is enabled.
+
+    Failures are logged and not raised, so an index problem never fails the
+    processing job; the video can be indexed again later.
+    """
+    try:
+        index = get_pose_index(config)
+        if index is None:
+            return
+        db = Database(db_config)
+        try:
+            index.add_video(db, video_id)
+        finally:
+            db.close()
+    except Exception:
+        logging.exception(f"Failed to index video {video_id}.")
+
+
+def label_matches(db, matches):
+    """
+    Add the position_name of each match, in place: that of a segment label
+    covering the middle of the match, or else that of its video.
+    """
+    labels = {}
+    videos = {}
+    for match in matches:
+        video_id = match['video_id']
+        if video_id not in videos:
+            video = db.get_video(video_id)
+            videos[video_id] = video['position_name'] if video else None
+            labels[video_id] = db.get_segment_labels(video_id=video_id)
+        middle = (match['start_frame'] + match['end_frame']) // 2
+        # Label ranges are 0-based and end-exclusive, stored frame numbers 1-based
+        covering = [label['position_name'] for label in labels[video_id]
+                    if label['start_frame'] < middle <= label['end_frame']]
+        match['position_name'] = covering[0] if covering else videos[video_id]
+    return matches
+
+
+def mirror_landmarks(landmarks):
+    """
+    Landmarks of the pose seen in a mirror: x flipped and left and right swapped.
+    """
+    mirrored = landmarks[..., MIRROR_ORDER, :].copy()
+    mirrored[..., 0] = 1.0 - mirrored[..., 0]
+    return mirrored
+
+
+def pose_descriptors(landmarks, aspect=1.0):
+    """
+    Describe poses independently of where and how large the athlete is in the frame.
+
+    The visible body landmarks are centred on their mean and divided by their
+    RMS distance from it. Landmarks that are not visible are set to the centre.
+
+    Args:
+        landmarks (numpy.ndarray): Landmarks, shape (N, 33, 4), normalized coordinates.
+        aspect (float): Frame width over height, so x and y are in the same unit.
+
+    Returns:
+        numpy.ndarray: float32 descriptors, shape (N, 2 * len(BODY_LANDMARKS)).
+    """
+    body = np.asarray(landmarks, dtype=np.float32)[:, BODY_LANDMARKS]
+    points = body[..., :2] * np.array([aspect, 1.0], dtype=np.float32)
+    visible = (body[..., 3] >= VISIBILITY_THRESHOLD)[..., None]
+    count = np.maximum(visible.sum(axis=1, keepdims=True), 1)
+    centre = (points * visible).sum(axis=1, keepdims=True) / count
+    points = (points - centre) * visible
+    scale = np.sqrt((points ** 2).sum(axis=(1, 2), keepdims=True) / count)
+    points = points / np.where(scale > 0, scale, 1.0)
+    return points.reshape(len(body), -1)
+
+
+def sequence_descriptor(landmarks, aspect=1.0, samples=4):
+    """
+    Describe a short sequence of poses (or one pose) as one vector.
+
+    The sequence is resampled to `samples` evenly spaced frames; a single frame
+    is repeated, so it matches clips that hold that pose.
+
+    Args:
+        landmarks (numpy.ndarray): Landmarks, shape (M, 33, 4) or (33, 4).
+        aspect (float): Frame width over height.
+        samples (int): Frames per descriptor, as the index was built with.
+
+    Returns:
+        numpy.ndarray: float32 vector of samples * 2 * len(BODY_LANDMARKS) values.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32)
+    if landmarks.ndim == 2:
+        landmarks = landmarks[None]
+    picks = np.rint(np.linspace(0, len(landmarks) - 1, samples)).astype(int)
+    return pose_descriptors(landmarks[picks], aspect).reshape(-1)
+
+
+def window_descriptors(frames, landmarks, aspect=1.0, window_frames=15, samples=4, stride=15):
+    """
+    Cut the stored frames of one athlete into windows and describe each.
+
+    Each window spans window_frames frames and is described by `samples` frames
+    spread over it; a sample takes the stored frame nearest to its position, and
+    windows with a sample too far from any stored frame are left out.
+
+    Args:
+        frames (numpy.ndarray): Frame numbers in increasing order, shape (N,).
+        landmarks (numpy.ndarray): Landmarks, shape (N, 33, 4).
+        aspect (float): Frame width over height.
+        window_frames (int): Frames per window.
+        samples (int): Frames per descriptor.
+        stride (int): Frames between the starts of two windows.
+
+    Returns:
+        tuple: (starts, ends, vectors): first and last frame number of each
+        window, and the descriptors, shape (W, samples * 2 * len(BODY_LANDMARKS)).
+    """
+    dim = samples * 2 * len(BODY_LANDMARKS)
+    if len(frames) == 0 or frames[-1] - frames[0] + 1 < window_frames:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32)
+    starts = np.arange(frames[0], frames[-1] - window_frames + 2, stride)
+    offsets = np.rint(np.linspace(0, window_frames - 1, samples)).astype(np.int64)
+    targets = starts[:, None] + offsets[None, :]
+
+    # Nearest stored frame to every sample position
+    right = np.clip(np.searchsorted(frames, targets), 0, len(frames) - 1)
+    left = np.clip(right - 1, 0, len(frames) - 1)
+    nearest = np.where(np.abs(frames[left] - targets) <= np.abs(frames[right] - targets), left, right)
+    max_gap = max(1, window_frames // (2 * samples))
+    complete = (np.abs(frames[nearest] - targets) <= max_gap).all(axis=1)
+
+    starts = starts[complete]
+    nearest = nearest[complete]
+    vectors = pose_descriptors(landmarks[nearest.reshape(-1)], aspect).reshape(len(starts), dim)
+    return starts, starts + window_frames - 1, vectors
+
+
+class _Growable:
+    """
+    An array that grows at the end without copying on every append.
+    """
+
+    def __init__(self, dtype, width=None):
+        self._shape = () if width is None else (width,)
+        self._data = np.empty((1024,) + self._shape, dtype=dtype)
+        self.size = 0
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        needed = self.size + len(values)
+        if needed > len(self._data):
+            data = np.empty((max(needed, 2 * len(self._data)),) + self._shape, dtype=self._data.dtype)
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size:needed] = values
+        self.size = needed
+
+    @property
+    def view(self):
+        return self._data[:self.size]
+
+
+class FlatIndex:
+    """
+    Exact k-nearest neighbour search by squared Euclidean distance.
+
+    Every query is compared with every vector, one matrix product per batch of
+    queries. Cost grows linearly with the corpus; the baseline for IvfIndex.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._vectors = _Growable(np.float32, dim)
+        self._norms = _Growable(np.float32)
+
+    @property
+    def size(self):
+        return self._vectors.size
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._vectors.append(vectors)
+        self._norms.append((vectors ** 2).sum(axis=1))
+
+    def search(self, queries, k):
+        """
+        Return the distances and ids of the k nearest vectors of every query,
+        nearest first, each of shape (Q, min(k, size)).
+        """
+        return self._search(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim), k, None)
+
+    def _search(self, queries, k, candidates):
+        vectors = self._vectors.view
+        norms = self._norms.view
+        if candidates is not None:
+            vectors = vectors[candidates]
+            norms = norms[candidates]
+        k = min(k, len(vectors))
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        distances = norms[None, :] - 2.0 * queries @ vectors.T + (queries ** 2).sum(axis=1)[:, None]
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < len(vectors) else \
+            np.broadcast_to(np.arange(len(vectors)), (len(queries), len(vectors)))
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        ids = np.take_along_axis(top, order, axis=1)
+        if candidates is not None:
+            ids = candidates[ids]
+        return np.maximum(np.take_along_axis(top_distances, order, axis=1), 0.0), ids
+
+
+class IvfIndex(FlatIndex):
+    """
+    Approximate k-nearest neighbour search over inverted lists.
+
+    The vectors are clustered by k-means into nlist lists, and a query is only
+    compared with the vectors of the nprobe lists whose centroids are nearest,
+    so about nprobe / nlist of the corpus. Until IVF_MIN_PER_LIST vectors per
+    list have been added, it searches exactly like FlatIndex. New vectors join
+    the list of their nearest centroid; the centroids are trained again each
+    time the corpus has grown fourfold since the last training.
+
+    The stored vectors are kept sorted by list, so each list is scanned as one
+    contiguous block instead of being gathered vector by vector; vectors added
+    since the last search are sorted in before the next one.
+    """
+
+    def __init__(self, dim, nlist=256, nprobe=8, seed=0):
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self._assign = _Growable(np.int32)
+        # Id of the vector at each storage position
+        self._ids = _Growable(np.int64)
+        self._bounds = None
+        self._trained_on = 0
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._ids.append(np.arange(self.size, self.size + len(vectors)))
+        super().add(vectors)
+        if self.centroids is not None:
+            self._assign.append(self._nearest_centroids(vectors, 1)[:, 0])
+        if self.size >= max(IVF_MIN_PER_LIST * self.nlist, 4 * self._trained_on):
+            self.train()
+        self._bounds = None
+
+    def train(self):
+        """
+        Cluster (a sample of) the vectors into nlist centroids and reassign all vectors.
+        """
+        vectors = self._vectors.view
+        sample = vectors
+        if len(vectors) > IVF_TRAIN_PER_LIST * self.nlist:
+            sample = vectors[self._rng.choice(len(vectors), IVF_TRAIN_PER_LIST * self.nlist, replace=False)]
+        centroids = sample[self._rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            self.centroids = centroids
+            labels = self._nearest_centroids(sample, 1)[:, 0]
+            counts = np.bincount(labels, minlength=self.nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            # Empty clusters keep their centroid
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self.centroids = centroids
+        self._assign = _Growable(np.int32)
+        self._assign.append(self._nearest_centroids(vectors, 1)[:, 0])
+        self._trained_on = len(vectors)
+        self._bounds = None
+        logging.info(f"Trained pose index lists on {len(sample)} of {len(vectors)} vectors.")
+
+    def search(self, queries, k):
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        if self.centroids is None:
+            distances, positions = self._search(queries, k, None)
+            return distances, self._ids.view[positions]
+        if self._bounds is None:
+            self._sort_lists()
+        vectors = self._vectors.view
+        norms = self._norms.view
+        ids = self._ids.view
+        probes = self._nearest_centroids(queries, min(self.nprobe, self.nlist))
+        found_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        found_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, query_probes in enumerate(probes):
+            query = queries[row]
+            blocks = [(self._bounds[probe], self._bounds[probe + 1]) for probe in query_probes]
+            distances = np.concatenate([norms[start:end] - 2.0 * (vectors[start:end] @ query) for start, end in blocks])
+            positions = np.concatenate([np.arange(start, end) for start, end in blocks])
+            count = min(k, len(distances))
+            if count == 0:
+                continue
+            top = np.argpartition(distances, count - 1)[:count] if count < len(distances) else np.arange(count)
+            top = top[np.argsort(distances[top])]
+            found_distances[row, :count] = np.maximum(distances[top] + query @ query, 0.0)
+            found_ids[row, :count] = ids[positions[top]]
+        return found_distances, found_ids
+
+    def _sort_lists(self):
+        """
+        Reorder the stored vectors by list and record where each list starts.
+        """
+        order = np.argsort(self._assign.view, kind='stable')
+        if (order != np.arange(len(order))).any():
+            for store in (self._vectors, self._norms, self._assign, self._ids):
+                store.view[:] = store.view[order]
+        self._bounds = np.searchsorted(self._assign.view, np.arange(self.nlist + 1))
+
+    def _nearest_centroids(self, vectors, count, batch=65536):
+        norms = (self.centroids ** 2).sum(axis=1)
+        nearest = np.empty((len(vectors), count), dtype=np.int64)
+        for start in range(0, len(vectors), batch):
+            distances = norms[None, :] - 2.0 * vectors[start:start + batch] @ self.centroids.T
+            if count == 1:
+                nearest[start:start + batch, 0] = distances.argmin(axis=1)
+            else:
+                top = np.argpartition(distances, count - 1, axis=1)[:, :count]
+                order = np.argsort(np.take_along_axis(distances, top, axis=1), axis=1)
+                nearest[start:start + batch] = np.take_along_axis(top, order, axis=1)
+        return nearest
+
+
+class PoseIndex:
+    """
+    Searchable windows of the stored landmark sequences of processed videos.
+
+    Every video is cut into windows per athlete (see window_descriptors) whose
+    descriptors go into a FlatIndex or IvfIndex. The windows of each video are
+    also saved in index_dir as one file per video, so the index is rebuilt
+    from there on restart and new videos are added without touching the rest.
+    Queries are matched in their own orientation and mirrored, so a pass to
+    the left also finds the same pass to the right.
+    """
+
+    def __init__(self, index_dir='index', index_type=INDEX_FLAT, window_frames=15, window_samples=4, stride_frames=15,
+                 nlist=256, nprobe=8):
+        """
+        Args:
+            index_dir (str): Directory of the per-video window files.
+            index_type (str): INDEX_FLAT or INDEX_IVF.
+            window_frames (int): Frames per window.
+            window_samples (int): Frames per window descriptor.
+            stride_frames (int): Frames between the starts of two windows.
+            nlist (int): Number of IVF lists.
+            nprobe (int): IVF lists searched per query.
+        """
+        self.dir = index_dir
+        self.window_frames = window_frames
+        self.window_samples = window_samples
+        self.stride_frames = stride_frames
+        self.dim = window_samples * 2 * len(BODY_LANDMARKS)
+        self.index = IvfIndex(self.dim, nlist, nprobe) if index_type == INDEX_IVF else FlatIndex(self.dim)
+        self._video_ids = _Growable(np.int64)
+        self._athlete_ids = _Growable(np.int64)
+        self._starts = _Growable(np.int64)
+        self._ends = _Growable(np.int64)
+        self._videos = set()
+        self._lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+        self._load()
+
+    def _window_file(self, video_id):
+        return os.path.join(self.dir, f"video_{video_id}.npz")
+
+    def _load(self):
+        names = [name for name in os.listdir(self.dir) if name.startswith('video_') and name.endswith('.npz')]
+        for name in sorted(names, key=lambda name: int(name[len('video_'):-len('.npz')])):
+            with np.load(os.path.join(self.dir, name)) as data:
+                if data['vectors'].shape[1:] != (self.dim,):
+                    # Written with other window settings; re-indexed when the video is added again
+                    continue
+                self._add(int(data['video_id']), data['athlete_ids'], data['starts'], data['ends'], data['vectors'])
+        if self._videos:
+            logging.info(f"Loaded pose index of {len(self._videos)} videos, {self.index.size} windows.")
+
+    def _add(self, video_id, athlete_ids, starts, ends, vectors):
+        self.index.add(vectors)
+        self._video_ids.append(np.full(len(starts), video_id))
+        self._athlete_ids.append(athlete_ids)
+        self._starts.append(starts)
+        self._ends.append(ends)
+        self._videos.add(video_id)
+
+    def add_video(self, db, video_id):
+        """
+        Index the stored landmarks of a video, unless it is indexed already.
+
+        Returns:
+            int: Number of windows added.
+        """
+        with self._lock:
+            if video_id in self._videos:
+                return 0
+        video = db.get_video(video_id)
+        if video is None:
+            raise ValueError(f"Video {video_id} not found")
+        aspect = video['width'] / video['height'] if video['width'] and video['height'] else 1.0
+        frames, landmarks, athlete_ids = db.read_pose_frames(video_id, with_athletes=True)
+
+        parts = []
+        for athlete_id in np.unique(athlete_ids):
+            rows = athlete_ids == athlete_id
+            starts, ends, vectors = window_descriptors(frames[rows], landmarks[rows], aspect, self.window_frames,
+                                                       self.window_samples, self.stride_frames)
+            parts.append((np.full(len(starts), athlete_id), starts, ends, vectors))
+        athlete_column = np.concatenate([part[0] for part in parts]) if parts else np.empty(0, dtype=np.int64)
+        starts = np.concatenate([part[1] for part in parts]) if parts else np.empty(0, dtype=np.int64)
+        ends = np.concatenate([part[2] for part in parts]) if parts else np.empty(0, dtype=np.int64)
+        vectors = np.concatenate([part[3] for part in parts]) if parts else np.empty((0, self.dim), dtype=np.float32)
+
+        with self._lock:
+            if video_id in self._videos:
+                return 0
+            # Write under a temporary name so a half-written file is never loaded
+            path = self._window_file(video_id)
+            temp_path = f"{path}.tmp.npz"
+            np.savez(temp_path, video_id=video_id, athlete_ids=athlete_column, starts=starts, ends=ends, vectors=vectors)
+            os.replace(temp_path, path)
+            self._add(video_id, athlete_column, starts, ends, vectors)
+        logging.info(f"Indexed {len(starts)} pose windows of video {video_id}.")
+        return len(starts)
+
+    def sync(self, db, progress_callback=None):
+        """
+        Index every stored video that is not indexed yet, e.g. those processed
+        before indexing was enabled.
+
+        Returns:
+            int: Number of videos added.
+        """
+        with self._lock:
+            missing = [video_id for video_id in db.list_video_ids() if video_id not in self._videos]
+        for done, video_id in enumerate(missing, start=1):
+            self.add_video(db, video_id)
+            if progress_callback:
+                progress_callback(done, len(missing))
+        return len(missing)
+
+    def search(self, landmarks, aspect=1.0, k=10, mirror=True):
+        """
+        Find the stored windows most similar to a pose or short pose sequence.
+
+        Overlapping windows of the same athlete count once, as the best of them.
+
+        Args:
+            landmarks (numpy.ndarray): Query landmarks, shape (M, 33, 4) or (33, 4).
+            aspect (float): Width over height of the frames the query comes from.
+            k (int): Number of matches to return.
+            mirror (bool): Also match the mirrored query.
+
+        Returns:
+            list of dict: video_id, athlete_id, start_frame and end_frame (frame
+            numbers of the window) and distance of each match, best first.
+        """
+        landmarks = np.asarray(landmarks, dtype=np.float32)
+        queries = [sequence_descriptor(landmarks, aspect, self.window_samples)]
+        if mirror:
+            queries.append(sequence_descriptor(mirror_landmarks(landmarks), aspect, self.window_samples))
+        with self._lock:
+            # Neighbouring windows overlap, so look further than k before suppressing them
+            distances, ids = self.index.search(np.stack(queries), 4 * k)
+            video_ids = self._video_ids.view
+            athlete_ids = self._athlete_ids.view
+            starts = self._starts.view
+            ends = self._ends.view
+
+            best = {}
+            for distance, entry in zip(distances.reshape(-1), ids.reshape(-1)):
+                if entry >= 0 and (entry not in best or distance < best[entry]):
+                    best[entry] = distance
+            matches = []
+            for entry, distance in sorted(best.items(), key=lambda item: item[1]):
+                match = {
+                    'video_id': int(video_ids[entry]),
+                    'athlete_id': int(athlete_ids[entry]),
+                    'start_frame': int(starts[entry]),
+                    'end_frame': int(ends[entry]),
+                    'distance': float(np.sqrt(distance)),
+                }
+                if any(other['video_id'] == match['video_id'] and other['athlete_id'] == match['athlete_id']
+                       and other['start_frame'] <= match['end_frame'] and match['start_frame'] <= other['end_frame']
+                       for other in matches):
+                    continue
+                matches.append(match)
+                if len(matches) == k:
+                    break
+        return matches
+
+    def stats(self):
+        """
+        Return the number of indexed videos and windows and the index type.
+        """
+        with self._lock:
+            stats = {'videos': len(self._videos), 'windows': self.index.size, 'dim': self.dim,
+                     'type': INDEX_IVF if isinstance(self.index, IvfIndex) else INDEX_FLAT}
+            if isinstance(self.index, IvfIndex):
+                stats['trained'] = self.index.centroids is not None
+        return stats
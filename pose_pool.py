@@ -0,0 +1,224 @@
+# pose_pool.py
+
+import threading
+import logging
+from contextlib import contextmanager
+
+import mediapipe as mp
+import numpy as np
+
+# One pool per process, shared by all jobs
+_pool = None
+_pool_lock = threading.Lock()
+
+# Size of the blank frame run through new graphs to load the model
+_WARM_FRAME_SHAPE = (64, 64, 3)
+
+
+def get_pose_pool(config):
+    """
+    Return the process-wide pool, created on first use.
+
+    Args:
+        config (dict): Configuration; pose_pool_size is the maximum number of
+            Pose graphs alive at once, 0 disables pooling.
+
+    Returns:
+        PosePool: The shared pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PosePool(config.getint('pose_pool_size', fallback=4))
+        return _pool
+
+
+def _settings_key(settings):
+    return tuple(sorted(settings.items()))
+
+
+class PosePool:
+    """
+    Keeps initialized MediaPipe Pose graphs between videos.
+
+    Building a Pose graph loads the model and sets up its calculators, which is
+    a fixed cost that dominates short clips. Graphs are kept per settings
+    (model_complexity and confidences) and handed out with checkout(); checkin()
+    makes them available again. A checked out graph is reset first, so tracking
+    never carries over from the previous video. At most max_size graphs are
+    alive; when all are in use, checkout() waits for one to be returned, and
+    idle graphs with other settings are closed to make room. Jobs that need several
+    graphs at once take them together with checkout_many(), so two such jobs never
+    wait on each other while each holds part of what it needs.
+    """
+
+    def __init__(self, max_size=4):
+        """
+        Args:
+            max_size (int): Maximum number of graphs alive at once, 0 for no pooling.
+        """
+        self.max_size = max(0, max_size)
+        self._idle = {}
+        self._live = 0
+        self._available = threading.Condition()
+        self._stats = {'created': 0, 'reused': 0, 'closed': 0, 'waits': 0}
+
+    def checkout(self, settings):
+        """
+        Take a graph with the given settings out of the pool.
+
+        Args:
+            settings (dict): Keyword arguments for mp.solutions.pose.Pose, as from
+                pose_detection.pose_settings(). Graphs are in tracking mode unless
+                settings has static_image_mode=True.
+
+        Returns:
+            mp.solutions.pose.Pose: A graph that is ready to process a new video.
+        """
+        return self.checkout_many([settings])[0]
+
+    def checkout_many(self, settings_list):
+        """
+        Take several graphs out of the pool at once, e.g. one per athlete.
+
+        Args:
+            settings_list (list of dict): Settings of each graph, as for checkout().
+
+        Returns:
+            list: The graphs, in the order of settings_list.
+
+        Raises:
+            ValueError: If more graphs are asked for than the pool may hold.
+        """
+        if self.max_size == 0:
+            return [self._create(settings) for settings in settings_list]
+        if len(settings_list) > self.max_size:
+            raise ValueError(f"Cannot check out {len(settings_list)} pose graphs from a pool of {self.max_size}")
+
+        keys = [_settings_key(settings) for settings in settings_list]
+        with self._available:
+            while not self._can_take(keys):
+                self._stats['waits'] += 1
+                self._available.wait()
+            poses = []
+            for key in keys:
+                idle = self._idle.get(key)
+                if idle:
+                    poses.append(idle.pop())
+                    self._stats['reused'] += 1
+                else:
+                    poses.append(None)
+            # Reserve the slots; the new graphs are built outside the lock
+            new = poses.count(None)
+            while self._live + new > self.max_size:
+                self._close_idle_other()
+            self._live += new
+
+        for index, settings in enumerate(settings_list):
+            if poses[index] is not None:
+                # Start the next video from a fresh detection
+                poses[index].reset()
+                continue
+            try:
+                poses[index] = self._create(settings)
+            except Exception:
+                # Give up the whole set: close what was taken, release the reserved slots
+                unbuilt = poses[index:].count(None)
+                for pose in poses:
+                    if pose is not None:
+                        self.discard(pose)
+                with self._available:
+                    self._live -= unbuilt
+                    self._available.notify_all()
+                raise
+        return poses
+
+    def checkin(self, pose, settings):
+        """
+        Return a graph taken with checkout() to the pool.
+        """
+        if self.max_size == 0:
+            pose.close()
+            return
+        with self._available:
+            self._idle.setdefault(_settings_key(settings), []).append(pose)
+            self._available.notify()
+
+    def discard(self, pose):
+        """
+        Close a checked out graph instead of returning it, e.g. after an error
+        that may have left it in a bad state.
+        """
+        pose.close()
+        if self.max_size == 0:
+            return
+        with self._available:
+            self._live -= 1
+            self._stats['closed'] += 1
+            self._available.notify()
+
+    @contextmanager
+    def pose(self, settings):
+        """
+        Check out a graph for the duration of a with block.
+        """
+        pose = self.checkout(settings)
+        try:
+            yield pose
+        except BaseException:
+            self.discard(pose)
+            raise
+        self.checkin(pose, settings)
+
+    def warm(self, settings, count=1):
+        """
+        Build graphs ahead of time, e.g. at startup, and run one blank frame
+        through each so the first video does not pay for loading the model.
+        """
+        poses = [self.checkout(settings) for _ in range(min(count, self.max_size))]
+        blank = np.zeros(_WARM_FRAME_SHAPE, dtype=np.uint8)
+        for pose in poses:
+            pose.process(blank)
+        for pose in poses:
+            self.checkin(pose, settings)
+        logging.info(f"Warmed {len(poses)} pose graphs with {settings}.")
+
+    def stats(self):
+        """
+        Return counters of created, reused and closed graphs, and the pool size.
+        """
+        with self._available:
+            stats = dict(self._stats)
+            stats['live'] = self._live
+            stats['idle'] = sum(len(idle) for idle in self._idle.values())
+        stats['max_size'] = self.max_size
+        return stats
+
+    def _create(self, settings):
+        options = {'static_image_mode': False, 'enable_segmentation': False}
+        options.update(settings)
+        pose = mp.solutions.pose.Pose(**options)
+        with self._available:
+            self._stats['created'] += 1
+        return pose
+
+    def _can_take(self, keys):
+        # Called with the lock held: whether idle graphs and free or freeable
+        # slots cover all the keys
+        wanted = {}
+        for key in keys:
+            wanted[key] = wanted.get(key, 0) + 1
+        reused = sum(min(count, len(self._idle.get(key, ()))) for key, count in wanted.items())
+        idle_left = sum(len(idle) for idle in self._idle.values()) - reused
+        return self._live - idle_left + len(keys) - reused <= self.max_size
+
+    def _close_idle_other(self):
+        # Called with the lock held: free a slot held by an idle graph
+        for key, idle in self._idle.items():
+            if idle:
+                idle.pop().close()
+                self._live -= 1
+                self._stats['closed'] += 1
+                logging.info(f"Closed idle pose graph with settings {dict(key)} to make room.")
+                return True
+        return False
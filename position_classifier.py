@@ -0,0 +1,376 @@
+# position_classifier.py
+
+import os
+import json
+import threading
+import logging
+
+import numpy as np
+
+VISIBILITY_THRESHOLD = 0.5
+
+# Joint angles as (end, vertex, end): elbows, shoulders, hips and knees, left then right
+ANGLE_JOINTS = [(11, 13, 15), (12, 14, 16), (13, 11, 23), (14, 12, 24),
+                (11, 23, 25), (12, 24, 26), (23, 25, 27), (24, 26, 28)]
+
+# Joints whose pairwise distances describe the shape of the body: nose,
+# shoulders, wrists, hips and ankles
+DISTANCE_JOINTS = [0, 11, 12, 15, 16, 23, 24, 27, 28]
+_PAIRS = np.array([(a, b) for i, a in enumerate(DISTANCE_JOINTS) for b in DISTANCE_JOINTS[i + 1:]])
+
+# Per-frame features: angles, distances, torso direction (2) and visible share
+FRAME_FEATURES = len(ANGLE_JOINTS) + len(_PAIRS) + 3
+
+# Fewest detected frames a window needs for a prediction, as a share of its length
+MIN_WINDOW_COVERAGE = 0.25
+
+# Loaded models by path, shared by all jobs
+_models = {}
+_models_lock = threading.Lock()
+
+
+def classifier_settings(config):
+    """
+    Read the position classifier settings from the configuration.
+    """
+    return {
+        'classifier_enabled': config.getboolean('classifier_enabled', fallback=True),
+        'classifier_path': config.get('classifier_path', 'models/position_classifier.npz'),
+        'classifier_window_frames': config.getint('classifier_window_frames', fallback=30),
+        'classifier_stride_frames': config.getint('classifier_stride_frames', fallback=15),
+        'classifier_l2': config.getfloat('classifier_l2', fallback=1e-3),
+        'classifier_epochs': config.getint('classifier_epochs', fallback=500),
+    }
+
+
+def get_classifier(config):
+    """
+    Return the trained classifier at classifier_path, or None if it is disabled
+    or has not been trained yet. Reloaded when the file changes.
+    """
+    settings = classifier_settings(config)
+    path = settings['classifier_path']
+    if not settings['classifier_enabled'] or not os.path.exists(path):
+        return None
+    with _models_lock:
+        mtime = os.path.getmtime(path)
+        cached = _models.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _models[path] = (mtime, PositionClassifier.load(path))
+        return cached[1]
+
+
+def frame_features(landmarks, aspect=1.0):
+    """
+    Describe the body shape of every frame by joint angles and distances.
+
+    Distances are divided by the spread of the visible joints, so they do not
+    depend on how large the athlete is in the frame. The torso direction (from
+    the hips to the shoulders) tells lying from upright positions.
+
+    Args:
+        landmarks (numpy.ndarray): Landmarks, shape (N, 33, 4), normalized coordinates.
+        aspect (float): Frame width over height.
+
+    Returns:
+        numpy.ndarray: float32 features, shape (N, FRAME_FEATURES).
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float32)
+    points = landmarks[..., :2] * np.array([aspect, 1.0], dtype=np.float32)
+
+    joints = np.array(ANGLE_JOINTS)
+    first = points[:, joints[:, 0]] - points[:, joints[:, 1]]
+    second = points[:, joints[:, 2]] - points[:, joints[:, 1]]
+    cross = first[..., 0] * second[..., 1] - first[..., 1] * second[..., 0]
+    angles = np.arctan2(cross, (first * second).sum(axis=-1))
+    angles = np.abs(angles) / np.pi
+
+    body = points[:, DISTANCE_JOINTS]
+    visible = landmarks[:, DISTANCE_JOINTS, 3] >= VISIBILITY_THRESHOLD
+    count = np.maximum(visible.sum(axis=1), 1)
+    centre = (body * visible[..., None]).sum(axis=1) / count[:, None]
+    spread = np.sqrt((((body - centre[:, None]) ** 2).sum(axis=-1) * visible).sum(axis=1) / count)
+    spread = np.where(spread > 0, spread, 1.0)
+    distances = np.linalg.norm(points[:, _PAIRS[:, 0]] - points[:, _PAIRS[:, 1]], axis=-1) / spread[:, None]
+
+    torso = (points[:, 11] + points[:, 12]) / 2 - (points[:, 23] + points[:, 24]) / 2
+    torso = torso / np.maximum(np.linalg.norm(torso, axis=-1, keepdims=True), 1e-6)
+
+    return np.concatenate([angles, distances, torso, visible.mean(axis=1, keepdims=True)], axis=1).astype(np.float32)
+
+
+def window_features(frames, features, ends, window_frames):
+    """
+    Mean and standard deviation of the frame features of windows ending at
+    the given frames.
+
+    Args:
+        frames (numpy.ndarray): Frame numbers in increasing order, shape (N,).
+        features (numpy.ndarray): Features of those frames, shape (N, F).
+        ends (numpy.ndarray): Last frame of each window, shape (W,).
+        window_frames (int): Frames per window.
+
+    Returns:
+        tuple: (window features of shape (W, 2 * F), number of frames in each window).
+    """
+    frames = np.asarray(frames)
+    ends = np.asarray(ends)
+    sums = np.concatenate([np.zeros((1, features.shape[1])), np.cumsum(features, axis=0, dtype=np.float64)])
+    squares = np.concatenate([np.zeros((1, features.shape[1])), np.cumsum(features.astype(np.float64) ** 2, axis=0)])
+    high = np.searchsorted(frames, ends, side='right')
+    low = np.searchsorted(frames, ends - window_frames, side='right')
+    counts = high - low
+    divisor = np.maximum(counts, 1)[:, None]
+    mean = (sums[high] - sums[low]) / divisor
+    variance = np.maximum((squares[high] - squares[low]) / divisor - mean ** 2, 0.0)
+    return np.concatenate([mean, np.sqrt(variance)], axis=1).astype(np.float32), counts
+
+
+class PositionClassifier:
+    """
+    Multinomial logistic regression over window features.
+
+    Small enough to train in seconds and to run on every window on the CPU
+    next to pose inference. Features are standardized with the mean and
+    spread of the training data.
+    """
+
+    def __init__(self, classes, weights, bias, mean, scale, window_frames):
+        self.classes = list(classes)
+        self.weights = weights
+        self.bias = bias
+        self.mean = mean
+        self.scale = scale
+        self.window_frames = window_frames
+
+    @classmethod
+    def fit(cls, features, labels, window_frames, l2=1e-3, epochs=500, learning_rate=0.5):
+        """
+        Train on window features and their position names by full batch
+        gradient descent on the cross-entropy, with L2 regularization.
+        """
+        classes = sorted(set(labels))
+        targets = np.searchsorted(classes, labels)
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale = np.where(scale > 1e-6, scale, 1.0)
+        x = (features - mean) / scale
+        onehot = np.eye(len(classes), dtype=np.float32)[targets]
+        # Classes weighted by inverse frequency, so a common position does not drown rare ones
+        sample_weights = (len(targets) / (len(classes) * np.bincount(targets, minlength=len(classes))))[targets]
+        sample_weights = (sample_weights / sample_weights.sum())[:, None]
+
+        weights = np.zeros((x.shape[1], len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        for _ in range(epochs):
+            probabilities = _softmax(x @ weights + bias)
+            error = (probabilities - onehot) * sample_weights
+            weights -= learning_rate * (x.T @ error + l2 * weights)
+            bias -= learning_rate * error.sum(axis=0)
+        return cls(classes, weights.astype(np.float32), bias.astype(np.float32), mean.astype(np.float32),
+                   scale.astype(np.float32), window_frames)
+
+    def predict_proba(self, features):
+        """
+        Return the probability of every class per window, shape (W, len(classes)).
+        """
+        return _softmax(((features - self.mean) / self.scale) @ self.weights + self.bias)
+
+    def predict(self, features):
+        """
+        Return the most likely position name and its probability per window.
+        """
+        probabilities = self.predict_proba(features)
+        best = probabilities.argmax(axis=1)
+        return [self.classes[index] for index in best], probabilities[np.arange(len(best)), best]
+
+    def save(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so a half-written model is never loaded
+        temp_path = f"{path}.tmp.npz"
+        np.savez(temp_path, classes=json.dumps(self.classes), weights=self.weights, bias=self.bias, mean=self.mean,
+                 scale=self.scale, window_frames=self.window_frames)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(json.loads(str(data['classes'])), data['weights'], data['bias'], data['mean'], data['scale'],
+                       int(data['window_frames']))
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class PositionTracker:
+    """
+    Classifies the position of each athlete while a video is processed.
+
+    Fed with chunks of detected landmarks as they are stored, it keeps the
+    features of the last window of frames per athlete and classifies a window
+    every stride_frames frames, so there is no second pass over the landmarks.
+    """
+
+    def __init__(self, classifier, fps, aspect=1.0, stride_frames=15):
+        """
+        Args:
+            classifier (PositionClassifier): The trained model.
+            fps (float): Frame rate, for the timestamps of predictions.
+            aspect (float): Frame width over height.
+            stride_frames (int): Frames between the ends of two classified windows.
+        """
+        self.classifier = classifier
+        self.fps = fps or 30.0
+        self.aspect = aspect
+        self.window_frames = classifier.window_frames
+        self.stride_frames = max(1, stride_frames)
+        self._frames = {}
+        self._features = {}
+        self._next_end = {}
+        self.predictions = []
+        self._lock = threading.Lock()
+
+    def update(self, frames, landmarks, athlete_id=0):
+        """
+        Add detected landmarks of one athlete, in frame order, and classify
+        the windows that ended.
+        """
+        if len(frames) == 0:
+            return
+        frames = np.asarray(frames, dtype=np.int64)
+        features = frame_features(landmarks, self.aspect)
+        with self._lock:
+            if athlete_id in self._frames:
+                frames = np.concatenate([self._frames[athlete_id], frames])
+                features = np.concatenate([self._features[athlete_id], features])
+            next_end = self._next_end.get(athlete_id, frames[0] + self.window_frames - 1)
+            ends = np.arange(next_end, frames[-1] + 1, self.stride_frames)
+            if len(ends):
+                self._classify(athlete_id, frames, features, ends)
+                next_end = ends[-1] + self.stride_frames
+            self._next_end[athlete_id] = next_end
+            # Only the frames that later windows still cover are kept
+            keep = frames > next_end - self.window_frames
+            self._frames[athlete_id] = frames[keep]
+            self._features[athlete_id] = features[keep]
+
+    def _classify(self, athlete_id, frames, features, ends):
+        windows, counts = window_features(frames, features, ends, self.window_frames)
+        enough = counts >= max(1, int(MIN_WINDOW_COVERAGE * self.window_frames))
+        if not enough.any():
+            return
+        names, confidences = self.classifier.predict(windows[enough])
+        for end, name, confidence in zip(ends[enough].tolist(), names, confidences.tolist()):
+            start = end - self.window_frames + 1
+            self.predictions.append({
+                'athlete_id': int(athlete_id),
+                'start_frame': start,
+                'end_frame': end,
+                # Stored frame numbers start at 1
+                'start_time': (start - 1) / self.fps,
+                'end_time': end / self.fps,
+                'position_name': name,
+                'confidence': confidence,
+            })
+
+    def take_predictions(self):
+        """
+        Return the predictions made so far and forget them.
+        """
+        with self._lock:
+            predictions, self.predictions = self.predictions, []
+        return predictions
+
+
+def training_windows(db, window_frames, stride_frames):
+    """
+    Collect window features and labels from the stored position names.
+
+    A video's segment labels provide the labels of their ranges; videos without
+    labels that have a position_name are labelled with it as a whole. Only
+    detected frames are used, as during processing.
+
+    Returns:
+        tuple: (features of shape (W, 2 * FRAME_FEATURES), labels, video id per window).
+    """
+    features, labels, video_ids = [], [], []
+    for video_id in db.list_video_ids():
+        video = db.get_video(video_id)
+        ranges = [(label['start_frame'] + 1, label['end_frame'], label['position_name'])
+                  for label in db.get_segment_labels(video_id=video_id) if label['position_name']]
+        if not ranges and video['position_name']:
+            ranges = [(None, None, video['position_name'])]
+        if not ranges:
+            continue
+        aspect = video['width'] / video['height'] if video['width'] and video['height'] else 1.0
+        for first, last, name in ranges:
+            frames, landmarks, athlete_ids = db.read_pose_frames(video_id, first, last, include_interpolated=False,
+                                                                 with_athletes=True)
+            for athlete_id in np.unique(athlete_ids):
+                rows = athlete_ids == athlete_id
+                if rows.sum() == 0:
+                    continue
+                athlete_frames = frames[rows]
+                ends = np.arange(athlete_frames[0] + window_frames - 1, athlete_frames[-1] + 1, stride_frames)
+                windows, counts = window_features(athlete_frames, frame_features(landmarks[rows], aspect), ends,
+                                                  window_frames)
+                enough = counts >= max(1, int(MIN_WINDOW_COVERAGE * window_frames))
+                features.append(windows[enough])
+                labels += [name] * int(enough.sum())
+                video_ids += [video_id] * int(enough.sum())
+    if not features:
+        return np.empty((0, 2 * FRAME_FEATURES), dtype=np.float32), [], []
+    return np.concatenate(features), labels, video_ids
+
+
+def train_position_classifier(db, config, progress_callback=None):
+    """
+    Train the classifier on the stored position names and save it to classifier_path.
+
+    One video in five is held out to report the accuracy on unseen footage,
+    then the model is trained again on all of them.
+
+    Returns:
+        dict: Number of windows and videos, classes, and held-out accuracy
+        (None when there are too few videos to hold any out).
+
+    Raises:
+        ValueError: If there are fewer than two labelled positions.
+    """
+    settings = classifier_settings(config)
+    window_frames = settings['classifier_window_frames']
+    features, labels, video_ids = training_windows(db, window_frames, settings['classifier_stride_frames'])
+    if len(set(labels)) < 2:
+        raise ValueError("Training needs windows of at least two labelled positions")
+    labels = np.array(labels)
+    video_ids = np.array(video_ids)
+    if progress_callback:
+        progress_callback(0, 2)
+
+    accuracy = None
+    held_out = np.isin(video_ids, np.unique(video_ids)[::5])
+    if 0 < held_out.sum() < len(labels) and len(set(labels[~held_out])) >= 2:
+        model = PositionClassifier.fit(features[~held_out], labels[~held_out].tolist(), window_frames,
+                                       settings['classifier_l2'], settings['classifier_epochs'])
+        names, _ = model.predict(features[held_out])
+        accuracy = float(np.mean(np.array(names) == labels[held_out]))
+    if progress_callback:
+        progress_callback(1, 2)
+
+    model = PositionClassifier.fit(features, labels.tolist(), window_frames, settings['classifier_l2'],
+                                   settings['classifier_epochs'])
+    model.save(settings['classifier_path'])
+    if progress_callback:
+        progress_callback(2, 2)
+    report = {
+        'windows': int(len(labels)),
+        'videos': int(len(np.unique(video_ids))),
+        'classes': model.classes,
+        'held_out_accuracy': accuracy,
+    }
+    logging.info(f"Trained position classifier: {report}")
+    return report
@@ -0,0 +1,203 @@
+# renderer.py
+
+import os
+import json
+import uuid
+import hashlib
+import logging
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from database import Database
+from video_io import open_capture, open_writer, video_settings
+
+# Same look as mp_drawing.draw_landmarks with the styles used in pose_detection
+LANDMARK_COLOR = (0, 255, 0)
+CONNECTION_COLOR = (0, 0, 255)
+BORDER_COLOR = (224, 224, 224)
+THICKNESS = 2
+CIRCLE_RADIUS = 2
+VISIBILITY_THRESHOLD = 0.5
+
+# Landmark colors of further athletes in multi-athlete mode; the first keeps LANDMARK_COLOR
+ATHLETE_COLORS = [(255, 128, 0), (0, 255, 255), (255, 0, 255)]
+
+# Frames of landmarks read from the database at a time
+READ_CHUNK_FRAMES = 1000
+
+
+def athlete_color(athlete_id):
+    """
+    Landmark color of an athlete, so the athletes of a frame can be told apart.
+    """
+    if athlete_id == 0:
+        return LANDMARK_COLOR
+    return ATHLETE_COLORS[(athlete_id - 1) % len(ATHLETE_COLORS)]
+
+
+def draw_pose(frame, landmarks, connections, landmark_color=LANDMARK_COLOR):
+    """
+    Draw one frame's stored landmarks onto an image.
+
+    Args:
+        frame (numpy.ndarray): BGR image to draw on.
+        landmarks (numpy.ndarray): Landmarks of shape (33, 4) with normalized x, y.
+        connections (iterable): Pairs of landmark indices to join with lines.
+        landmark_color (tuple): BGR color of the landmarks, e.g. from athlete_color().
+    """
+    height, width = frame.shape[:2]
+    points = np.rint(landmarks[:, :2] * (width, height)).astype(np.int32).tolist()
+    visible = (landmarks[:, 3] >= VISIBILITY_THRESHOLD).tolist()
+
+    for start, end in connections:
+        if visible[start] and visible[end]:
+            cv2.line(frame, tuple(points[start]), tuple(points[end]), CONNECTION_COLOR, THICKNESS)
+    for point, is_visible in zip(points, visible):
+        if is_visible:
+            cv2.circle(frame, tuple(point), CIRCLE_RADIUS + 1, BORDER_COLOR, THICKNESS)
+            cv2.circle(frame, tuple(point), CIRCLE_RADIUS, landmark_color, THICKNESS)
+
+
+def render_path(config, video):
+    """
+    Path of the cached render of a video.
+
+    The name includes a digest of the settings the landmarks were produced with,
+    so a video processed again with other settings gets a new render.
+    """
+    renders_dir = config.get('renders_dir', 'renders')
+    digest = hashlib.sha256(json.dumps(video['model_settings'], sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.join(renders_dir, f"video_{video['id']}_{digest}.mp4")
+
+
+def cached_render(config, video):
+    """
+    Return the path of an existing render of the video, or None.
+    """
+    path = render_path(config, video)
+    if os.path.exists(path):
+        # Mark as recently used for eviction
+        os.utime(path)
+        return path
+    return None
+
+
+def render_video(db_config, config, video_id, progress_callback=None):
+    """
+    Render the annotated video of a processed video from its stored landmarks.
+
+    The result is cached in renders_dir, so the encode cost is only paid the
+    first time the video is requested.
+
+    Args:
+        db_config (dict): Database configuration parameters.
+        config (dict): Additional configuration parameters.
+        video_id (int): Id of the video row.
+        progress_callback (callable): Optional, called as progress_callback(frames_done, total_frames).
+
+    Returns:
+        str: Path of the rendered video.
+    """
+    db = Database(db_config)
+    try:
+        video = db.get_video(video_id)
+        if video is None:
+            raise ValueError(f"Unknown video: {video_id}")
+        path = cached_render(config, video)
+        if path:
+            return path
+
+        source = video['source']
+        scale_factor = video['model_settings'].get('scale_factor', config.getfloat('scale_factor', fallback=0.5))
+        settings = video_settings(config)
+        cap = open_capture(source, settings, scale=scale_factor) if source else None
+        if cap is None or not cap.isOpened():
+            logging.error(f"Source video of video {video_id} is not available: {source}")
+            raise FileNotFoundError(f"Source video is not available: {source}")
+
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        # Only the processed range of a segment is rendered
+        start_frame = video['start_frame'] or 0
+        end_frame = video['end_frame'] or int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+        total_frames = end_frame - start_frame if end_frame is not None else None
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH) * scale_factor)
+        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT) * scale_factor)
+
+        path = render_path(config, video)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so a half-written file is never served
+        temp_path = f"{os.path.splitext(path)[0]}.{uuid.uuid4().hex}.tmp.mp4"
+        # The source's audio only lines up with a render of the whole video
+        out = open_writer(temp_path, fps, (frame_width, frame_height), settings,
+                          audio_source=None if video['start_frame'] or video['end_frame'] else source)
+        connections = mp.solutions.pose.POSE_CONNECTIONS
+
+        try:
+            frame_number = start_frame
+            chunk = {}
+            chunk_end = 0
+            while end_frame is None or frame_number < end_frame:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_number += 1
+
+                if frame_number > chunk_end:
+                    frames, landmarks, athlete_ids = db.read_pose_frames(
+                        video_id, frame_number, frame_number + READ_CHUNK_FRAMES - 1, with_athletes=True
+                    )
+                    # Every athlete of a frame, in multi-athlete mode there can be several
+                    chunk = {}
+                    for frame_index, frame_landmarks, athlete_id in zip(frames.tolist(), landmarks, athlete_ids.tolist()):
+                        chunk.setdefault(frame_index, []).append((athlete_id, frame_landmarks))
+                    chunk_end = frame_number + READ_CHUNK_FRAMES - 1
+
+                if frame.shape[1] != frame_width or frame.shape[0] != frame_height:
+                    frame = cv2.resize(frame, (frame_width, frame_height))
+                for athlete_id, frame_landmarks in chunk.get(frame_number, ()):
+                    draw_pose(frame, frame_landmarks, connections, athlete_color(athlete_id))
+                out.write(frame)
+
+                if progress_callback:
+                    progress_callback(frame_number - start_frame, total_frames)
+        finally:
+            cap.release()
+            out.release()
+
+        os.replace(temp_path, path)
+        logging.info(f"Rendered video {video_id} to '{path}'.")
+        evict_renders(
+            config.get('renders_dir', 'renders'),
+            int(config.getfloat('render_cache_max_mb', fallback=10240) * 1024 * 1024),
+            keep=path
+        )
+        return path
+    finally:
+        db.close()
+
+
+def evict_renders(renders_dir, max_bytes, keep=None):
+    """
+    Delete the least recently used renders until the directory fits in max_bytes.
+    The render at ``keep`` is never deleted.
+    """
+    entries = []
+    for name in os.listdir(renders_dir):
+        path = os.path.join(renders_dir, name)
+        if name.endswith('.tmp.mp4') or path == keep or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if keep and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        logging.info(f"Evicted render '{path}'.")
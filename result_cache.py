@@ -0,0 +1,228 @@
+# result_cache.py
+
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import time
+import logging
+
+import numpy as np
+
+from metrics import get_metrics
+
+# One cache object per directory, so hit/miss counters cover the whole process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def file_key(path, chunk_size=1 << 20):
+    """
+    Hash the content of a file.
+
+    Returns:
+        str: 'file:' followed by the SHA-256 of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return f"file:{digest.hexdigest()}"
+
+
+def url_key(video_url, start_time, end_time, video_format):
+    """
+    Identify a downloaded segment by URL, time range and download format.
+    """
+    return f"url:{video_url}|{float(start_time):.3f}|{float(end_time):.3f}|{video_format}"
+
+
+def range_key(input_key, start_time, end_time):
+    """
+    Identify a time range, in seconds, of an input identified by input_key.
+    """
+    return f"{input_key}|range:{float(start_time):.3f}-{float(end_time):.3f}"
+
+
+def result_key(input_key, params):
+    """
+    Combine an input key with the processing parameters into a cache key.
+
+    Args:
+        input_key (str): From file_key(), url_key() or range_key().
+        params (dict): Settings that change the result, e.g. scale_factor and skip_rate.
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    payload = json.dumps({'input': input_key, 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_result_cache(config):
+    """
+    Return the shared cache for the configured directory, or None if disabled.
+    """
+    if not config.getboolean('cache_enabled', fallback=True):
+        return None
+    cache_dir = config.get('cache_dir', 'cache')
+    max_bytes = int(config.getfloat('cache_max_mb', fallback=10240) * 1024 * 1024)
+    with _caches_lock:
+        cache = _caches.get(cache_dir)
+        if cache is None:
+            cache = _caches[cache_dir] = ResultCache(cache_dir, max_bytes)
+        cache.max_bytes = max_bytes
+        return cache
+
+
+class ResultCache:
+    """
+    Stores annotated videos and landmark arrays by result key.
+
+    Entries are kept in cache_dir with an SQLite index. When the total size goes
+    over max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        Args:
+            cache_dir (str): Directory for the cached files and the index.
+            max_bytes (int): Size limit of all cached files together.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.db'), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    video_path TEXT,
+                    landmarks_path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    meta TEXT,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def get(self, key):
+        """
+        Look up a cached result and mark it as recently used.
+
+        Returns:
+            dict: video_path, landmarks_path and meta, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None and not os.path.exists(row['landmarks_path']):
+                # Files removed behind our back
+                with self._conn:
+                    self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                row = None
+            if row is None:
+                self._stats['misses'] += 1
+                get_metrics().inc('pose_cache_requests_total', result='miss')
+                return None
+            with self._conn:
+                self._conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._stats['hits'] += 1
+            get_metrics().inc('pose_cache_requests_total', result='hit')
+        return {
+            'key': key,
+            'video_path': row['video_path'],
+            'landmarks_path': row['landmarks_path'],
+            'meta': json.loads(row['meta'] or '{}'),
+        }
+
+    def load_landmarks(self, entry):
+        """
+        Load the landmark arrays of a cache entry.
+
+        Returns:
+            tuple: (frames, landmarks, interpolated, athlete_ids) arrays.
+        """
+        with np.load(entry['landmarks_path']) as data:
+            count = len(data['frames'])
+            interpolated = data['interpolated'] if 'interpolated' in data else np.zeros(count, dtype=bool)
+            athlete_ids = data['athlete_ids'] if 'athlete_ids' in data else np.zeros(count, dtype=np.int64)
+            return data['frames'], data['landmarks'], interpolated, athlete_ids
+
+    def put(self, key, video_path, frames, landmarks, meta=None, interpolated=None, athlete_ids=None):
+        """
+        Add a result to the cache and evict old entries if over the size limit.
+
+        Args:
+            key (str): From result_key().
+            video_path (str): Annotated video to copy into the cache, or None.
+            frames (numpy.ndarray): Frame numbers, shape (N,).
+            landmarks (numpy.ndarray): Landmarks, shape (N, 33, 4).
+            meta (dict): Extra information stored with the entry, e.g. fps and resolution.
+            interpolated (numpy.ndarray): Booleans of shape (N,) marking interpolated frames.
+            athlete_ids (numpy.ndarray): Athlete of each row, shape (N,); all 0 if None.
+        """
+        entry_dir = os.path.join(self.cache_dir, key[:2])
+        os.makedirs(entry_dir, exist_ok=True)
+        landmarks_path = os.path.join(entry_dir, f"{key}.npz")
+        if interpolated is None:
+            interpolated = np.zeros(len(frames), dtype=bool)
+        if athlete_ids is None:
+            athlete_ids = np.zeros(len(frames), dtype=np.int64)
+        np.savez(landmarks_path, frames=frames, landmarks=landmarks, interpolated=interpolated, athlete_ids=athlete_ids)
+        size = os.path.getsize(landmarks_path)
+
+        cached_video = None
+        if video_path:
+            cached_video = os.path.join(entry_dir, f"{key}{os.path.splitext(video_path)[1]}")
+            shutil.copyfile(video_path, cached_video)
+            size += os.path.getsize(cached_video)
+
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, cached_video, landmarks_path, size, json.dumps(meta or {}), now, now)
+                )
+            self._stats['stores'] += 1
+            self._evict(keep=key)
+        logging.info(f"Cached result {key} ({size} bytes).")
+
+    def stats(self):
+        """
+        Return hit/miss counters, hit rate, entry count and total size.
+        """
+        with self._lock:
+            count, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['entries'] = count
+        stats['bytes'] = size
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    def _evict(self, keep):
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            'SELECT key, video_path, landmarks_path, size FROM entries WHERE key != ? ORDER BY last_access',
+            (keep,)
+        ).fetchall()
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            for path in (row['video_path'], row['landmarks_path']):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            with self._conn:
+                self._conn.execute('DELETE FROM entries WHERE key = ?', (row['key'],))
+            total -= row['size']
+            self._stats['evictions'] += 1
+            logging.info(f"Evicted cached result {row['key']}.")
@@ -0,0 +1,164 @@
+# roi.py
+
+import cv2
+
+# Landmarks below this visibility do not count towards the tracked box
+VISIBILITY_THRESHOLD = 0.5
+
+
+def roi_settings(config):
+    """
+    Read the ROI tracking settings from the configuration.
+
+    Returns:
+        dict: roi_enabled, and when enabled the crop margin, input size,
+        minimum box size and re-detection interval.
+    """
+    if not config.getboolean('roi_enabled', fallback=False):
+        return {'roi_enabled': False}
+    return {
+        'roi_enabled': True,
+        'roi_margin': config.getfloat('roi_margin', fallback=0.25),
+        'roi_input_size': config.getint('roi_input_size', fallback=256),
+        'roi_min_size': config.getfloat('roi_min_size', fallback=0.2),
+        'roi_redetect_interval': config.getint('roi_redetect_interval', fallback=0),
+    }
+
+
+class RoiTracker:
+    """
+    Tracks a square region around the athlete from the previous landmarks.
+
+    The model then only sees that region of the full resolution frame, resized
+    to its input size, instead of the whole downscaled frame: less empty mat,
+    more pixels on the athlete. The box keeps still while the landmarks stay
+    well inside it, so the tracking inside the model sees a steady image, and
+    is moved or resized when they come near its edge or it becomes much larger
+    than needed. Without a box (at the start, after losing the athlete, or
+    every redetect_interval frames) the whole frame is used.
+    """
+
+    def __init__(self, margin=0.25, input_size=256, min_size=0.2, redetect_interval=0):
+        """
+        Args:
+            margin (float): Space added around the landmarks on each side, as a
+                share of their extent.
+            input_size (int): Side of the square image passed to the model.
+            min_size (float): Minimum side of the box, as a share of the shorter
+                frame side.
+            redetect_interval (int): Use the whole frame every this many frames
+                to pick up a drifting box, 0 to only do so when tracking is lost.
+        """
+        self.margin = margin
+        self.input_size = input_size
+        self.min_size = min_size
+        self.redetect_interval = redetect_interval
+        # Current box as (x0, y0, side) in full frame pixels; may extend past the frame
+        self.box = None
+        self._last_full = None
+        self._stats = {'crops': 0, 'full_frames': 0, 'lost': 0, 'box_moves': 0, 'crop_area': 0.0}
+
+    def next_box(self, frame_number):
+        """
+        Return the box to crop for a frame, or None to use the whole frame.
+        """
+        if self.box is not None and self.redetect_interval and self._last_full is not None \
+                and frame_number - self._last_full >= self.redetect_interval:
+            self._last_full = frame_number
+            self._stats['full_frames'] += 1
+            return None
+        if self.box is None:
+            self._last_full = frame_number
+            self._stats['full_frames'] += 1
+            return None
+        self._stats['crops'] += 1
+        return self.box
+
+    def crop(self, frame, box):
+        """
+        Cut a box out of a frame, padding with black where it extends past the
+        frame, and resize it to the model input size.
+        """
+        height, width = frame.shape[:2]
+        x0, y0, side = box
+        x1, y1 = x0 + side, y0 + side
+        region = frame[max(0, y0):min(height, y1), max(0, x0):min(width, x1)]
+        if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+            region = cv2.copyMakeBorder(
+                region,
+                max(0, -y0), max(0, y1 - height), max(0, -x0), max(0, x1 - width),
+                cv2.BORDER_CONSTANT, value=(0, 0, 0)
+            )
+        self._stats['crop_area'] += side * side / (width * height)
+        return cv2.resize(region, (self.input_size, self.input_size), interpolation=cv2.INTER_AREA)
+
+    def to_frame(self, pose_landmarks, box, width, height):
+        """
+        Map landmarks detected in a crop to normalized full frame coordinates, in place.
+
+        Args:
+            pose_landmarks: MediaPipe NormalizedLandmarkList, relative to the crop.
+            box (tuple): The box the crop was cut from.
+            width (int): Full frame width in pixels.
+            height (int): Full frame height in pixels.
+        """
+        x0, y0, side = box
+        scale_x = side / width
+        scale_y = side / height
+        offset_x = x0 / width
+        offset_y = y0 / height
+        for landmark in pose_landmarks.landmark:
+            landmark.x = offset_x + landmark.x * scale_x
+            landmark.y = offset_y + landmark.y * scale_y
+            # Depth uses roughly the scale of x
+            landmark.z = landmark.z * scale_x
+
+    def update(self, landmarks, width, height):
+        """
+        Move the box to follow the landmarks of the last inferred frame.
+
+        Args:
+            landmarks (numpy.ndarray): Landmarks of shape (33, 4) in normalized full
+                frame coordinates, or None if the athlete was not found.
+            width (int): Full frame width in pixels.
+            height (int): Full frame height in pixels.
+        """
+        visible = None if landmarks is None else landmarks[:, 3] >= VISIBILITY_THRESHOLD
+        if visible is None or not visible.any():
+            if self.box is not None:
+                self._stats['lost'] += 1
+            self.box = None
+            return
+
+        points = landmarks[visible, :2] * (width, height)
+        low = points.min(axis=0)
+        high = points.max(axis=0)
+        extent = high - low
+
+        # Never smaller than min_size, never larger than the frame's longer side
+        needed = max(extent.max() * (1 + 2 * self.margin), self.min_size * min(width, height))
+        needed = min(needed, max(width, height))
+
+        if self.box is not None:
+            x0, y0, side = self.box
+            inner = side * self.margin / 2
+            inside = (low[0] >= x0 + inner and low[1] >= y0 + inner
+                      and high[0] <= x0 + side - inner and high[1] <= y0 + side - inner)
+            if inside and needed >= side / 2:
+                return
+
+        side = int(needed)
+        center = (low + high) / 2
+        # Shift the box to cover as much of the frame as it can
+        x0 = min(max(int(center[0] - side / 2), min(0, width - side)), max(0, width - side))
+        y0 = min(max(int(center[1] - side / 2), min(0, height - side)), max(0, height - side))
+        self.box = (x0, y0, side)
+        self._stats['box_moves'] += 1
+
+    def stats(self):
+        """
+        Return crop and full frame counts, lost tracks, box moves and the mean crop area.
+        """
+        stats = dict(self._stats)
+        stats['crop_area_mean'] = stats.pop('crop_area') / stats['crops'] if stats['crops'] else 0.0
+        return stats
@@ -0,0 +1,167 @@
+# sampling.py
+
+import cv2
+import numpy as np
+
+# Sampling modes: every skip_rate-th frame, or decided per frame by AdaptiveSampler
+SAMPLING_FIXED = 'fixed'
+SAMPLING_ADAPTIVE = 'adaptive'
+
+# Landmarks below this visibility are ignored when measuring landmark motion
+VISIBILITY_THRESHOLD = 0.5
+
+
+def sampling_settings(config):
+    """
+    Read the frame sampling settings from the configuration.
+
+    Returns:
+        dict: sampling mode, and for adaptive sampling its budget and thresholds.
+    """
+    mode = config.get('sampling', SAMPLING_FIXED)
+    if mode not in (SAMPLING_FIXED, SAMPLING_ADAPTIVE):
+        raise ValueError(f"Unknown sampling mode: {mode}")
+    settings = {
+        'sampling': mode,
+        'interpolate_max_gap': config.getint('interpolate_max_gap', fallback=30),
+    }
+    if mode == SAMPLING_ADAPTIVE:
+        settings.update({
+            'sampling_target_fps': config.getfloat('sampling_target_fps', fallback=10.0),
+            'sampling_motion_threshold': config.getfloat('sampling_motion_threshold', fallback=4.0),
+            'sampling_landmark_threshold': config.getfloat('sampling_landmark_threshold', fallback=0.02),
+            'sampling_max_gap': config.getint('sampling_max_gap', fallback=15),
+        })
+    return settings
+
+
+def interpolate_landmarks(start_frame, start_landmarks, end_frame, end_landmarks, frames):
+    """
+    Linearly interpolate landmarks between two detected frames.
+
+    Args:
+        start_frame (int): Frame number of the earlier detection.
+        start_landmarks (numpy.ndarray): Its landmarks, shape (33, 4).
+        end_frame (int): Frame number of the later detection.
+        end_landmarks (numpy.ndarray): Its landmarks, shape (33, 4).
+        frames (array-like): Frame numbers in between to interpolate.
+
+    Returns:
+        numpy.ndarray: Landmarks of shape (len(frames), 33, 4), float32.
+    """
+    weights = (np.asarray(frames, dtype=np.float32) - start_frame) / (end_frame - start_frame)
+    weights = weights[:, None, None]
+    return ((1 - weights) * start_landmarks + weights * end_landmarks).astype(np.float32)
+
+
+class AdaptiveSampler:
+    """
+    Decides per frame whether to run pose inference, from motion in the image
+    and of the landmarks, within a compute budget.
+
+    A frame is inferred when the mean absolute difference of a small grayscale
+    thumbnail against the last inferred frame reaches motion_threshold, or when
+    the landmarks, moving at the speed seen between the last two detections,
+    are predicted to have moved landmark_threshold (normalized units). Static
+    stretches are thus sampled sparsely and scrambles densely. Inference is
+    limited to target_fps on average by a token bucket that allows short
+    bursts; a frame is always inferred after max_gap frames without one.
+    """
+
+    def __init__(self, fps, target_fps=10.0, motion_threshold=4.0, landmark_threshold=0.02, max_gap=15,
+                 thumbnail_width=64):
+        """
+        Args:
+            fps (float): Frame rate of the video.
+            target_fps (float): Average number of inferred frames per second of video.
+            motion_threshold (float): Mean absolute gray level difference (0-255)
+                that triggers inference.
+            landmark_threshold (float): Predicted mean landmark displacement that
+                triggers inference.
+            max_gap (int): Maximum number of frames between two inferred frames.
+            thumbnail_width (int): Width of the thumbnails compared for motion.
+        """
+        self.rate = min(1.0, target_fps / fps) if fps and fps > 0 else 1.0
+        # Up to half a second of budget can be spent in a burst
+        self.capacity = max(1.0, target_fps / 2)
+        self.tokens = self.capacity
+        self.motion_threshold = motion_threshold
+        self.landmark_threshold = landmark_threshold
+        self.max_gap = max(1, max_gap)
+        self.thumbnail_width = thumbnail_width
+        self._reference = None
+        self._last_frame = None
+        self._last_landmarks = None
+        self._last_landmarks_frame = None
+        self._speed = 0.0
+        self._stats = {'inferred': 0, 'skipped': 0, 'forced': 0, 'motion': 0, 'landmarks': 0, 'over_budget': 0}
+
+    def should_infer(self, frame_number, image):
+        """
+        Decide whether to run inference on a frame.
+
+        Args:
+            frame_number (int): Frame number of the frame.
+            image (numpy.ndarray): The BGR frame.
+
+        Returns:
+            bool: True if the frame should be inferred.
+        """
+        self.tokens = min(self.capacity, self.tokens + self.rate)
+        thumbnail = self._thumbnail(image)
+
+        if self._reference is None or frame_number - self._last_frame >= self.max_gap:
+            reason = 'forced'
+        elif self.tokens < 1.0:
+            reason = None
+            self._stats['over_budget'] += 1
+        elif cv2.absdiff(thumbnail, self._reference).mean() >= self.motion_threshold:
+            reason = 'motion'
+        elif self._speed * (frame_number - self._last_frame) >= self.landmark_threshold:
+            reason = 'landmarks'
+        else:
+            reason = None
+
+        if reason is None:
+            self._stats['skipped'] += 1
+            return False
+        self._stats['inferred'] += 1
+        self._stats[reason] += 1
+        # The forced frames may overdraw the budget; it is paid back by skipping
+        self.tokens -= 1.0
+        self._reference = thumbnail
+        self._last_frame = frame_number
+        return True
+
+    def update(self, frame_number, landmarks):
+        """
+        Record the result of an inferred frame.
+
+        Args:
+            frame_number (int): Frame number of the inferred frame.
+            landmarks (numpy.ndarray): Detected landmarks of shape (33, 4), or
+                None if no pose was found.
+        """
+        if landmarks is None:
+            # Lost the athlete: look again as soon as the budget allows
+            self._speed = self.landmark_threshold
+            self._last_landmarks = None
+            return
+        if self._last_landmarks is not None:
+            visible = (landmarks[:, 3] >= VISIBILITY_THRESHOLD) & (self._last_landmarks[:, 3] >= VISIBILITY_THRESHOLD)
+            if visible.any():
+                displacement = np.linalg.norm(landmarks[visible, :2] - self._last_landmarks[visible, :2], axis=1).mean()
+                self._speed = float(displacement) / max(1, frame_number - self._last_landmarks_frame)
+        self._last_landmarks = landmarks
+        self._last_landmarks_frame = frame_number
+
+    def stats(self):
+        """
+        Return the number of inferred and skipped frames, and why frames were inferred.
+        """
+        return dict(self._stats)
+
+    def _thumbnail(self, image):
+        height, width = image.shape[:2]
+        size = (self.thumbnail_width, max(1, height * self.thumbnail_width // width))
+        return cv2.cvtColor(cv2.resize(image, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
@@ -0,0 +1,364 @@
+# segments.py
+
+import os
+import uuid
+import logging
+
+import cv2
+
+from database import Database
+from pose_detection import process_video, processing_params, processing_mode, restore_cached_result, decode_scale, MODE_FULL
+from result_cache import get_result_cache, file_key, url_key, range_key, result_key
+from video_io import open_capture, video_settings
+
+# Directory of uploaded files, as in app.py
+UPLOADS_DIR = 'uploads'
+
+
+def local_source(source, video_dirs):
+    """
+    Find the local file a source refers to.
+
+    Args:
+        source (str): A path, a file:// URL or a file name.
+        video_dirs (list of str): Directories local sources may come from.
+
+    Returns:
+        str: Path of the file inside one of video_dirs, or None if the source is
+        an http(s) URL or not such a file.
+    """
+    if source.startswith(('http://', 'https://')):
+        return None
+    path = source[len('file://'):] if source.startswith('file://') else source
+    roots = [os.path.realpath(directory) for directory in video_dirs]
+    candidates = [path] + [os.path.join(directory, os.path.basename(path)) for directory in video_dirs]
+    for candidate in candidates:
+        real = os.path.realpath(candidate)
+        # Only files that were uploaded or put there, never arbitrary paths
+        if os.path.isfile(real) and any(os.path.dirname(real) == root for root in roots):
+            return real
+    return None
+
+
+class SharedCapture:
+    """
+    One decoder over a source, read by several segments in turn.
+
+    Each segment gets a view() that process_frames reads like a capture of its
+    own. Moving to the start of the next segment grabs the frames in between when
+    they are at most max_skip_frames ahead, and seeks otherwise: the decoder
+    jumps to the keyframe before the wanted frame and decodes from there. So
+    segments in start order are decoded in one forward pass that skips the gaps,
+    instead of one pass from frame 0 per segment. Releasing a view leaves the
+    decoder open; release() closes it.
+    """
+
+    def __init__(self, capture, max_skip_frames=150):
+        """
+        Args:
+            capture: Open capture of the source, from video_io.open_capture().
+            max_skip_frames (int): Largest gap read through rather than seeked over.
+        """
+        self.capture = capture
+        self.max_skip_frames = max_skip_frames
+        self.position = 0
+        self._stats = {'seeks': 0, 'skipped_frames': 0, 'frames_read': 0}
+
+    def view(self):
+        """
+        Return a capture for the next segment.
+        """
+        return _SegmentView(self)
+
+    def seek(self, frame_index):
+        """
+        Move to a frame (0-based), reading forward or seeking.
+        """
+        if frame_index == self.position:
+            return
+        if self.position < frame_index <= self.position + self.max_skip_frames:
+            while self.position < frame_index and self.grab():
+                self._stats['skipped_frames'] += 1
+            return
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        self.position = frame_index
+        self._stats['seeks'] += 1
+
+    def grab(self):
+        if not self.capture.grab():
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        ret, frame = self.capture.read()
+        if ret:
+            self.position += 1
+            self._stats['frames_read'] += 1
+        return ret, frame
+
+    def release(self):
+        self.capture.release()
+
+    def stats(self):
+        """
+        Return the number of seeks, frames read through between segments, and frames read.
+        """
+        return dict(self._stats)
+
+
+class _SegmentView:
+    """
+    The part of cv2.VideoCapture that process_frames uses, on a SharedCapture.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+
+    def isOpened(self):
+        return self.shared.capture.isOpened()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.shared.position
+        return self.shared.capture.get(prop)
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.shared.seek(int(value))
+        return True
+
+    def grab(self):
+        return self.shared.grab()
+
+    def read(self):
+        return self.shared.read()
+
+    def release(self):
+        # The next segment carries on from here
+        pass
+
+
+def process_segments(source, segments, db_config, config, progress_callback=None, downloader=None,
+                     segment_progress=None):
+    """
+    Process several time ranges of one source in a single pass over it.
+
+    A local source (a file in uploads or local_video_dir) is read in place. Any
+    other source is downloaded once, from the start of the first range to the
+    end of the last. The ranges are then processed in start order from one
+    SharedCapture, each into a video row of its own whose landmarks keep the
+    frame numbers of the file that was read. Ranges found in the result cache
+    are restored instead.
+
+    Args:
+        source (str): Path, file:// URL or name of a local file, or URL to download.
+        segments (list of tuple): (start_time, end_time, position_name) per range,
+            times in seconds.
+        db_config (dict): Database configuration parameters.
+        config (dict): Additional configuration parameters.
+        progress_callback (callable): Optional, called as progress_callback(frames_done, total_frames)
+            over all ranges.
+        downloader: Object with a download(video_url, start_time, end_time, path)
+            method, for sources that are not local files.
+        segment_progress (callable): Optional, called as segment_progress(index, frames_done, total_frames)
+            for the range at index in segments.
+
+    Returns:
+        list of tuple: (output_path, video_id) per range, in the order given;
+        output_path is None in landmarks_only mode.
+    """
+    render = processing_mode(config) == MODE_FULL
+    outputs_dir = 'outputs'
+    os.makedirs(outputs_dir, exist_ok=True)
+
+    path = local_source(source, [UPLOADS_DIR, config.get('local_video_dir', UPLOADS_DIR)])
+    span_start = min(start for start, _, _ in segments)
+    span_end = max(end for _, end, _ in segments)
+    if path is not None:
+        input_key = file_key(path)
+    else:
+        if downloader is None:
+            raise FileNotFoundError(f"No local video for {source} and no downloader")
+        input_key = url_key(source, span_start, span_end, downloader.video_format)
+
+    # Restore what was processed before, with the same settings
+    cache = get_result_cache(config)
+    params = processing_params(config)
+    results = [None] * len(segments)
+    pending = []
+    for index, (start_time, end_time, position_name) in enumerate(segments):
+        output_path = os.path.join(outputs_dir, f"processed_segment_{uuid.uuid4().hex}.mp4")
+        key = range_key(input_key, start_time, end_time)
+        entry = cache.get(result_key(key, params)) if cache is not None else None
+        if entry is not None:
+            video_id = restore_cached_result(cache, entry, output_path, db_config, config, position_name)
+            results[index] = ((output_path if render else None), video_id)
+            if segment_progress:
+                segment_progress(index, 1, 1)
+            continue
+        pending.append((index, start_time, end_time, position_name, output_path, key))
+    if not pending:
+        if progress_callback:
+            progress_callback(1, 1)
+        return results
+
+    downloaded = None
+    offset = 0.0
+    if path is None:
+        downloads_dir = 'downloads'
+        os.makedirs(downloads_dir, exist_ok=True)
+        downloaded = path = os.path.join(downloads_dir, f"temp_video_{uuid.uuid4().hex}.mp4")
+        downloader.download(source, span_start, span_end, path)
+        # Verify that the video was downloaded
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            logging.error(f"Failed to download video segment from {source}")
+            raise FileNotFoundError(f"Downloaded video file is missing or empty: {path}")
+        offset = span_start
+
+    capture = open_capture(path, video_settings(config), scale=decode_scale(config))
+    if not capture.isOpened():
+        logging.error(f"Error opening video file {path}")
+        raise FileNotFoundError(f"Cannot open video file: {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    shared = SharedCapture(capture, int(config.getfloat('segment_max_skip_seconds', fallback=5.0) * fps))
+
+    def frame_range(start_time, end_time):
+        return max(0, int(round((start_time - offset) * fps))), max(0, int(round((end_time - offset) * fps)))
+
+    total_frames = sum(max(0, end - start) for start, end in (frame_range(s, e) for _, s, e, _, _, _ in pending))
+    frames_before = 0
+    try:
+        for index, start_time, end_time, position_name, output_path, key in sorted(pending, key=lambda item: item[1]):
+            start_frame, end_frame = frame_range(start_time, end_time)
+            def on_progress(frames_done, _total, index=index, before=frames_before, length=end_frame - start_frame):
+                if segment_progress:
+                    segment_progress(index, frames_done, length)
+                if progress_callback:
+                    progress_callback(before + frames_done, total_frames)
+            video_id = process_video(
+                video_path=path,
+                output_path=output_path,
+                db_config=db_config,
+                config=config,
+                position_name=position_name,
+                progress_callback=on_progress,
+                cache_key=key,
+                capture=shared.view(),
+                start_frame=start_frame,
+                end_frame=end_frame
+            )
+            results[index] = ((output_path if render else None), video_id)
+            frames_before += end_frame - start_frame
+    finally:
+        shared.release()
+        # Without a rendered output the download is kept, since the annotated
+        # videos are rendered from it on demand
+        if downloaded is not None and render and os.path.exists(downloaded):
+            os.remove(downloaded)
+
+    logging.info(f"Processed {len(pending)} segments of '{source}' in one pass: {shared.stats()}")
+    return results
+
+
+def merge_ranges(ranges):
+    """
+    Merge overlapping and touching (start, end) ranges.
+
+    Returns:
+        list of tuple: (start, end, members) in start order, members being the
+        indexes in ranges of the ranges merged into it.
+    """
+    merged = []
+    for index in sorted(range(len(ranges)), key=lambda index: ranges[index]):
+        start, end = ranges[index]
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end), merged[-1][2] + [index])
+        else:
+            merged.append((start, end, [index]))
+    return merged
+
+
+def process_labelled_ranges(source, ranges, db_config, config, batch_id=None, progress_callback=None, downloader=None):
+    """
+    Process labelled time ranges of one source, each frame once.
+
+    Overlapping ranges are merged into spans, and the spans are processed with
+    process_segments(), so the union of the ranges is fetched and decoded once
+    and every frame goes through the model once. Each range becomes a row of the
+    segment_labels table pointing at the frames of its span's video, so
+    overlapping ranges share landmark rows instead of storing them twice.
+
+    Args:
+        source (str): Local file or URL, as for process_segments().
+        ranges (list of tuple): (position_name, start_time, end_time) per range,
+            times in seconds; ranges may overlap.
+        db_config (dict): Database configuration parameters.
+        config (dict): Additional configuration parameters.
+        batch_id (str): Identifier the labels are stored under, e.g. the job id.
+        progress_callback (callable): Optional, called as progress_callback(frames_done, total_frames, ranges)
+            with ranges a list with the percentage done of each range, in the order given.
+        downloader: As for process_segments().
+
+    Returns:
+        list of dict: Per range in the order given, the label id, position_name,
+        start_time, end_time, video_id and start_frame/end_frame of the range in
+        the video's source, and the annotated video of its span (None in
+        landmarks_only mode).
+    """
+    spans = merge_ranges([(start_time, end_time) for _, start_time, end_time in ranges])
+    segments = []
+    for start_time, end_time, members in spans:
+        names = {ranges[index][0] for index in members}
+        # A span covered by one position is labelled with it; mixed spans only through segment_labels
+        segments.append((start_time, end_time, names.pop() if len(names) == 1 else None))
+
+    percent_done = [0.0] * len(ranges)
+
+    def on_segment(span_index, frames_done, total_frames):
+        span_start, span_end, members = spans[span_index]
+        reached = span_start + (span_end - span_start) * frames_done / max(1, total_frames)
+        for index in members:
+            _, start_time, end_time = ranges[index]
+            share = (reached - start_time) / (end_time - start_time) if end_time > start_time else 1.0
+            percent_done[index] = round(100.0 * min(1.0, max(0.0, share)), 1)
+
+    def on_progress(frames_done, total_frames):
+        progress_callback(frames_done, total_frames, [
+            {'position_name': name, 'start_time': start_time, 'end_time': end_time, 'percent': percent}
+            for (name, start_time, end_time), percent in zip(ranges, percent_done)
+        ])
+
+    results = process_segments(source, segments, db_config, config, progress_callback=on_progress if progress_callback else None,
+                               downloader=downloader, segment_progress=on_segment)
+
+    db = Database(db_config)
+    try:
+        labels = []
+        for (span_start, _, members), (output_path, video_id) in zip(spans, results):
+            video = db.get_video(video_id)
+            first = video['start_frame'] or 0
+            last = video['end_frame'] if video['end_frame'] is not None else video['total_frames']
+            for index in members:
+                position_name, start_time, end_time = ranges[index]
+                start_frame = first + int(round((start_time - span_start) * video['fps']))
+                end_frame = first + int(round((end_time - span_start) * video['fps']))
+                labels.append((index, output_path, {
+                    'batch_id': batch_id,
+                    'video_id': video_id,
+                    'position_name': position_name,
+                    'start_time': float(start_time),
+                    'end_time': float(end_time),
+                    'start_frame': start_frame,
+                    'end_frame': min(end_frame, last) if last is not None else end_frame,
+                }))
+        label_ids = db.create_segment_labels([label for _, _, label in labels])
+    finally:
+        db.close()
+
+    described = [None] * len(ranges)
+    for label_id, (index, output_path, label) in zip(label_ids, labels):
+        described[index] = dict(label, id=label_id, output_video=output_path)
+    logging.info(f"Processed {len(ranges)} labelled ranges of '{source}' as {len(spans)} spans.")
+    return described
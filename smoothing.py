@@ -0,0 +1,138 @@
+# smoothing.py
+
+import math
+
+import numpy as np
+
+# Smoothing modes: landmarks as detected, or filtered with a One Euro filter per track
+SMOOTHING_NONE = 'none'
+SMOOTHING_ONE_EURO = 'one_euro'
+
+
+def smoothing_settings(config):
+    """
+    Read the landmark smoothing settings from the configuration.
+
+    Returns:
+        dict: smoothing mode, and when enabled the One Euro filter parameters
+        and whether frames without a detection are filled.
+    """
+    mode = config.get('smoothing', SMOOTHING_ONE_EURO)
+    if mode not in (SMOOTHING_NONE, SMOOTHING_ONE_EURO):
+        raise ValueError(f"Unknown smoothing mode: {mode}")
+    if mode == SMOOTHING_NONE:
+        return {'smoothing': mode}
+    return {
+        'smoothing': mode,
+        'smoothing_min_cutoff': config.getfloat('smoothing_min_cutoff', fallback=0.5),
+        'smoothing_beta': config.getfloat('smoothing_beta', fallback=20.0),
+        'smoothing_d_cutoff': config.getfloat('smoothing_d_cutoff', fallback=1.0),
+        'smoothing_fill_gaps': config.getboolean('smoothing_fill_gaps', fallback=True),
+    }
+
+
+def _alpha(cutoff, seconds):
+    """
+    Smoothing factor of an exponential filter with the given cutoff frequency.
+    """
+    return 1.0 / (1.0 + 1.0 / (2 * math.pi * cutoff * seconds))
+
+
+def fill_gap(start_frame, start_landmarks, end_frame, end_landmarks, frames):
+    """
+    Interpolate landmarks between two detections, weighting each end by its visibility.
+
+    A landmark that was barely visible at one end follows the other end, so
+    an occluded joint does not drag the filled frames towards where the model
+    guessed it. Visibility itself is interpolated linearly.
+
+    Args:
+        start_frame (int): Frame number of the earlier detection.
+        start_landmarks (numpy.ndarray): Its landmarks, shape (33, 4).
+        end_frame (int): Frame number of the later detection.
+        end_landmarks (numpy.ndarray): Its landmarks, shape (33, 4).
+        frames (array-like): Frame numbers in between to fill.
+
+    Returns:
+        numpy.ndarray: Landmarks of shape (len(frames), 33, 4), float32.
+    """
+    steps = ((np.asarray(frames, dtype=np.float32) - start_frame) / (end_frame - start_frame))[:, None]
+    start_weight = (1 - steps) * start_landmarks[:, 3]
+    end_weight = steps * end_landmarks[:, 3]
+    total = start_weight + end_weight
+    weights = np.where(total > 1e-6, end_weight / np.maximum(total, 1e-6), steps)
+
+    filled = np.empty((len(steps),) + start_landmarks.shape, dtype=np.float32)
+    filled[..., :3] = start_landmarks[:, :3] + weights[..., None] * (end_landmarks[:, :3] - start_landmarks[:, :3])
+    filled[..., 3] = (1 - steps) * start_landmarks[:, 3] + steps * end_landmarks[:, 3]
+    return filled
+
+
+class LandmarkSmoother:
+    """
+    One Euro filter over the landmarks of every track, vectorized across all 33 landmarks.
+
+    The cutoff frequency rises with the speed of each landmark: slow landmarks
+    are smoothed strongly, which removes jitter, fast ones hardly at all, which
+    avoids lag. The state per track is the last frame number, filtered
+    positions and filtered velocities, so the cost per frame is constant.
+    Time steps come from the frame numbers, so skipped frames are allowed for.
+    Visibility is passed through unfiltered.
+    """
+
+    def __init__(self, fps, min_cutoff=0.5, beta=20.0, d_cutoff=1.0, reset_frames=30):
+        """
+        Args:
+            fps (float): Frame rate of the video.
+            min_cutoff (float): Cutoff frequency in Hz of a landmark at rest.
+            beta (float): Increase of the cutoff per unit of speed (frame sizes per second).
+            d_cutoff (float): Cutoff frequency in Hz of the velocity estimate.
+            reset_frames (int): Start a track afresh after this many frames without it.
+        """
+        self.fps = fps or 30.0
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset_frames = reset_frames
+        # athlete_id: (frame number, positions (33, 3), velocities (33, 3))
+        self._tracks = {}
+
+    @classmethod
+    def from_settings(cls, fps, settings, reset_frames=30):
+        """
+        Create a smoother from smoothing_settings(), or return None when smoothing is off.
+        """
+        if settings['smoothing'] == SMOOTHING_NONE:
+            return None
+        return cls(fps, settings['smoothing_min_cutoff'], settings['smoothing_beta'], settings['smoothing_d_cutoff'],
+                   reset_frames)
+
+    def filter(self, frame_number, landmarks, athlete_id=0):
+        """
+        Filter the landmarks of one track at one frame; frames must come in order.
+
+        Args:
+            frame_number (int): Frame number of the landmarks.
+            landmarks (numpy.ndarray): Detected landmarks, shape (33, 4).
+            athlete_id (int): Track the landmarks belong to.
+
+        Returns:
+            numpy.ndarray: Filtered landmarks, a new float32 array of shape (33, 4).
+        """
+        smoothed = np.array(landmarks, dtype=np.float32)
+        positions = smoothed[:, :3]
+        track = self._tracks.get(athlete_id)
+        if track is None or not 0 < frame_number - track[0] <= self.reset_frames:
+            self._tracks[athlete_id] = (frame_number, positions.copy(), np.zeros_like(positions))
+            return smoothed
+
+        previous_frame, previous, previous_velocity = track
+        seconds = (frame_number - previous_frame) / self.fps
+        velocity = previous_velocity + _alpha(self.d_cutoff, seconds) * ((positions - previous) / seconds - previous_velocity)
+        # One cutoff per landmark, from its speed in the image plane
+        cutoff = self.min_cutoff + self.beta * np.sqrt(velocity[:, 0] ** 2 + velocity[:, 1] ** 2)
+        alpha = _alpha(cutoff, seconds)
+        positions += (1 - alpha)[:, None] * (previous - positions)
+
+        self._tracks[athlete_id] = (frame_number, positions.copy(), velocity)
+        return smoothed
@@ -0,0 +1,269 @@
+# streaming.py
+
+import shutil
+import struct
+import subprocess
+import threading
+import logging
+
+import cv2
+import numpy as np
+
+# Bytes of the upload inspected to decide whether it can be decoded as it arrives
+HEAD_BYTES = 64 * 1024
+
+# Top-level MP4 boxes that carry the sample tables
+_MP4_INDEX_BOXES = (b'moov', b'moof')
+
+
+class StreamError(Exception):
+    """Raised when a streamed upload cannot be decoded."""
+
+
+def mp4_streamable(head):
+    """
+    Check whether an upload can be decoded before it has fully arrived.
+
+    MP4/MOV files need their index (the moov box) to decode anything. When it
+    comes after the media data, as written by most cameras, decoding has to
+    wait for the end of the file. Fragmented and "faststart" files, and
+    containers other than MP4 (MKV, MPEG-TS, ...), can be decoded as they arrive.
+
+    Args:
+        head (bytes): The first bytes of the upload.
+
+    Returns:
+        bool: False if the upload is an MP4 whose media data comes before its index.
+    """
+    if head[4:8] != b'ftyp':
+        return True
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box = struct.unpack('>I4s', head[offset:offset + 8])
+        if box in _MP4_INDEX_BOXES:
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            # 64-bit box size follows the type
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if size < 8:
+            break
+        offset += size
+    # Index not found in the inspected bytes; let the decoder try
+    return True
+
+
+class UploadStream:
+    """
+    Reads a request body in chunks, optionally keeping a copy on disk.
+    """
+
+    def __init__(self, stream, raw_path=None, chunk_size=1 << 20):
+        """
+        Args:
+            stream: File-like request body, e.g. flask.request.stream.
+            raw_path (str): Where to keep the raw upload, or None to keep nothing.
+            chunk_size (int): Bytes read from the body at a time.
+        """
+        self.stream = stream
+        self.raw_path = raw_path
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self._head = b''
+        self._raw = open(raw_path, 'wb') if raw_path else None
+
+    def head(self, size=HEAD_BYTES):
+        """
+        Read the first bytes of the body without consuming them.
+        """
+        while len(self._head) < size:
+            chunk = self.stream.read(size - len(self._head))
+            if not chunk:
+                break
+            self._head += chunk
+        return self._head
+
+    def chunks(self):
+        """
+        Yield the body chunk by chunk, writing each to the raw copy first.
+        """
+        try:
+            if self._head:
+                head, self._head = self._head, b''
+                yield self._keep(head)
+            while True:
+                chunk = self.stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield self._keep(chunk)
+        finally:
+            self.close()
+
+    def save(self, path):
+        """
+        Write the whole body to a file, e.g. when it cannot be decoded as it arrives.
+        """
+        if self.raw_path == path:
+            for _ in self.chunks():
+                pass
+            return
+        with open(path, 'wb') as f:
+            for chunk in self.chunks():
+                f.write(chunk)
+
+    def close(self):
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+
+    def _keep(self, chunk):
+        self.bytes_read += len(chunk)
+        if self._raw is not None:
+            self._raw.write(chunk)
+        return chunk
+
+
+class StreamCapture:
+    """
+    Decodes a video from a byte stream with an ffmpeg subprocess.
+
+    Bytes are written to ffmpeg's stdin by feed(), usually on the request thread,
+    and decoded frames are read from its stdout in the yuv4mpegpipe format by
+    read(). Both sides go through OS pipes, so when the consumer of the frames
+    falls behind, ffmpeg stops reading and feed() blocks: the upload is received
+    no faster than it is processed, and nothing but the pipe buffers is held in
+    memory. The read side mirrors the part of cv2.VideoCapture that
+    process_frames uses.
+    """
+
+    def __init__(self, ffmpeg='ffmpeg'):
+        """
+        Args:
+            ffmpeg (str): Name or path of the ffmpeg executable.
+
+        Raises:
+            StreamError: If ffmpeg is not installed.
+        """
+        if shutil.which(ffmpeg) is None:
+            raise StreamError("ffmpeg is required for streaming uploads")
+        self._process = subprocess.Popen(
+            [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+             # yuv420p needs even dimensions
+             '-vf', 'crop=trunc(iw/2)*2:trunc(ih/2)*2',
+             '-an', '-f', 'yuv4mpegpipe', '-pix_fmt', 'yuv420p', 'pipe:1'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self._stderr = b''
+        self._stderr_thread = threading.Thread(target=self._read_stderr, name='ffmpeg-stderr', daemon=True)
+        self._stderr_thread.start()
+        self._header_lock = threading.Lock()
+        self._header = None
+        self._frame_size = 0
+        self._opened = True
+        self.frames_read = 0
+
+    def feed(self, chunks):
+        """
+        Write the encoded video to ffmpeg and close its input at the end.
+
+        Args:
+            chunks (iterable): Byte chunks of the video, e.g. UploadStream.chunks().
+
+        Returns:
+            bool: True if every chunk was written, False if the decoder stopped
+            early (released, or failed on the input).
+        """
+        try:
+            for chunk in chunks:
+                self._process.stdin.write(chunk)
+            self._process.stdin.close()
+            return True
+        except (BrokenPipeError, ValueError, OSError):
+            logging.warning("Video decoder stopped before the upload was complete.")
+            return False
+
+    def isOpened(self):
+        return self._opened and self._read_header() is not None
+
+    def get(self, prop):
+        header = self._read_header()
+        if header is None:
+            return 0
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return header['width']
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return header['height']
+        if prop == cv2.CAP_PROP_FPS:
+            return header['fps']
+        # The frame count is not known until the stream ends
+        return 0
+
+    def set(self, prop, value):
+        # Streams cannot seek
+        return False
+
+    def grab(self):
+        return self._read_frame() is not None
+
+    def read(self):
+        data = self._read_frame()
+        if data is None:
+            return False, None
+        header = self._header
+        yuv = np.frombuffer(data, dtype=np.uint8).reshape(header['height'] * 3 // 2, header['width'])
+        return True, cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420)
+
+    def release(self):
+        """
+        Stop the decoder. A pending feed() returns False.
+        """
+        if not self._opened:
+            return
+        self._opened = False
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process.stdout.close()
+        self._stderr_thread.join()
+        if self._process.returncode not in (0, -9) and self._stderr:
+            logging.error(f"ffmpeg failed on the upload stream: {self._stderr.decode(errors='replace').strip()}")
+
+    def _read_header(self):
+        with self._header_lock:
+            if self._header is None and self._opened:
+                line = self._process.stdout.readline()
+                if not line.startswith(b'YUV4MPEG2'):
+                    return None
+                header = {'width': 0, 'height': 0, 'fps': 0.0}
+                for token in line.split()[1:]:
+                    tag, value = token[:1], token[1:].decode()
+                    if tag == b'W':
+                        header['width'] = int(value)
+                    elif tag == b'H':
+                        header['height'] = int(value)
+                    elif tag == b'F':
+                        numerator, denominator = value.split(':')
+                        header['fps'] = int(numerator) / int(denominator) if int(denominator) else 0.0
+                self._frame_size = header['width'] * header['height'] * 3 // 2
+                self._header = header
+            return self._header
+
+    def _read_frame(self):
+        if not self._opened or self._read_header() is None:
+            return None
+        # Every frame starts with a "FRAME" line, optionally with parameters
+        line = self._process.stdout.readline()
+        if not line.startswith(b'FRAME'):
+            return None
+        data = self._process.stdout.read(self._frame_size)
+        if len(data) < self._frame_size:
+            return None
+        self.frames_read += 1
+        return data
+
+    def _read_stderr(self):
+        # Drained on its own thread so a chatty ffmpeg never blocks on a full pipe
+        self._stderr = self._process.stderr.read()
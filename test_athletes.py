@@ -0,0 +1,56 @@
+# test_athletes.py
+#
+# The search for new athletes must end even when the detector keeps finding
+# an athlete who is already tracked. Uses stand-ins for the Pose graphs, so it
+# runs without MediaPipe: python test_athletes.py (or pytest).
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from athletes import AthleteTracker
+
+
+def _pose_landmarks(x0, y0, x1, y1):
+    points = np.linspace((x0, y0), (x1, y1), 33)
+    return SimpleNamespace(landmark=[SimpleNamespace(x=float(x), y=float(y), z=0.0, visibility=1.0)
+                                     for x, y in points])
+
+
+class ConstantDetector:
+    """
+    Returns the same pose for every image, however much of it is painted out.
+    """
+
+    def __init__(self, pose_landmarks):
+        self.pose_landmarks = pose_landmarks
+        self.calls = 0
+
+    def process(self, image):
+        self.calls += 1
+        return SimpleNamespace(pose_landmarks=self.pose_landmarks)
+
+
+class NoPose:
+    def process(self, image):
+        return SimpleNamespace(pose_landmarks=None)
+
+    def reset(self):
+        pass
+
+
+def test_search_ends_with_constant_detector():
+    detector = ConstantDetector(_pose_landmarks(0.3, 0.2, 0.6, 0.9))
+    tracker = AthleteTracker([NoPose(), NoPose()], detector, connections=[(0, 1)])
+    frame = np.full((240, 320, 3), 128, dtype=np.uint8)
+    try:
+        athletes = tracker.process(1, frame, frame)
+    finally:
+        tracker.close()
+    assert len(athletes) == 1, athletes
+    assert detector.calls <= 2, detector.calls
+
+
+if __name__ == '__main__':
+    test_search_ends_with_constant_detector()
+    print("Search ends with a constant detector.")
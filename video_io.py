@@ -0,0 +1,388 @@
+# video_io.py
+
+import os
+import shutil
+import subprocess
+import threading
+import logging
+
+import cv2
+import numpy as np
+
+# Video I/O backends: OpenCV, ffmpeg subprocesses over pipes, or ffmpeg when installed
+BACKEND_OPENCV = 'opencv'
+BACKEND_FFMPEG = 'ffmpeg'
+BACKEND_AUTO = 'auto'
+
+
+def ffmpeg_available(ffmpeg='ffmpeg'):
+    """
+    Check whether the ffmpeg executable is installed.
+    """
+    return shutil.which(ffmpeg) is not None
+
+
+def video_settings(config):
+    """
+    Read the video I/O settings from the configuration.
+
+    Returns:
+        dict: video_backend (auto resolved to ffmpeg or opencv), and for ffmpeg
+        the encoder, its preset and quality, decoder threads and whether to keep
+        the audio.
+    """
+    backend = config.get('video_backend', BACKEND_AUTO)
+    if backend not in (BACKEND_OPENCV, BACKEND_FFMPEG, BACKEND_AUTO):
+        raise ValueError(f"Unknown video_backend: {backend}")
+    if backend == BACKEND_AUTO:
+        backend = BACKEND_FFMPEG if ffmpeg_available() else BACKEND_OPENCV
+    if backend == BACKEND_OPENCV:
+        return {'video_backend': backend}
+    return {
+        'video_backend': backend,
+        'video_codec': config.get('video_codec', 'libx264'),
+        'video_preset': config.get('video_preset', 'veryfast'),
+        'video_crf': config.getint('video_crf', fallback=23),
+        'video_decode_threads': config.getint('video_decode_threads', fallback=0),
+        'video_audio': config.getboolean('video_audio', fallback=True),
+    }
+
+
+def open_capture(video_path, settings, scale=None):
+    """
+    Open a video for reading with the configured backend.
+
+    Args:
+        video_path (str): Path to the video file.
+        settings (dict): From video_settings().
+        scale (float): Have the decoder return frames scaled by this factor, as
+            int(width * scale) x int(height * scale). Only the ffmpeg backend does;
+            OpenCV returns full size frames, so callers still check the size.
+
+    Returns:
+        cv2.VideoCapture or FfmpegCapture: The capture, which may not be opened.
+    """
+    if settings['video_backend'] == BACKEND_FFMPEG:
+        return FfmpegCapture(video_path, scale=scale, threads=settings['video_decode_threads'])
+    return cv2.VideoCapture(video_path)
+
+
+def open_writer(output_path, fps, size, settings, audio_source=None):
+    """
+    Open a video for writing with the configured backend.
+
+    Args:
+        output_path (str): Path of the video to write.
+        fps (float): Frame rate.
+        size (tuple): (width, height) of the frames.
+        settings (dict): From video_settings().
+        audio_source (str): Video whose audio is muxed into the output, if any
+            and if the backend and settings keep audio.
+
+    Returns:
+        cv2.VideoWriter or FfmpegWriter: The writer.
+    """
+    if settings['video_backend'] == BACKEND_FFMPEG:
+        return FfmpegWriter(
+            output_path, fps, size,
+            codec=settings['video_codec'],
+            preset=settings['video_preset'],
+            crf=settings['video_crf'],
+            audio_source=audio_source if settings['video_audio'] else None
+        )
+    return cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+
+def mux_audio(video_path, audio_source, ffmpeg='ffmpeg'):
+    """
+    Add the audio of another file to a video, in place, without re-encoding the video.
+
+    Args:
+        video_path (str): Video to add the audio to.
+        audio_source (str): File to take the first audio stream from. Nothing
+            happens if it has none.
+    """
+    temp_path = f"{video_path}.audio.mp4"
+    try:
+        subprocess.run(
+            [ffmpeg, '-y', '-hide_banner', '-loglevel', 'error', '-i', video_path, '-i', audio_source,
+             '-map', '0:v:0', '-map', '1:a:0?', '-c:v', 'copy', '-c:a', 'aac', '-shortest',
+             '-movflags', '+faststart', temp_path],
+            check=True, capture_output=True
+        )
+        shutil.move(temp_path, video_path)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Could not add the audio of '{audio_source}': {e.stderr.decode(errors='replace').strip()}")
+        raise e
+
+
+def concat_videos(segment_paths, output_path):
+    """
+    Join video segments into one file.
+
+    Uses the ffmpeg concat demuxer without re-encoding when ffmpeg is installed,
+    and falls back to re-encoding the frames with OpenCV otherwise.
+
+    Args:
+        segment_paths (list of str): Segment files in playback order.
+        output_path (str): Path of the joined video.
+    """
+    if shutil.which('ffmpeg'):
+        list_path = f"{output_path}.segments.txt"
+        with open(list_path, 'w') as f:
+            for path in segment_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        try:
+            subprocess.run(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                 '-i', list_path, '-c', 'copy', output_path],
+                check=True
+            )
+            return
+        except subprocess.CalledProcessError:
+            logging.exception("ffmpeg concat failed, falling back to OpenCV.")
+        finally:
+            os.remove(list_path)
+
+    out = None
+    for path in segment_paths:
+        cap = cv2.VideoCapture(path)
+        if out is None:
+            out = cv2.VideoWriter(
+                output_path,
+                cv2.VideoWriter_fourcc(*'mp4v'),
+                cap.get(cv2.CAP_PROP_FPS),
+                (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            )
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        cap.release()
+    if out is not None:
+        out.release()
+
+class _Stderr:
+    """
+    Drains the stderr of a subprocess on its own thread, so a chatty ffmpeg
+    never blocks on a full pipe.
+    """
+
+    def __init__(self, process, name):
+        self.data = b''
+        self._process = process
+        self._thread = threading.Thread(target=self._read, name=name, daemon=True)
+        self._thread.start()
+
+    def text(self):
+        self._thread.join()
+        return self.data.decode(errors='replace').strip()
+
+    def _read(self):
+        self.data = self._process.stderr.read()
+
+
+class FfmpegCapture:
+    """
+    Reads the frames of a video file from an ffmpeg subprocess.
+
+    ffmpeg decodes on its own threads (threads=0 lets it choose), scales inside
+    the decoder when asked to, and writes raw BGR frames to a pipe, so frames
+    arrive at the processing size without a full resolution copy in Python.
+    Seeking restarts ffmpeg at the wanted time, which decodes from the preceding
+    keyframe. Mirrors the part of cv2.VideoCapture that process_frames uses;
+    the properties come from OpenCV, so they match the OpenCV backend.
+    """
+
+    def __init__(self, video_path, scale=None, threads=0, ffmpeg='ffmpeg'):
+        """
+        Args:
+            video_path (str): Path to the video file.
+            scale (float): Scale factor applied by the decoder, or None for full size.
+            threads (int): Decoder threads, 0 for automatic.
+            ffmpeg (str): Name or path of the ffmpeg executable.
+        """
+        self.video_path = video_path
+        self.threads = threads
+        self.ffmpeg = ffmpeg
+        self._process = None
+        self._stderr = None
+        self._position = 0
+
+        probe = cv2.VideoCapture(video_path)
+        self._opened = probe.isOpened() and ffmpeg_available(ffmpeg)
+        self._properties = {
+            cv2.CAP_PROP_FRAME_WIDTH: probe.get(cv2.CAP_PROP_FRAME_WIDTH),
+            cv2.CAP_PROP_FRAME_HEIGHT: probe.get(cv2.CAP_PROP_FRAME_HEIGHT),
+            cv2.CAP_PROP_FPS: probe.get(cv2.CAP_PROP_FPS),
+            cv2.CAP_PROP_FRAME_COUNT: probe.get(cv2.CAP_PROP_FRAME_COUNT),
+        }
+        probe.release()
+
+        width = int(self._properties[cv2.CAP_PROP_FRAME_WIDTH])
+        height = int(self._properties[cv2.CAP_PROP_FRAME_HEIGHT])
+        if scale is not None and scale != 1.0:
+            self._size = (int(width * scale), int(height * scale))
+        else:
+            self._size = (width, height)
+        self._frame_bytes = self._size[0] * self._size[1] * 3
+        self._scratch = bytearray(self._frame_bytes)
+
+    def isOpened(self):
+        return self._opened
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self._position
+        return self._properties.get(prop, 0)
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self._stop()
+        self._position = int(value)
+        return True
+
+    def grab(self):
+        # Decoded all the same, but never turned into an array
+        return self._read_into(self._scratch)
+
+    def read(self):
+        buffer = bytearray(self._frame_bytes)
+        if not self._read_into(buffer):
+            return False, None
+        return True, np.frombuffer(buffer, dtype=np.uint8).reshape(self._size[1], self._size[0], 3)
+
+    def release(self):
+        self._stop()
+        self._opened = False
+
+    def _start(self):
+        command = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-threads', str(self.threads)]
+        fps = self._properties[cv2.CAP_PROP_FPS]
+        if self._position > 0 and fps > 0:
+            # Half a frame early, so rounding never skips the wanted frame
+            command += ['-ss', f"{max(0.0, (self._position - 0.5) / fps):.6f}"]
+        command += ['-i', self.video_path, '-an', '-sn', '-vsync', 'passthrough']
+        width = int(self._properties[cv2.CAP_PROP_FRAME_WIDTH])
+        height = int(self._properties[cv2.CAP_PROP_FRAME_HEIGHT])
+        if self._size != (width, height):
+            command += ['-vf', f"scale={self._size[0]}:{self._size[1]}:flags=area"]
+        command += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+        self._process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+        self._stderr = _Stderr(self._process, 'ffmpeg-decode-stderr')
+
+    def _read_into(self, buffer):
+        if not self._opened:
+            return False
+        if self._process is None:
+            self._start()
+        view = memoryview(buffer)
+        filled = 0
+        while filled < self._frame_bytes:
+            count = self._process.stdout.readinto(view[filled:])
+            if not count:
+                self._stop()
+                self._opened = False
+                return False
+            filled += count
+        self._position += 1
+        return True
+
+    def _stop(self):
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process.stdout.close()
+        errors = self._stderr.text()
+        if self._process.returncode not in (0, -9) and errors:
+            logging.error(f"ffmpeg failed to decode '{self.video_path}': {errors}")
+        self._process = None
+
+
+class FfmpegWriter:
+    """
+    Encodes frames with an ffmpeg subprocess fed raw BGR frames over a pipe.
+
+    Encodes with codec (H.264 by default) at a preset and constant quality
+    (crf), which gives much smaller files than OpenCV's mp4v at similar or
+    better speed, and can mux the audio of the source video back in. Odd frame
+    sizes are padded by one pixel, since yuv420p needs even ones. Mirrors the
+    part of cv2.VideoWriter that process_frames uses.
+    """
+
+    def __init__(self, output_path, fps, size, codec='libx264', preset='veryfast', crf=23, audio_source=None,
+                 ffmpeg='ffmpeg'):
+        """
+        Args:
+            output_path (str): Path of the video to write.
+            fps (float): Frame rate.
+            size (tuple): (width, height) of the frames.
+            codec (str): ffmpeg video encoder.
+            preset (str): Encoder preset, trading speed for size.
+            crf (int): Constant rate factor; lower is better quality and larger.
+            audio_source (str): File to take the first audio stream from, or None.
+            ffmpeg (str): Name or path of the ffmpeg executable.
+        """
+        self.output_path = output_path
+        self.size = size
+        command = [ffmpeg, '-y', '-hide_banner', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{size[0]}x{size[1]}", '-r', f"{fps}",
+                   '-i', 'pipe:0']
+        if audio_source:
+            command += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?', '-c:a', 'aac', '-shortest']
+        command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', codec]
+        if codec.startswith('libx26'):
+            command += ['-preset', preset, '-crf', str(crf)]
+        command += ['-pix_fmt', 'yuv420p', '-movflags', '+faststart', output_path]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.PIPE)
+        self._stderr = _Stderr(self._process, 'ffmpeg-encode-stderr')
+
+    def isOpened(self):
+        return self._process is not None and self._process.poll() is None
+
+    def write(self, frame):
+        """
+        Write one BGR frame of the writer's size.
+
+        Raises:
+            RuntimeError: If ffmpeg has stopped, with its error output.
+        """
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, ValueError) as e:
+            raise RuntimeError(f"ffmpeg stopped encoding '{self.output_path}': {self._close()}") from e
+
+    def release(self):
+        """
+        Finish the file.
+
+        Raises:
+            RuntimeError: If ffmpeg failed, with its error output.
+        """
+        if self._process is None:
+            return
+        errors = self._close()
+        if errors is not None:
+            raise RuntimeError(f"ffmpeg failed to encode '{self.output_path}': {errors}")
+
+    def _close(self):
+        # Returns the error output if ffmpeg failed, None otherwise
+        process, self._process = self._process, None
+        if process is None:
+            return None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+        errors = self._stderr.text()
+        if process.returncode != 0:
+            logging.error(f"ffmpeg failed to encode '{self.output_path}': {errors}")
+            return errors or f"exit code {process.returncode}"
+        return None
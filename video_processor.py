@@ -1,47 +1,33 @@
 # video_processor.py
 
-import os
 import yt_dlp
 import logging
-from pose_detection import process_video
+import cv2
+from segments import process_segments, local_source
 
-def process_video_segment(video_url, start_time, end_time, position_name, db_config, config):
-    """
-    Downloads a segment of a YouTube video and processes it.
-
-    Args:
-        video_url (str): The URL of the YouTube video.
-        start_time (float): Start time of the segment in seconds.
-        end_time (float): End time of the segment in seconds.
-        position_name (str): Name of the BJJ position or technique.
-        db_config (dict): Database configuration parameters.
-        config (dict): Additional configuration parameters.
-
-    Returns:
-        str: Path to the processed output video.
-    """
-    try:
-        downloads_dir = 'downloads'
-        os.makedirs(downloads_dir, exist_ok=True)
-        output_filename = f"temp_video_{os.getpid()}.mp4"
-        video_filepath = os.path.join(downloads_dir, output_filename)
+# Configure yt_dlp logger to use the application's logger
+class YTLogger(object):
+    def debug(self, msg):
+        logging.debug(msg)
 
-        # Configure yt_dlp logger to use the application's logger
-        class YTLogger(object):
-            def debug(self, msg):
-                logging.debug(msg)
+    def info(self, msg):
+        logging.info(msg)
 
-            def info(self, msg):
-                logging.info(msg)
+    def warning(self, msg):
+        logging.warning(msg)
 
-            def warning(self, msg):
-                logging.warning(msg)
+    def error(self, msg):
+        logging.error(msg)
 
-            def error(self, msg):
-                logging.error(msg)
+class YtDlpDownloader:
+    """
+    Downloads a time range of an online video with yt-dlp.
+    """
+    video_format = 'bestvideo+bestaudio/best'
 
+    def download(self, video_url, start_time, end_time, video_filepath):
         ydl_opts = {
-            'format': 'bestvideo+bestaudio/best',
+            'format': self.video_format,
             'outtmpl': video_filepath,
             'download_sections': [  # Correctly use a list
                 {
@@ -58,31 +44,95 @@ def process_video_segment(video_url, start_time, end_time, position_name, db_con
             logging.info(f"Downloading video segment from {video_url}")
             ydl.download([video_url])
 
-        # Verify that the video was downloaded
-        if not os.path.exists(video_filepath) or os.path.getsize(video_filepath) == 0:
-            logging.error(f"Failed to download video segment from {video_url}")
-            raise FileNotFoundError(f"Downloaded video file is missing or empty: {video_filepath}")
-
-        # Define output path
-        outputs_dir = 'outputs'
-        os.makedirs(outputs_dir, exist_ok=True)
-        output_filename = f"processed_{os.path.basename(video_filepath)}"
-        output_path = os.path.join(outputs_dir, output_filename)
-
-        # Process the video segment
-        process_video(
-            video_path=video_filepath,
-            output_path=output_path,
-            db_config=db_config,
-            config=config,
-            position_name=position_name
+class LocalDownloader:
+    """
+    Stand-in for yt-dlp that cuts the time range out of a local video file.
+
+    Lets the download stage run offline. The video URL may be a file:// URL,
+    a path, or the name of a file in video_dir; only files in video_dir are read.
+    """
+    video_format = 'local'
+
+    def __init__(self, video_dir='uploads'):
+        self.video_dir = video_dir
+
+    def resolve(self, video_url):
+        path = local_source(video_url, [self.video_dir])
+        if path is None:
+            raise FileNotFoundError(f"No local video for {video_url}")
+        return path
+
+    def download(self, video_url, start_time, end_time, video_filepath):
+        source_path = self.resolve(video_url)
+        logging.info(f"Copying video segment from local file {source_path}")
+        cap = cv2.VideoCapture(source_path)
+        if not cap.isOpened():
+            raise FileNotFoundError(f"Cannot open video file: {source_path}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        start_frame = int(round(start_time * fps))
+        end_frame = int(round(end_time * fps))
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        out = cv2.VideoWriter(
+            video_filepath,
+            cv2.VideoWriter_fourcc(*'mp4v'),
+            fps,
+            (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
         )
+        for _ in range(end_frame - start_frame):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        out.release()
+        cap.release()
 
-        # Clean up temporary files
-        if os.path.exists(video_filepath):
-            os.remove(video_filepath)
+def get_downloader(config):
+    """
+    Create the downloader selected by the 'downloader' setting (yt_dlp or local).
+    """
+    name = config.get('downloader', 'yt_dlp')
+    if name == 'yt_dlp':
+        return YtDlpDownloader()
+    if name == 'local':
+        return LocalDownloader(config.get('local_video_dir', 'uploads'))
+    raise ValueError(f"Unknown downloader: {name}")
 
-        return output_path
+def process_video_segment(video_url, start_time, end_time, position_name, db_config, config, progress_callback=None,
+                          downloader=None):
+    """
+    Processes a segment of a YouTube video or of a local video file.
+
+    A local file (in uploads or local_video_dir) is read in place, from the
+    keyframe before the segment; anything else is downloaded first. Results are
+    cached by source, time range and processing settings, so a segment that was
+    processed before is neither downloaded nor processed again. Several segments
+    of one source are best passed to segments.process_segments() together.
+
+    Args:
+        video_url (str): The URL of the YouTube video, or a local path or file:// URL.
+        start_time (float): Start time of the segment in seconds.
+        end_time (float): End time of the segment in seconds.
+        position_name (str): Name of the BJJ position or technique.
+        db_config (dict): Database configuration parameters.
+        config (dict): Additional configuration parameters.
+        progress_callback (callable): Optional, called as progress_callback(frames_done, total_frames).
+        downloader: Optional object with a download(video_url, start_time, end_time, path)
+            method. Defaults to the one selected in the configuration.
+
+    Returns:
+        tuple: Path to the processed output video (None in landmarks_only mode)
+        and id of the stored video row.
+    """
+    try:
+        downloader = downloader or get_downloader(config)
+        return process_segments(
+            video_url,
+            [(start_time, end_time, position_name)],
+            db_config,
+            config,
+            progress_callback=progress_callback,
+            downloader=downloader
+        )[0]
     except Exception as e:
         logging.exception("An error occurred during video segment processing.")
         raise e